@@ -0,0 +1,78 @@
+import time
+
+import compression
+import merkle
+import protocol
+
+# Small files travel many to a frame. The frame meta lists [relative path,
+# size, digest] for each file and the payload is their bytes back to back, so the
+# listener pays one request, one reply and one makedirs per directory for the
+# whole batch instead of per file.
+
+MAX_FILE_SIZE = 256 * 1024
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+MAX_BATCH_FILES = 1024
+# A batch is sent once its first file has waited this long, full or not
+MAX_BATCH_DELAY = 0.05
+
+
+class Batch:
+    def __init__(self, max_bytes=MAX_BATCH_BYTES):
+        self.max_bytes = max_bytes
+        self.items = []
+        self.size = 0
+        self.started = None
+
+    def add(self, item):
+        if not self.items:
+            self.started = time.monotonic()
+        self.items.append(item)
+        self.size += item.size
+
+    def time_left(self):
+        # Seconds until the batch is due to go out, or None while it is empty
+        if not self.items:
+            return None
+        return max(0.0, self.started + MAX_BATCH_DELAY - time.monotonic())
+
+    def full(self):
+        return (self.size >= self.max_bytes or len(self.items) >= MAX_BATCH_FILES
+                or time.monotonic() - self.started >= MAX_BATCH_DELAY)
+
+    def read(self):
+        # Returns (items, entries, payload, errors). Files are read whole and
+        # sent with the digest they were hashed to, so a file that changed
+        # since is refused by the listener; unreadable files are left out and
+        # listed in errors.
+        items = []
+        entries = []
+        parts = []
+        errors = []
+        for item in self.items:
+            try:
+                with open(item.file_path, 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                errors.append((item, e))
+                continue
+            items.append(item)
+            entries.append([merkle.normalize(item.relative_path), len(data), item.digest])
+            parts.append(data)
+        return items, entries, b''.join(parts), errors
+
+
+def compress_payload(payload, codec, stats=None, chunk_size=protocol.CHUNK_SIZE):
+    # Independently compressed chunks, or None when the batch does not shrink enough
+    compress = compression.compress_function(codec)
+    started = time.thread_time()
+    chunks = [compress(payload[i:i + chunk_size]) for i in range(0, len(payload), chunk_size)]
+    cpu = time.thread_time() - started
+    size = sum(len(chunk) for chunk in chunks)
+    if size > len(payload) * compression.MAX_RATIO:
+        if stats is not None:
+            stats.skip()
+        return None
+    if stats is not None:
+        stats.add(len(payload), size, cpu)
+    return chunks
+
@@ -0,0 +1,394 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import compression
+import hashing
+import protocol
+from hashing import HashEngine
+from listener import RECEIVE_MODES, ListenerServer
+from sync_engine import create_sync
+
+# Reproducible sync benchmark. A synthetic Unreal project is generated from a
+# seed, a listener is started in this process on loopback, and the same sync
+# the main application runs is driven headlessly through four scenarios:
+#
+#   cold         empty destination, everything is sent
+#   noop         nothing changed, only checksums are compared
+#   small_delta  a fraction of the config, code and asset files rewritten
+#   large_delta  a few small regions of each large .umap/.pak file rewritten
+#
+# Results are written as JSON so runs can be compared between versions with
+# --baseline.
+
+HOST = '127.0.0.1'
+BLOCK_SIZE = 1024 * 1024
+
+# Project shapes. Sizes are in bytes; asset sizes are drawn log-uniformly
+# between the two bounds so most assets are small and a few are large.
+PROFILES = {
+    'smoke': {'config_files': 200, 'code_files': 100, 'assets': 100,
+              'asset_size': (16 * 1024, 1024 * 1024), 'large_files': 1, 'large_size': 96 * 1024 * 1024},
+    'standard': {'config_files': 2000, 'code_files': 800, 'assets': 1000,
+                 'asset_size': (64 * 1024, 8 * 1024 * 1024), 'large_files': 2, 'large_size': 512 * 1024 * 1024},
+    'full': {'config_files': 5000, 'code_files': 2000, 'assets': 4000,
+             'asset_size': (64 * 1024, 32 * 1024 * 1024), 'large_files': 3, 'large_size': 4 * 1024 * 1024 * 1024},
+}
+
+SCENARIOS = ('cold', 'noop', 'small_delta', 'large_delta')
+
+CONFIG_FOLDERS = ['Config', 'Config/Windows', 'Config/Linux', 'Config/Localization']
+CONTENT_FOLDERS = ['Characters', 'Environment', 'Props', 'FX', 'UI', 'Audio', 'Materials', 'Blueprints']
+
+
+def binary_block(rng, size):
+    # Half noise, half repeated structure, so asset data compresses to
+    # roughly the ratio cooked Unreal packages do
+    noise = size // 2
+    return rng.randbytes(noise) + (b'\x00\x01UE\xc1\x83*\x9e' * (size // 16 + 1))[:size - noise]
+
+
+def text_block(rng, size):
+    lines = []
+    length = 0
+    while length < size:
+        line = f'{rng.choice(["+", "", "-"])}Key{rng.randrange(10000)}=Value{rng.getrandbits(48):x}\n'
+        lines.append(line)
+        length += len(line)
+    return ''.join(lines)[:size].encode('ascii')
+
+
+def write_binary(path, size, rng):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining:
+            block = min(BLOCK_SIZE, remaining)
+            f.write(binary_block(rng, block))
+            remaining -= block
+
+
+def write_text(path, size, rng):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(text_block(rng, size))
+
+
+def log_uniform(rng, low, high):
+    return int(round(low * (high / low) ** rng.random()))
+
+
+def generate_project(root, shape, seed):
+    # Returns {'small': [...], 'large': [...]} relative paths plus totals. The
+    # same shape and seed always produce the same tree.
+    rng = random.Random(seed)
+    small = []
+    large = []
+    total = 0
+
+    def add_text(relative_path, size):
+        nonlocal total
+        write_text(os.path.join(root, relative_path), size, rng)
+        small.append(relative_path)
+        total += size
+
+    add_text('Benchmark.uproject', 600)
+    plugins = [f'Plugin{i}' for i in range(max(1, shape['config_files'] // 200))]
+    for plugin in plugins:
+        add_text(f'Plugins/{plugin}/{plugin}.uplugin', 400)
+    for i in range(shape['config_files']):
+        folder = rng.choice(CONFIG_FOLDERS + [f'Plugins/{plugin}/Config' for plugin in plugins])
+        add_text(f'{folder}/Default{i}.ini', log_uniform(rng, 200, 4096))
+    for i in range(shape['code_files']):
+        module = f'Module{i % 8}'
+        extension = '.h' if i % 2 else '.cpp'
+        folder = 'Public' if extension == '.h' else 'Private'
+        add_text(f'Source/{module}/{folder}/File{i}{extension}', log_uniform(rng, 1024, 64 * 1024))
+    for i in range(shape['assets']):
+        relative_path = f'Content/{rng.choice(CONTENT_FOLDERS)}/Group{i % 32}/Asset{i}.uasset'
+        size = log_uniform(rng, *shape['asset_size'])
+        write_binary(os.path.join(root, relative_path), size, rng)
+        small.append(relative_path)
+        total += size
+    for i in range(shape['large_files']):
+        relative_path = f'Content/Maps/Level{i}.umap' if i % 2 == 0 else f'Content/Paks/Chunk{i}.pak'
+        write_binary(os.path.join(root, relative_path), shape['large_size'], rng)
+        large.append(relative_path)
+        total += shape['large_size']
+    return {'small': small, 'large': large, 'files': len(small) + len(large), 'bytes': total}
+
+
+def touch(path, stat):
+    # Make sure the change is visible to stat even on coarse timestamps
+    os.utime(path, ns=(stat.st_atime_ns, max(time.time_ns(), stat.st_mtime_ns + 1_000_000_000)))
+
+
+def change_small_files(root, project, ratio, rng):
+    # Rewrite `ratio` of the small files with new content of the same size
+    count = max(1, round(len(project['small']) * ratio))
+    changed = 0
+    for relative_path in rng.sample(project['small'], count):
+        path = os.path.join(root, relative_path)
+        stat = os.stat(path)
+        if relative_path.endswith('.uasset'):
+            write_binary(path, stat.st_size, rng)
+        else:
+            write_text(path, stat.st_size, rng)
+        touch(path, stat)
+        changed += stat.st_size
+    return {'files': count, 'bytes': changed}
+
+
+def change_large_files(root, project, change_bytes, rng, regions=4):
+    # Overwrite a few scattered regions of every large file in place
+    changed = 0
+    region = max(1, change_bytes // regions)
+    for relative_path in project['large']:
+        path = os.path.join(root, relative_path)
+        stat = os.stat(path)
+        with open(path, 'r+b') as f:
+            for _ in range(regions):
+                size = min(region, stat.st_size)
+                f.seek(rng.randrange(stat.st_size - size + 1))
+                f.write(rng.randbytes(size))
+                changed += size
+        touch(path, stat)
+    return {'files': len(project['large']), 'bytes': changed}
+
+
+def peak_rss():
+    # Peak resident set size of this process in bytes, where the platform
+    # reports it. /proc gives a high-water mark that reset_peak_rss can clear.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def start_listener(cache_dir, receive_mode):
+    server = ListenerServer(HOST, 0, cache_dir=cache_dir, receive_mode=receive_mode)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if not server.ready.wait(10):
+        raise RuntimeError('Listener did not start')
+    return server
+
+
+def run_scenario(name, server, hash_engine, source, destination, options, log):
+    per_scenario_peak = reset_peak_rss()
+    server.metrics.reset()
+    with server.connections_lock:
+        connections = server.connections
+        server.peak_connections = server.active_connections
+    pipeline = create_sync([HOST], source, destination, hash_engine, port=server.port, log=log, **options)
+    summary = pipeline.run()
+    with server.connections_lock:
+        connections = server.connections - connections
+        peak_connections = server.peak_connections
+    seconds = summary['seconds']
+    return {
+        'seconds': seconds,
+        'launchable_seconds': summary['launchable_seconds'],
+        'files': summary['files'],
+        'hashed': summary['hashed'],
+        'sent': summary['sent'],
+        'failed': summary['failed'],
+        'sent_bytes': summary['sent_bytes'],
+        'wire_bytes': summary['wire_bytes'],
+        'delta_files': summary['delta_files'],
+        'delta_saved': summary['delta_saved'],
+        'batches': summary['batches'],
+        'files_per_second': summary['files'] / seconds if seconds else None,
+        'sent_bytes_per_second': summary['sent_bytes'] / seconds if seconds else None,
+        'wire_bytes_per_second': summary['wire_bytes'] / seconds if seconds else None,
+        # Sender and listener share this process, so this covers both
+        'peak_rss': peak_rss(),
+        'peak_rss_scope': 'scenario' if per_scenario_peak else 'process',
+        'connections': connections,
+        'peak_connections': peak_connections,
+        'utilization': summary['utilization'],
+        'metrics': summary['metrics'],
+        'listener_metrics': summary['listener'],
+        'errors': summary['errors'],
+    }
+
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    # One line per scenario with the change in wall time against a previous
+    # run; returns the scenarios that slowed down by more than `threshold`
+    lines = []
+    regressions = []
+    for name, result in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before or not before.get('seconds'):
+            lines.append(f'{name:12} {result["seconds"]:8.2f}s  (no baseline)')
+            continue
+        change = result['seconds'] / before['seconds'] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        lines.append(f'{name:12} {result["seconds"]:8.2f}s  vs {before["seconds"]:8.2f}s  {change:+.0%}{flag}')
+    return lines, regressions
+
+
+def run_benchmark(args):
+    shape = dict(PROFILES[args.profile])
+    if args.large_size_mb is not None:
+        shape['large_size'] = args.large_size_mb * 1024 * 1024
+    if args.large_files is not None:
+        shape['large_files'] = args.large_files
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='sync-benchmark-')
+    source = os.path.join(workdir, 'project')
+    destination = os.path.join(workdir, 'listener')
+    cache_dir = os.path.join(workdir, 'manifests')
+    for path in (source, destination, cache_dir):
+        shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(destination)
+
+    def progress(message):
+        print(message, file=sys.stderr, flush=True)
+
+    log = progress if args.verbose else (lambda message: None)
+    codecs = {'off': [], 'auto': compression.available_codecs()}.get(args.compression, [args.compression])
+    options = {
+        'algorithms': hashing.available_algorithms() if args.algorithm == 'auto' else [args.algorithm],
+        'transfer_workers': args.workers,
+        'codecs': codecs,
+        'zero_copy': not args.no_zero_copy,
+        'cache_dir': cache_dir,
+    }
+    results = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'revision': revision(),
+        'protocol_version': protocol.PROTOCOL_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'profile': args.profile,
+        'seed': args.seed,
+        'settings': {
+            'shape': shape,
+            'change_ratio': args.change_ratio,
+            'large_change_bytes': args.large_change_mb * 1024 * 1024,
+            'workers': args.workers,
+            'algorithm': args.algorithm,
+            'compression': codecs,
+            'zero_copy': options['zero_copy'],
+            'receive_mode': args.receive_mode,
+        },
+        'scenarios': {},
+    }
+
+    try:
+        progress(f'Generating {args.profile} project in {source}')
+        started = time.perf_counter()
+        project = generate_project(source, shape, args.seed)
+        results['project'] = {'files': project['files'], 'bytes': project['bytes'],
+                              'generate_seconds': time.perf_counter() - started}
+        progress(f'Generated {project["files"]} files ({project["bytes"] / 1e9:.2f} GB)')
+
+        rng = random.Random(args.seed + 1)
+        with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+            # The listener reports every file it writes on stdout
+            server = start_listener(cache_dir, args.receive_mode)
+            hash_engine = HashEngine()
+            for name in SCENARIOS:
+                changes = None
+                if name == 'small_delta':
+                    changes = change_small_files(source, project, args.change_ratio, rng)
+                elif name == 'large_delta':
+                    if not project['large']:
+                        continue
+                    changes = change_large_files(source, project, args.large_change_mb * 1024 * 1024, rng)
+                result = run_scenario(name, server, hash_engine, source, destination, options, log)
+                if changes:
+                    result['changed'] = changes
+                results['scenarios'][name] = result
+                progress(f'{name}: {result["seconds"]:.2f}s, {result["sent"]} files sent, '
+                         f'{result["wire_bytes"] / 1e6:.1f} MB on the wire')
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark syncing a synthetic Unreal project over loopback')
+    parser.add_argument('--profile', choices=PROFILES, default='standard')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--large-files', type=int, default=None, help='Override the number of large .umap/.pak files')
+    parser.add_argument('--large-size-mb', type=int, default=None, help='Override the size of each large file')
+    parser.add_argument('--change-ratio', type=float, default=0.05,
+                        help='Fraction of small files rewritten for the small_delta scenario')
+    parser.add_argument('--large-change-mb', type=int, default=4,
+                        help='Bytes rewritten in each large file for the large_delta scenario')
+    parser.add_argument('--workers', type=int, default=4, help='Transfer workers')
+    parser.add_argument('--algorithm', default='auto', choices=['auto'] + hashing.available_algorithms())
+    parser.add_argument('--compression', default='off', choices=['off', 'auto'] + compression.available_codecs())
+    parser.add_argument('--no-zero-copy', action='store_true', help='Send files through Python buffers')
+    parser.add_argument('--receive-mode', default='mapped', choices=RECEIVE_MODES)
+    parser.add_argument('--workdir', default=None, help='Where the project is generated (kept afterwards)')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary working directory')
+    parser.add_argument('--output', default=None, help='Write the JSON results here instead of stdout')
+    parser.add_argument('--baseline', default=None, help='Earlier results to compare wall times against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Slowdown against the baseline reported as a regression (default 0.1 = 10%%)')
+    parser.add_argument('--verbose', action='store_true', help='Show the sync log')
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline, args.threshold)
+        print('\n'.join(lines), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+import argparse
+import os
+import signal
+import sys
+
+# Command-line entry point for build machines and scripts, without the GUI:
+#
+#   python cli.py sync   --listeners 10.0.0.5,10.0.0.6 --project C:\Proj\Proj.uproject --listener-project D:\Proj\Proj.uproject
+#   python cli.py verify (same arguments)   exit status 1 if any file differs
+#   python cli.py sync   (same arguments) --launch --editor C:\UE_5.4\...\UnrealEditor.exe --server
+#   python cli.py launch --editor C:\UE_5.4\...\UnrealEditor.exe --project C:\Proj\Proj.uproject --server
+#   python cli.py stats  --listeners 10.0.0.5
+#
+# Only argparse and a few builtins are imported up front. Each command imports the
+# engine modules it needs when it runs, so --help and argument errors return
+# at once, and no command ever loads PyQt6.
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_CANCELLED = 130
+
+
+def project_folder(path):
+    # Accept either a .uproject file or the folder that holds it
+    return os.path.dirname(path) if path.lower().endswith('.uproject') else path
+
+
+def listener_list(value):
+    ips = [ip.strip() for ip in value.split(',') if ip.strip()]
+    if not ips:
+        raise argparse.ArgumentTypeError('at least one listener address is required')
+    return ips
+
+
+def add_listener_arguments(parser):
+    parser.add_argument('--listeners', type=listener_list, required=True,
+                        help='Listener address, or a comma-separated list of them')
+    parser.add_argument('--port', type=int, default=None, help='Listener port (default 65432)')
+
+
+def add_sync_arguments(parser):
+    add_listener_arguments(parser)
+    parser.add_argument('--project', required=True, help='Editor .uproject file or project folder')
+    parser.add_argument('--listener-project', required=True,
+                        help='.uproject file or project folder on the listeners')
+    parser.add_argument('--algorithm', default='auto', help='Checksum algorithm: auto, xxh3_128, blake2b or md5')
+    parser.add_argument('--force-rehash', action='store_true', help='Ignore checksum caches on both ends')
+    parser.add_argument('--workers', type=int, default=4, help='Transfer workers per listener')
+    parser.add_argument('--queue-depth', type=int, default=256, help='Files queued between pipeline stages')
+    parser.add_argument('--report-dir', default=None,
+                        help='Where the JSON report goes (default ~/.simpleUnrealSwitchboard/reports)')
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON on stdout')
+    parser.add_argument('--quiet', action='store_true', help='Only print the outcome')
+
+
+def interrupt_cancels(cancel, log):
+    # The first Ctrl-C stops the sync cleanly; a second one exits at once
+    def handler(signum, frame):
+        log('Cancelling sync...')
+        cancel.set()
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, handler)
+
+
+def make_log(args):
+    if args.quiet:
+        return lambda message: None
+    # One write per line so lines from parallel nodes do not interleave
+    return lambda message: sys.stderr.write(f'{message}\n')
+
+
+def sync_settings(args, dry_run):
+    import compression
+    import hashing
+    if args.algorithm != 'auto' and args.algorithm not in hashing.available_algorithms():
+        raise SystemExit(f'Checksum algorithm {args.algorithm} is not available here')
+    codecs = compression.codec_preference(getattr(args, 'compression', 'off'))
+    if any(codec not in compression.available_codecs() for codec in codecs):
+        raise SystemExit(f'Compression codec {args.compression} is not available here')
+    options = {
+        'algorithms': hashing.algorithm_preference(args.algorithm),
+        'force_rehash': args.force_rehash,
+        'transfer_workers': args.workers,
+        'queue_depth': args.queue_depth,
+        'codecs': codecs,
+        'dry_run': dry_run,
+    }
+    if args.port is not None:
+        options['port'] = args.port
+    if not dry_run:
+        options.update(
+            delta_threshold=args.delta_threshold_mb * 1024 * 1024,
+            batch_size=args.batch_size_kb * 1024,
+            content_order=args.content_order,
+            zero_copy=not args.no_zero_copy,
+        )
+    return options
+
+
+def command_sync(args, dry_run=False):
+    import json
+    import threading
+    from hashing import HashEngine
+    from instrumentation import Profiler
+    from sync_engine import outcome, run_sync
+
+    log = make_log(args)
+    options = sync_settings(args, dry_run)
+    launch = getattr(args, 'launch', False)
+    if launch and not args.listener_project.lower().endswith('.uproject'):
+        raise SystemExit('--launch needs --listener-project to be a .uproject file')
+    cancel = threading.Event()
+    interrupt_cancels(cancel, log)
+    options.update(
+        max_nodes=getattr(args, 'max_nodes', 4),
+        bandwidth=getattr(args, 'bandwidth_mb', 0) * 1024 * 1024,
+        report_dir=args.report_dir,
+        profiler=Profiler() if getattr(args, 'profile', False) else None,
+        cancel=cancel,
+        log=log,
+    )
+    if launch:
+        from orchestrator import SyncAndLaunch
+        if args.server:
+            import launcher
+            try:
+                launcher.start_server(args.editor, args.server_name, capture_output=False)
+            except OSError as e:
+                print(f'Error: {e}', file=sys.stderr)
+                return EXIT_FAILED
+        summary, report = SyncAndLaunch(
+            args.listeners, project_folder(args.project), args.listener_project, HashEngine(),
+            args.listener_editor or args.editor, args.server_name, args.session,
+            session_timeout=args.session_timeout, **options,
+        ).run()
+    else:
+        summary, report = run_sync(
+            args.listeners, project_folder(args.project), project_folder(args.listener_project), HashEngine(),
+            **options,
+        )
+
+    if dry_run:
+        differences = summary_differences(args.listeners, summary)
+        if args.json:
+            print(json.dumps(dict(summary, differences=differences), indent=2, default=str))
+        else:
+            for ip, files in differences.items():
+                for entry in files:
+                    print(f'{ip}\t{entry["state"]}\t{entry["path"]}')
+        total = sum(len(files) for files in differences.values())
+        print(f'{total} files differ' if total else 'All listeners match', file=sys.stderr)
+    else:
+        if args.json:
+            print(json.dumps(dict(summary, launch=report['launch']) if launch else summary, indent=2, default=str))
+        print(outcome(summary), file=sys.stderr)
+
+    if summary.get('cancelled'):
+        return EXIT_CANCELLED
+    if summary['errors'] or summary['failed'] or (dry_run and total):
+        return EXIT_FAILED
+    if launch and report['launch']['joined'] < len(report['launch']['nodes']):
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+def summary_differences(listener_ips, summary):
+    # {listener: [differences]} for single-listener and fan-out summaries alike
+    if 'nodes' not in summary:
+        return {listener_ips[0]: summary.get('differences', [])}
+    return {ip: result.get('differences', []) for ip, result in summary['nodes'].items()}
+
+
+def command_launch(args):
+    import launcher
+    processes = []
+    try:
+        if args.server:
+            print(f'Starting Multi-User server {args.server_name}', file=sys.stderr)
+            processes.append(launcher.start_server(args.editor, args.server_name, capture_output=False))
+        if not args.no_editor:
+            print(f'Launching {args.project} into session {args.session}', file=sys.stderr)
+            processes.append(launcher.launch_editor(args.editor, args.project, args.server_name, args.session,
+                                                    args.display_name))
+    except (OSError, ValueError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return EXIT_FAILED
+    if args.wait:
+        for process in processes:
+            process.wait()
+    return EXIT_OK
+
+
+def command_stats(args):
+    import json
+    import instrumentation
+    import protocol
+    from client import ListenerSession
+
+    status = EXIT_OK
+    results = {}
+    for ip in args.listeners:
+        try:
+            with ListenerSession(ip, args.port or protocol.DEFAULT_PORT, timeout=args.timeout) as session:
+                results[ip] = session.stats(args.reset)
+        except Exception as e:
+            results[ip] = {'error': str(e)}
+            status = EXIT_FAILED
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return status
+    for ip, stats in results.items():
+        if 'error' in stats:
+            print(f'{ip}: {stats["error"]}')
+            continue
+        connections = stats['connections']
+        print(f'{ip}: up {stats["uptime"]:.0f}s, {connections["active"]} sessions open '
+              f'({connections["total"]} total, peak {connections["peak"]}), receive mode {stats["receive_mode"]}')
+        for line in instrumentation.describe(stats):
+            print(f'  {line}')
+    return status
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='Sync and launch Unreal projects without the GUI')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    sync = commands.add_parser('sync', help='Push changed files to the listeners')
+    add_sync_arguments(sync)
+    sync.add_argument('--compression', default='off', help='off, auto, or a codec (zlib, lzma, zstd)')
+    sync.add_argument('--delta-threshold-mb', type=int, default=64,
+                      help='Files at least this large are sent as block deltas (0 disables)')
+    sync.add_argument('--batch-size-kb', type=int, default=4096, help='Small-file batch size (0 disables)')
+    sync.add_argument('--content-order', choices=['size', 'recent'], default='size')
+    sync.add_argument('--max-nodes', type=int, default=4, help='Listeners synced at the same time')
+    sync.add_argument('--bandwidth-mb', type=int, default=0, help='Total outbound cap in MB/s (0 is unlimited)')
+    sync.add_argument('--no-zero-copy', action='store_true', help='Send files through Python buffers')
+    sync.add_argument('--profile', action='store_true', help='Save a cProfile capture next to the report')
+    sync.add_argument('--launch', action='store_true',
+                      help='Open the project on each listener as soon as its sync is done')
+    sync.add_argument('--editor', default='', help='Path to UnrealEditor.exe on this machine')
+    sync.add_argument('--listener-editor', default='',
+                      help='Path to UnrealEditor.exe on the listeners (default: same as --editor)')
+    sync.add_argument('--server', action='store_true', help='Start the Multi-User server here while syncing')
+    sync.add_argument('--server-name', default='unrealMUS', help='Multi-User server name')
+    sync.add_argument('--session', default='Session_1', help='Multi-User session to join')
+    sync.add_argument('--session-timeout', type=float, default=600,
+                      help='Seconds to wait for launched editors to join the session')
+    sync.set_defaults(handler=command_sync)
+
+    verify = commands.add_parser('verify', help='Compare the listeners against the project without sending')
+    add_sync_arguments(verify)
+    verify.set_defaults(handler=lambda args: command_sync(args, dry_run=True))
+
+    launch = commands.add_parser('launch', help='Start the Multi-User server and/or a local editor in the session')
+    launch.add_argument('--editor', required=True, help='Path to UnrealEditor.exe')
+    launch.add_argument('--project', default='', help='.uproject to open')
+    launch.add_argument('--server', action='store_true', help='Start the Multi-User server first')
+    launch.add_argument('--no-editor', action='store_true', help='Only start the server')
+    launch.add_argument('--server-name', default='unrealMUS', help='Multi-User server name')
+    launch.add_argument('--session', default='Session_1', help='Multi-User session to join')
+    launch.add_argument('--display-name', default='Editor_1', help='Name the editor shows in the session')
+    launch.add_argument('--wait', action='store_true', help='Wait for the started processes to exit')
+    launch.set_defaults(handler=command_launch)
+
+    stats = commands.add_parser('stats', help="Show the listeners' timings, rates and latency histograms")
+    add_listener_arguments(stats)
+    stats.add_argument('--reset', action='store_true', help='Start the counters over after reading them')
+    stats.add_argument('--timeout', type=float, default=10, help='Connection timeout in seconds')
+    stats.add_argument('--json', action='store_true', help='Print the raw stats as JSON')
+    stats.set_defaults(handler=command_stats)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
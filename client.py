@@ -0,0 +1,406 @@
+import itertools
+import socket
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import hashing
+import protocol
+
+Reply = namedtuple('Reply', ['frame', 'payload'])
+
+# Longest wait for the answer to a request the listener can serve at once,
+# such as hello; slow requests pass their own limit to wait()
+REPLY_TIMEOUT = 30
+# Replies that follow work on a whole file (writing, copying or hashing it)
+# get extra time as if the listener's disk managed only this rate
+SLOW_DISK_RATE = 20 * 1024 * 1024
+# Longest wait for requests that hash a whole folder; a cold listener can
+# take many minutes
+FOLDER_TIMEOUT = 30 * 60
+# How often a wait for a reply checks for a cancel
+CANCEL_POLL = 0.2
+# TCP keepalive, so a listener host that vanishes fails its session within
+# about a minute instead of leaving it waiting forever
+KEEPALIVE_IDLE = 30
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+
+class ListenerError(Exception):
+    pass
+
+
+# The request never got an answer because the session went away
+class SessionLost(ListenerError):
+    pass
+
+
+# The listener kept the connection open but did not answer in time
+class ReplyTimeout(ListenerError):
+    pass
+
+
+# Token bucket shared by every session that should count against one outbound
+# bandwidth cap. consume() blocks until the bytes fit under the rate.
+class Throttle:
+    def __init__(self, bytes_per_second, burst=None):
+        self.rate = bytes_per_second
+        self.capacity = burst or max(bytes_per_second / 4, 1024 * 1024)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, size):
+        while size > 0:
+            take = min(size, self.capacity)
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                self.tokens -= take
+                wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            if wait:
+                time.sleep(wait)
+            size -= take
+
+
+class ThrottledSocket:
+    def __init__(self, sock, throttle):
+        self.sock = sock
+        self.throttle = throttle
+
+    def sendall(self, data):
+        self.throttle.consume(len(data))
+        self.sock.sendall(data)
+
+    def sendfile(self, file, offset=0, count=None):
+        return sendfile_slices(self.sock, file, offset, count, self.throttle.consume)
+
+
+# Stops a send between chunks once `cancel` is set. The frame being written is
+# left incomplete, so the session has to be dropped; the listener keeps what
+# it received as a partial file to resume from.
+class CancellableSocket:
+    def __init__(self, sock, cancel):
+        self.sock = sock
+        self.cancel = cancel
+
+    def sendall(self, data):
+        self.check()
+        self.sock.sendall(data)
+
+    def sendfile(self, file, offset=0, count=None):
+        return sendfile_slices(self.sock, file, offset, count, lambda size: self.check())
+
+    def check(self):
+        if self.cancel.is_set():
+            raise protocol.Cancelled('Sync cancelled')
+
+
+# Counts the bytes handed to the socket, so a failed send can tell whether
+# any part of its frame went out. A write that fails part way counts in full.
+class CountingSocket:
+    def __init__(self, sock):
+        self.sock = sock
+        self.sent = 0
+
+    def sendall(self, data):
+        self.sent += len(data)
+        self.sock.sendall(data)
+
+    def sendfile(self, file, offset=0, count=None):
+        self.sent += count if count is not None else 1
+        return self.sock.sendfile(file, offset, count)
+
+
+def sendfile_slices(sock, file, offset, count, before):
+    # sendfile in CHUNK_SIZE slices, calling before(size) ahead of each one
+    # so wrappers can throttle or cancel a zero-copy send part way through
+    total = 0
+    while count is None or total < count:
+        size = protocol.CHUNK_SIZE if count is None else min(protocol.CHUNK_SIZE, count - total)
+        before(size)
+        sent = sock.sendfile(file, offset + total, size)
+        if not sent:
+            break
+        total += sent
+    return total
+
+
+# One long-lived connection to a listener. Requests are written in order from
+# any thread and tagged with a request id; a reader thread matches replies back
+# to the Future returned for each request, so callers can pipeline many
+# requests before waiting on any of them.
+class ListenerSession:
+    def __init__(self, host, port=protocol.DEFAULT_PORT, timeout=None, throttle=None, cancel=None,
+                 zero_copy=True):
+        self.host = host
+        self.port = port
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        enable_keepalive(self.sock)
+        self.sock.settimeout(None)
+        # Outgoing frames go through `out`, which applies the bandwidth cap and
+        # cancellation if any
+        self.out = ThrottledSocket(self.sock, throttle) if throttle else self.sock
+        self.cancel = cancel
+        if cancel is not None:
+            self.out = CancellableSocket(self.out, cancel)
+        self.out = CountingSocket(self.out)
+        self._ids = itertools.count(1)
+        self._send_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = {}
+        # Callbacks for the interim replies (FLAG_MORE) of streaming requests
+        self._updates = {}
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+        self.algorithm = hashing.DEFAULT_ALGORITHM
+        self.codec = None
+        # Raw file payloads go out with sendfile instead of through a buffer
+        self.zero_copy = zero_copy
+
+    def hello(self, algorithms=None, codecs=()):
+        # Agree on a checksum algorithm and compression codec both ends
+        # support, in our order of preference
+        offered = algorithms or hashing.available_algorithms()
+        reply = self.wait(self.request(protocol.CMD_HELLO, meta={'algorithms': offered, 'codecs': list(codecs)}))
+        self.algorithm = reply.frame.meta.get('algorithm', hashing.DEFAULT_ALGORITHM)
+        self.peer_algorithms = reply.frame.meta.get('algorithms', [self.algorithm])
+        self.codec = reply.frame.meta.get('codec')
+        return self.algorithm
+
+    def wait(self, future, timeout=REPLY_TIMEOUT):
+        # The reply to a request. A listener that accepted the connection but
+        # does not answer in time is dropped, which fails its other requests
+        # too. A cancel ends the wait early and drops the session as well,
+        # since nothing is left to read the reply.
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return future.result(max(0, min(CANCEL_POLL, deadline - time.monotonic())))
+            except FutureTimeout:
+                pass
+            if self.cancel is not None and self.cancel.is_set():
+                self.abort()
+                raise protocol.Cancelled('Sync cancelled')
+            if time.monotonic() >= deadline:
+                self.abort()
+                raise ReplyTimeout(f'{self.host} did not answer within {timeout:.0f}s')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _register(self, on_update=None):
+        future = Future()
+        with self._pending_lock:
+            if self._closed:
+                raise SessionLost(f'Session to {self.host} is closed')
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            if on_update is not None:
+                self._updates[request_id] = on_update
+        return request_id, future
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _send(self, request_id, future, send, *args, **kwargs):
+        # Write one frame with send(out, ..., request_id=...). A failure
+        # before any of it went out, such as a file that cannot be opened,
+        # only fails this request; once part of the frame is on the wire the
+        # session cannot carry anything more.
+        with self._send_lock:
+            written = self.out.sent
+            try:
+                send(self.out, *args, request_id=request_id, **kwargs)
+            except Exception as e:
+                self._fail(request_id, e, broken=self.out.sent != written)
+        return future
+
+    def request(self, command, path='', meta=None, payload=b'', on_update=None):
+        # on_update is called from the reader thread with each interim Reply
+        # before the future resolves with the final one
+        request_id, future = self._register(on_update)
+        return self._send(request_id, future, protocol.send_frame, command, path, meta, payload)
+
+    def send_file(self, file_path, dest_path, meta=None, offset=0):
+        # With an offset only the rest of the file is sent, to be appended to
+        # the listener's partial copy
+        if offset:
+            meta = dict(meta or {}, offset=offset)
+        request_id, future = self._register()
+        return self._send(request_id, future, protocol.send_file, protocol.CMD_SYNC_FILE, dest_path, file_path,
+                          meta, offset=offset, zero_copy=self.zero_copy)
+
+    def send_compressed(self, dest_path, chunks, meta=None):
+        request_id, future = self._register()
+        return self._send(request_id, future, protocol.send_chunked, protocol.CMD_SYNC_FILE, dest_path, chunks,
+                          dict(meta or {}, codec=self.codec), protocol.FLAG_COMPRESSED)
+
+    def send_batch(self, folder, entries, payload, chunks=None):
+        # Many small files in one frame; `chunks` replaces the payload with
+        # its compressed form when given
+        if chunks is None:
+            return self.request(protocol.CMD_SYNC_BATCH, folder, {'files': entries}, payload)
+        request_id, future = self._register()
+        return self._send(request_id, future, protocol.send_chunked, protocol.CMD_SYNC_BATCH, folder, chunks,
+                          {'files': entries, 'codec': self.codec}, protocol.FLAG_COMPRESSED)
+
+    def send_stream(self, command, dest_path, chunks, size, meta=None):
+        request_id, future = self._register()
+        return self._send(request_id, future, protocol.send_stream, command, dest_path, chunks, size, meta)
+
+    def resume_offset(self, dest_path, digest):
+        # How much of this exact content the listener already holds from an
+        # interrupted transfer
+        reply = self.wait(self.request(protocol.CMD_RESUME_OFFSET, dest_path, {'digest': digest}))
+        return reply.frame.meta.get('offset', 0)
+
+    def get_signatures(self, dest_path, block_size, size=0):
+        # The listener reads the whole `size` byte file to describe it
+        reply = self.wait(self.request(protocol.CMD_GET_SIGNATURES, dest_path, {'block_size': block_size}),
+                          reply_timeout(size))
+        return reply.payload
+
+    def request_checksums(self, folder, force=False):
+        meta = {'force': True} if force else None
+        return self.request(protocol.CMD_GET_CHECKSUMS, folder, meta)
+
+    def request_tree(self, folder, directories=('',), refresh=False, force=False):
+        # Nodes of the listener's checksum tree for `directories`. refresh
+        # makes the listener rescan the folder instead of reusing the tree it
+        # built earlier on this session.
+        meta = {'dirs': list(directories)}
+        if refresh:
+            meta['refresh'] = True
+        if force:
+            meta['force'] = True
+        return self.request(protocol.CMD_GET_TREE, folder, meta)
+
+    def find_content(self, folder, digests):
+        # Future resolving to the subset of `digests` the listener already
+        # holds somewhere under `folder`
+        return self.request(protocol.CMD_FIND_CONTENT, folder, payload=protocol.encode_json(list(digests)))
+
+    def materialize(self, dest_path, digest):
+        # Ask the listener to produce dest_path from content it already has
+        return self.request(protocol.CMD_MATERIALIZE, dest_path, {'digest': digest})
+
+    def stats(self, reset=False):
+        # The listener's per-phase counters, rates and latency histograms;
+        # reset starts them over after this snapshot
+        reply = self.wait(self.request(protocol.CMD_GET_STATS, meta={'reset': True} if reset else None))
+        return protocol.decode_json(reply.payload)
+
+    def launch_editor(self, editor_path, uproject_path, server_name, session_name, display_name=None,
+                      on_status=None):
+        # Have the listener open uproject_path in the Multi-User session.
+        # on_status gets the status dicts for 'started' and, once the editor
+        # has joined the session, 'ready'; the future resolves with the
+        # 'exited' status when the editor closes.
+        meta = {'editor_path': editor_path, 'server_name': server_name, 'session_name': session_name,
+                'display_name': display_name}
+        on_update = (lambda reply: on_status(reply.frame.meta)) if on_status is not None else None
+        return self.request(protocol.CMD_LAUNCH_EDITOR, uproject_path, meta, on_update=on_update)
+
+    def get_checksums(self, folder, force=False):
+        reply = self.wait(self.request_checksums(folder, force), FOLDER_TIMEOUT)
+        return protocol.decode_json(reply.payload), reply.frame.meta
+
+    def _fail(self, request_id, error, broken=True):
+        with self._pending_lock:
+            future = self._pending.pop(request_id, None)
+            self._updates.pop(request_id, None)
+            if broken:
+                self._closed = True
+        if future is not None and not future.done():
+            future.set_exception(error)
+        if not broken:
+            return
+        # A frame was cut off part way, so nothing more can follow it on this
+        # connection
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _read_replies(self):
+        error = SessionLost(f'Connection to {self.host} closed')
+        try:
+            while True:
+                frame = protocol.recv_frame(self.sock)
+                if frame is None:
+                    break
+                payload = protocol.recv_payload(self.sock, frame)
+                if frame.flags & protocol.FLAG_MORE:
+                    with self._pending_lock:
+                        on_update = self._updates.get(frame.request_id)
+                    if on_update is not None:
+                        on_update(Reply(frame, payload))
+                    continue
+                with self._pending_lock:
+                    future = self._pending.pop(frame.request_id, None)
+                    self._updates.pop(frame.request_id, None)
+                if future is None:
+                    continue
+                if frame.command == protocol.CMD_ERROR:
+                    future.set_exception(ListenerError(frame.meta.get('error', 'Unknown listener error')))
+                else:
+                    future.set_result(Reply(frame, payload))
+        except Exception as e:
+            if not self._closed:
+                error = SessionLost(f'Connection to {self.host} failed: {e}')
+        with self._pending_lock:
+            self._closed = True
+            pending, self._pending = self._pending, {}
+            self._updates = {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def abort(self):
+        # Drop the connection without waiting for outstanding replies
+        with self._pending_lock:
+            self._closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self, timeout=30):
+        # Half-close so the listener finishes the frames already sent and the
+        # reader can collect their replies before the socket goes away.
+        with self._pending_lock:
+            self._closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        self._reader.join(timeout)
+        self.sock.close()
+
+
+def enable_keepalive(sock):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # The timing options are not available on every platform
+    for name, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE), ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                        ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+        if hasattr(socket, name):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+            except OSError:
+                pass
+
+
+def reply_timeout(size):
+    # How long to wait for the answer to a request that makes the listener
+    # write, copy or read `size` bytes
+    return REPLY_TIMEOUT + size / SLOW_DISK_RATE
@@ -0,0 +1,175 @@
+import lzma
+import os
+import threading
+import time
+import zlib
+
+import protocol
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Optional per-file compression for the transfer path. Each file's first
+# SAMPLE_SIZE bytes are compressed as a trial, and the file goes out
+# uncompressed when the trial ratio is poor or the extension is known to
+# hold already-compressed data.
+
+SAMPLE_SIZE = 64 * 1024
+MIN_SIZE = 4 * 1024
+MAX_RATIO = 0.85
+
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.pak', '.utoc', '.ucas', '.zip', '.7z', '.gz', '.mp4', '.mov', '.mkv', '.webm', '.bk2',
+    '.png', '.jpg', '.jpeg', '.exr', '.dds', '.ktx', '.mp3', '.ogg', '.opus', '.wem', '.bnk',
+}
+
+
+# Every chunk on the wire is compressed independently from at most CHUNK_SIZE
+# input bytes, so the receiver never holds more than one chunk's worth of
+# output in memory whatever the codec's ratio.
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 1), zlib.decompress),
+    'lzma': (lambda data: lzma.compress(data, preset=1), lzma.decompress),
+}
+if zstandard is not None:
+    CODECS['zstd'] = (lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+                      lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+PREFERENCE = ['zstd', 'zlib', 'lzma']
+# What the codecs raise for data they cannot decompress
+DECOMPRESS_ERRORS = (zlib.error, lzma.LZMAError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def available_codecs():
+    return [name for name in PREFERENCE if name in CODECS]
+
+
+def codec_preference(choice='off'):
+    # Codecs to offer a peer for a user's setting, empty to send uncompressed
+    if choice == 'off':
+        return []
+    if choice == 'auto':
+        return available_codecs()
+    return [choice]
+
+
+def negotiate(offered, supported=None):
+    # First codec in the peer's preference list that we also support, if any
+    supported = supported or available_codecs()
+    for name in offered:
+        if name in supported:
+            return name
+    return None
+
+
+def compress_function(codec):
+    return CODECS[codec][0]
+
+
+def decompress_function(codec):
+    # Corrupt input raises ProtocolError rather than the codec's own error
+    try:
+        decompress = CODECS[codec][1]
+    except (KeyError, TypeError):
+        raise protocol.ProtocolError(f'Unsupported compression codec: {codec}')
+
+    def checked(data):
+        try:
+            return decompress(data)
+        except DECOMPRESS_ERRORS as e:
+            raise protocol.ProtocolError(f'Corrupt {codec} data: {e}') from None
+    return checked
+
+
+# Per-sync totals: bytes in and out, CPU seconds spent compressing, and files
+# that were skipped because the sample did not compress well enough.
+class CompressionStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+        self.remote_cpu_seconds = 0.0
+
+    def add(self, bytes_in, bytes_out, cpu_seconds):
+        with self.lock:
+            self.files += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.cpu_seconds += cpu_seconds
+
+    def skip(self):
+        with self.lock:
+            self.skipped += 1
+
+    def add_remote(self, cpu_seconds):
+        with self.lock:
+            self.remote_cpu_seconds += cpu_seconds
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'files': self.files,
+                'skipped': self.skipped,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'ratio': self.bytes_out / self.bytes_in if self.bytes_in else 1.0,
+                'cpu_seconds': self.cpu_seconds,
+                'remote_cpu_seconds': self.remote_cpu_seconds,
+            }
+
+    def describe(self):
+        stats = self.as_dict()
+        return (f'Compression: {stats["files"]} files, {stats["bytes_in"] / 1e6:.1f} MB -> '
+                f'{stats["bytes_out"] / 1e6:.1f} MB ({stats["ratio"]:.0%}), '
+                f'{stats["cpu_seconds"]:.2f}s CPU compressing, '
+                f'{stats["remote_cpu_seconds"]:.2f}s CPU decompressing on the listener, '
+                f'{stats["skipped"]} files skipped')
+
+
+def should_compress(file_path, size, codec):
+    if size < MIN_SIZE:
+        return False
+    if os.path.splitext(file_path)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return False
+    with open(file_path, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+    return len(compress_function(codec)(sample)) <= len(sample) * MAX_RATIO
+
+
+def iter_compressed(file_path, codec, stats=None, chunk_size=protocol.CHUNK_SIZE, offset=0):
+    compress = compress_function(codec)
+    bytes_in = 0
+    bytes_out = 0
+    cpu = 0.0
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        while data := f.read(chunk_size):
+            started = time.thread_time()
+            out = compress(data)
+            cpu += time.thread_time() - started
+            bytes_in += len(data)
+            bytes_out += len(out)
+            yield out
+    if stats is not None:
+        stats.add(bytes_in, bytes_out, cpu)
+
+
+def decompress_into(chunks, out, codec, digest=None):
+    # Returns (bytes written, CPU seconds spent decompressing)
+    decompress = decompress_function(codec)
+    written = 0
+    cpu = 0.0
+    for chunk in chunks:
+        started = time.thread_time()
+        data = decompress(chunk)
+        cpu += time.thread_time() - started
+        out.write(data)
+        if digest is not None:
+            digest.update(data)
+        written += len(data)
+    return written, cpu
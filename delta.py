@@ -0,0 +1,192 @@
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+
+import protocol
+
+# rsync-style block delta. The listener describes its copy of a file as one
+# (weak, strong) signature per block; the sender answers with a stream of
+# "copy these blocks" and "here are literal bytes" instructions, which the
+# listener replays into a temp file next to the destination.
+
+BLOCK_SIZE = 256 * 1024
+DELTA_THRESHOLD = 64 * 1024 * 1024
+
+SIGNATURE = struct.Struct('!I16s')
+OP_COPY = b'C'
+OP_LITERAL = b'L'
+COPY = struct.Struct('!cQI')
+LITERAL = struct.Struct('!cQ')
+OP_HEADER = 1
+
+ADLER_MOD = 65521
+
+# After this many consecutive blocks with no match anywhere, stop the rolling
+# search until an aligned block matches again, so brand-new content does not
+# pay the byte-by-byte cost all the way through.
+MAX_SEARCH_MISSES = 8
+
+
+def strong_digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def file_signatures(file_path, block_size=BLOCK_SIZE):
+    signatures = bytearray()
+    with open(file_path, 'rb') as f:
+        while block := f.read(block_size):
+            signatures += SIGNATURE.pack(zlib.adler32(block), strong_digest(block))
+    return bytes(signatures)
+
+
+def parse_signatures(payload):
+    # weak checksum -> [(strong digest, block index)]
+    table = {}
+    for index, (weak, strong) in enumerate(SIGNATURE.iter_unpack(payload)):
+        table.setdefault(weak, []).append((strong, index))
+    return table
+
+
+def _match(table, weak, block):
+    candidates = table.get(weak)
+    if not candidates:
+        return None
+    strong = strong_digest(block)
+    for candidate, index in candidates:
+        if candidate == strong:
+            return index
+    return None
+
+
+def _search(table, data, start, block_size, window):
+    # Slide a rolling Adler-32 byte by byte from `start`, looking for any
+    # listener block. This is the slow path, only used around changed regions
+    # to find where shifted old content resumes.
+    end = min(start + window, len(data) - block_size)
+    if end <= start:
+        return None
+    checksum = zlib.adler32(data[start:start + block_size])
+    a = checksum & 0xFFFF
+    b = checksum >> 16
+    for pos in range(start + 1, end + 1):
+        out_byte = data[pos - 1]
+        in_byte = data[pos + block_size - 1]
+        a = (a - out_byte + in_byte) % ADLER_MOD
+        b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+        weak = (b << 16) | a
+        if weak in table:
+            index = _match(table, weak, data[pos:pos + block_size])
+            if index is not None:
+                return pos, index
+    return None
+
+
+def compute_delta(file_path, table, block_size=BLOCK_SIZE):
+    # Returns a list of ('copy', first_block, count) and ('literal', offset, length)
+    ops = []
+
+    def add_copy(index):
+        if ops and ops[-1][0] == 'copy' and ops[-1][1] + ops[-1][2] == index:
+            ops[-1] = ('copy', ops[-1][1], ops[-1][2] + 1)
+        else:
+            ops.append(('copy', index, 1))
+
+    def add_literal(offset, length):
+        if length <= 0:
+            return
+        if ops and ops[-1][0] == 'literal' and ops[-1][1] + ops[-1][2] == offset:
+            ops[-1] = ('literal', ops[-1][1], ops[-1][2] + length)
+        else:
+            ops.append(('literal', offset, length))
+
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ops
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pos = 0
+            misses = 0
+            while pos < size:
+                block = data[pos:pos + block_size]
+                index = _match(table, zlib.adler32(block), block)
+                if index is not None:
+                    add_copy(index)
+                    pos += len(block)
+                    misses = 0
+                    continue
+                if misses < MAX_SEARCH_MISSES:
+                    found = _search(table, data, pos, block_size, block_size)
+                    if found is not None:
+                        resume, index = found
+                        add_literal(pos, resume - pos)
+                        add_copy(index)
+                        pos = resume + block_size
+                        misses = 0
+                        continue
+                add_literal(pos, len(block))
+                pos += len(block)
+                misses += 1
+    return ops
+
+
+def delta_size(ops):
+    return sum(COPY.size if op == 'copy' else LITERAL.size + length for op, _, length in ops)
+
+
+def literal_bytes(ops):
+    return sum(length for op, _, length in ops if op == 'literal')
+
+
+def iter_delta(file_path, ops, chunk_size=protocol.CHUNK_SIZE):
+    # Encoded instruction stream, reading literal ranges from the source file
+    with open(file_path, 'rb') as f:
+        for op, start, length in ops:
+            if op == 'copy':
+                yield COPY.pack(OP_COPY, start, length)
+                continue
+            yield LITERAL.pack(OP_LITERAL, length)
+            f.seek(start)
+            remaining = length
+            while remaining:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise protocol.ProtocolError(f'{file_path} shrank while its delta was being sent')
+                yield chunk
+                remaining -= len(chunk)
+
+
+def apply_delta(sock, size, basis, out, block_size, buffer=None, digest=None):
+    # Rebuild a file from `size` bytes of delta instructions read off `sock`,
+    # copying matched blocks from `basis`, the listener's existing copy.
+    remaining = size
+    written = 0
+    while remaining:
+        op = protocol.recv_exact(sock, OP_HEADER)
+        if op == OP_COPY:
+            _, first, count = COPY.unpack(op + protocol.recv_exact(sock, COPY.size - OP_HEADER))
+            remaining -= COPY.size
+            if remaining < 0:
+                raise protocol.ProtocolError('Delta instructions overran their frame')
+            basis.seek(first * block_size)
+            to_copy = count * block_size
+            while to_copy:
+                chunk = basis.read(min(protocol.CHUNK_SIZE, to_copy))
+                if not chunk:
+                    break
+                out.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+                written += len(chunk)
+                to_copy -= len(chunk)
+        elif op == OP_LITERAL:
+            _, length = LITERAL.unpack(op + protocol.recv_exact(sock, LITERAL.size - OP_HEADER))
+            remaining -= LITERAL.size + length
+            if remaining < 0:
+                raise protocol.ProtocolError('Delta instructions overran their frame')
+            protocol.recv_into_file(sock, out, length, buffer, digest)
+            written += length
+        else:
+            raise protocol.ProtocolError(f'Bad delta instruction {op!r}')
+    return written
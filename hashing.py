@@ -0,0 +1,132 @@
+import hashlib
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Digest algorithms in order of preference. MD5 stays available so older
+# manifests and peers remain comparable; xxh3 is only offered when the
+# optional xxhash package is installed.
+ALGORITHMS = {
+    'md5': hashlib.md5,
+    'blake2b': lambda: hashlib.blake2b(digest_size=16),
+}
+if xxhash is not None:
+    ALGORITHMS['xxh3_128'] = xxhash.xxh3_128
+
+PREFERENCE = ['xxh3_128', 'blake2b', 'md5']
+DEFAULT_ALGORITHM = 'md5'
+
+READ_SIZE = 1024 * 1024
+MMAP_THRESHOLD = 64 * 1024 * 1024
+
+
+def available_algorithms():
+    return [name for name in PREFERENCE if name in ALGORITHMS]
+
+
+def algorithm_preference(choice='auto'):
+    # Preference list to offer a peer for a user's setting: every available
+    # algorithm for 'auto', otherwise just the one chosen
+    if choice == 'auto':
+        return available_algorithms()
+    return [choice]
+
+
+def negotiate(offered, supported=None):
+    # First algorithm in the peer's preference list that we also support
+    supported = supported or available_algorithms()
+    for name in offered:
+        if name in supported:
+            return name
+    return DEFAULT_ALGORITHM
+
+
+def new_hasher(algorithm=DEFAULT_ALGORITHM):
+    try:
+        return ALGORITHMS[algorithm]()
+    except KeyError:
+        raise ValueError(f'Unsupported checksum algorithm: {algorithm}')
+
+
+def hash_file(file_path, algorithm=DEFAULT_ALGORITHM):
+    hasher = new_hasher(algorithm)
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                hasher.update(m)
+        else:
+            buffer = bytearray(min(READ_SIZE, size) or 1)
+            view = memoryview(buffer)
+            while n := f.readinto(view):
+                hasher.update(view[:n])
+    return hasher.hexdigest(), size
+
+
+def _hash_one(args):
+    file_path, algorithm = args
+    try:
+        return hash_file(file_path, algorithm)
+    except OSError as e:
+        return None, str(e)
+
+
+def _hash_timed(file_path, algorithm):
+    start = time.perf_counter()
+    digest, result = _hash_one((file_path, algorithm))
+    return digest, result, time.perf_counter() - start
+
+
+def format_rate(stats):
+    seconds = stats['seconds'] or 1e-9
+    return (f'Hashed {stats["files"]} files ({stats["bytes"] / 1e9:.2f} GB) in {stats["seconds"]:.2f}s: '
+            f'{stats["files"] / seconds:.0f} files/s, {stats["bytes"] / 1e9 / seconds:.2f} GB/s')
+
+
+# Worker pool shared by every hashing pass in a process. Threads are the
+# default since hashlib releases the GIL on large buffers; a process pool
+# helps when trees are dominated by many tiny files.
+class HashEngine:
+    def __init__(self, workers=None, processes=False):
+        self.workers = workers or os.cpu_count() or 4
+        if processes:
+            # Imported here so command-line tools that never hash in
+            # processes do not pay for loading multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hash')
+        self.lock = threading.Lock()
+        self.last_stats = {'files': 0, 'bytes': 0, 'seconds': 0.0}
+
+    def hash_files(self, paths, algorithm=DEFAULT_ALGORITHM, on_error=None):
+        # Returns digests in the order of `paths`, None for unreadable files
+        start = time.perf_counter()
+        digests = []
+        total_bytes = 0
+        jobs = [(path, algorithm) for path in paths]
+        for path, (digest, result) in zip(paths, self.pool.map(_hash_one, jobs, chunksize=16)):
+            if digest is None:
+                if on_error:
+                    on_error(path, result)
+            else:
+                total_bytes += result
+            digests.append(digest)
+        stats = {'files': len(paths), 'bytes': total_bytes, 'seconds': time.perf_counter() - start}
+        with self.lock:
+            self.last_stats = stats
+        return digests, stats
+
+    def submit(self, file_path, algorithm=DEFAULT_ALGORITHM):
+        # Future resolving to (digest, size or error, seconds spent hashing)
+        return self.pool.submit(_hash_timed, file_path, algorithm)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
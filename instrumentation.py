@@ -0,0 +1,193 @@
+import bisect
+import datetime
+import io
+import json
+import os
+import threading
+import time
+
+# Timers, counters and latency histograms shared by the sync pipeline and the
+# listener. Everything is thread-safe and snapshots to plain dicts, so it can
+# travel in a frame or be written out as a report.
+
+DEFAULT_REPORT_DIR = os.path.join(os.path.expanduser('~'), '.simpleUnrealSwitchboard', 'reports')
+
+# Upper bounds of the latency buckets in seconds, 1-2-5 steps from 100us to
+# 50s; slower observations land in a final overflow bucket
+BUCKETS = [step * 10.0 ** exponent for exponent in range(-4, 2) for step in (1, 2, 5)]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def quantile(self, q):
+        # Interpolated within the bucket holding the q-th observation, which
+        # is clamped to the fastest and slowest ones actually seen
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = self.min
+        for bound, count in zip(BUCKETS + [self.max], self.counts):
+            if count and seen + count >= rank:
+                low = max(lower, self.min)
+                high = min(bound, self.max)
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            # Only non-empty buckets, keyed by upper bound ('inf' for overflow)
+            'buckets': {f'{bound:g}': count for bound, count in zip(BUCKETS + [float('inf')], self.counts)
+                        if count},
+        }
+
+
+# Named phases, each with call, file and byte counters and the seconds spent,
+# plus a latency histogram for phases recorded one file at a time
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self._clear()
+
+    def _clear(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.histograms = {}
+
+    def add(self, phase, seconds=0.0, files=0, size=0):
+        with self.lock:
+            totals = self.phases.get(phase)
+            if totals is None:
+                totals = self.phases[phase] = {'calls': 0, 'seconds': 0.0, 'files': 0, 'bytes': 0}
+            totals['calls'] += 1
+            totals['seconds'] += seconds
+            totals['files'] += files
+            totals['bytes'] += size
+
+    def record(self, phase, seconds, files=1, size=0):
+        # One timed operation: counted under `phase` and added to its histogram
+        self.add(phase, seconds, files, size)
+        self.observe(phase, seconds)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self, reset=False):
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            phases = {}
+            for name, totals in self.phases.items():
+                seconds = totals['seconds']
+                phases[name] = dict(totals,
+                                    files_per_second=totals['files'] / seconds if seconds else None,
+                                    bytes_per_second=totals['bytes'] / seconds if seconds else None)
+            histograms = {name: histogram.as_dict() for name, histogram in self.histograms.items()}
+            # Cleared under the same lock, so nothing recorded in between is lost
+            if reset:
+                self._clear()
+        return {'elapsed': elapsed, 'phases': phases, 'latency': histograms}
+
+
+def describe(snapshot, phases=None):
+    # One status line per phase, slowest first
+    lines = []
+    items = sorted(snapshot['phases'].items(), key=lambda item: item[1]['seconds'], reverse=True)
+    for name, totals in items:
+        if phases is not None and name not in phases:
+            continue
+        line = f'{name}: {totals["calls"]} calls, {totals["seconds"]:.2f}s'
+        if totals['bytes_per_second']:
+            line += f', {totals["bytes"] / 1e6:.1f} MB at {totals["bytes_per_second"] / 1e6:.1f} MB/s'
+        latency = snapshot['latency'].get(name)
+        if latency and latency['count']:
+            line += f', p50 {latency["p50"] * 1e3:.1f} ms, p99 {latency["p99"] * 1e3:.1f} ms'
+        lines.append(line)
+    return lines
+
+
+# cProfile across threads. Before Python 3.12 a profiler only sees the thread
+# that enabled it, so every function run through run() gets its own and they
+# are merged when saved. From 3.12 one enabled profiler sees every thread and
+# a second one cannot be enabled, so nested runs just call through. cProfile
+# and pstats are only imported once a profile is actually wanted.
+class Profiler:
+    def __init__(self):
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def run(self, func, *args, **kwargs):
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self.lock:
+                self.profiles.append(profile)
+
+    def stats(self):
+        with self.lock:
+            profiles = list(self.profiles)
+        if not profiles:
+            return None
+        import pstats
+        stats = pstats.Stats(profiles[0], stream=io.StringIO())
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def save(self, path):
+        stats = self.stats()
+        if stats is None:
+            return None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        stats.dump_stats(path)
+        return path
+
+
+def report_path(prefix='sync', extension='json', directory=None):
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    return os.path.join(directory or DEFAULT_REPORT_DIR, f'{prefix}-{stamp}.{extension}')
+
+
+def write_report(report, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,117 @@
+import os
+import re
+import subprocess
+import time
+
+# Command lines for the Unreal Multi-User server and for editors joining its
+# session. Nothing here touches the UI, so the GUI, the command line and the
+# listener start Unreal exactly the same way.
+
+SERVER_EXECUTABLE = 'UnrealMultiUserSlateServer.exe'
+UNICAST_ENDPOINT = '127.0.0.1:9030'
+MULTICAST_ENDPOINT = '230.0.0.1:6666'
+
+# An editor counts as in the session once its log has a Concert line saying
+# it joined or connected to one
+READY_PATTERN = re.compile(r'LogConcert.*\b(joined|connected to)\b.*\bsession\b', re.IGNORECASE)
+LOG_POLL_INTERVAL = 0.25
+# Allowance for coarse file timestamps when telling a fresh log from the one
+# an earlier run left behind
+LOG_MTIME_SLACK = 2.0
+
+
+def check_paths(editor_path, uproject_path):
+    if not editor_path or not os.path.isfile(editor_path):
+        raise ValueError('Unreal Editor path is invalid.')
+    if not uproject_path or not os.path.isfile(uproject_path):
+        raise ValueError('.uproject file path is invalid.')
+
+
+def is_editor(path):
+    # Only Unreal editor binaries are launched on behalf of a remote request
+    return bool(path) and os.path.basename(path).lower().startswith('unrealeditor')
+
+
+def editor_log_path(uproject_path, display_name='Editor_1'):
+    # Where the editor writes the Log= file passed by editor_command
+    return os.path.join(os.path.dirname(uproject_path), 'Saved', 'Logs', f'{display_name}.log')
+
+
+def server_path(editor_path):
+    # The Multi-User server ships next to the editor executable
+    return os.path.join(os.path.dirname(editor_path), SERVER_EXECUTABLE)
+
+
+def server_command(editor_path, server_name):
+    return [
+        server_path(editor_path),
+        f'-CONCERTSERVER={server_name}',
+        '-UDPMESSAGING_SHARE_KNOWN_NODES=1',
+        f'-UDPMESSAGING_TRANSPORT_UNICAST={UNICAST_ENDPOINT}',
+        f'-UDPMESSAGING_TRANSPORT_MULTICAST={MULTICAST_ENDPOINT}',
+        '-messaging'
+    ]
+
+
+def editor_command(editor_path, uproject_path, server_name, session_name, display_name='Editor_1'):
+    return [
+        editor_path, uproject_path,
+        f'Log={display_name}.log',
+        '-CONCERTRETRYAUTOCONNECTONERROR', '-CONCERTAUTOCONNECT',
+        f'-CONCERTSERVER="{server_name}"', f'-CONCERTSESSION="{session_name}"',
+        f'-CONCERTDISPLAYNAME="{display_name}"', f'-StageFriendlyName="{display_name}"',
+        '-DPCVars="Slate.bAllowThrottling=0"', '-ConcertReflectVisibility=1',
+        f'-UDPMESSAGING_TRANSPORT_MULTICAST="{MULTICAST_ENDPOINT}"',
+        '-UDPMESSAGING_TRANSPORT_UNICAST="127.0.0.1:0"',
+        f'-UDPMESSAGING_TRANSPORT_STATIC="{UNICAST_ENDPOINT}"'
+    ]
+
+
+def start_server(editor_path, server_name, capture_output=True):
+    # The server process; with capture_output its stdout and stderr are
+    # pipes of text lines for the caller to read
+    command = server_command(editor_path, server_name)
+    if not os.path.isfile(command[0]):
+        raise FileNotFoundError('Unreal Multi-User Slate Server executable not found.')
+    pipe = subprocess.PIPE if capture_output else None
+    return subprocess.Popen(command, stdout=pipe, stderr=pipe, text=True)
+
+
+def launch_editor(editor_path, uproject_path, server_name, session_name, display_name='Editor_1'):
+    check_paths(editor_path, uproject_path)
+    if not session_name:
+        raise ValueError('Multi-User session not started.')
+    return subprocess.Popen(editor_command(editor_path, uproject_path, server_name, session_name, display_name))
+
+
+def watch_editor(process, log_path, on_ready=None, poll_interval=LOG_POLL_INTERVAL, pattern=READY_PATTERN):
+    # Follow the editor's log until a line shows it joined the Multi-User
+    # session, calling on_ready(seconds since the watch began), then wait for
+    # the editor to exit and return its exit code. A log left over from an
+    # earlier run is ignored until the editor replaces it.
+    launched = time.time()
+    started = time.monotonic()
+    offset = 0
+    tail = b''
+    while on_ready is not None and process.poll() is None:
+        try:
+            with open(log_path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if st.st_mtime >= launched - LOG_MTIME_SLACK:
+                    if st.st_size < offset:
+                        offset, tail = 0, b''
+                    f.seek(offset)
+                    data = f.read()
+                    offset += len(data)
+                    lines = (tail + data).split(b'\n')
+                    tail = lines.pop()
+                    # NULs are dropped so UTF-16 logs match as well as UTF-8
+                    if any(pattern.search(line.replace(b'\x00', b'').decode('utf-8', 'replace'))
+                           for line in lines):
+                        on_ready(time.monotonic() - started)
+                        on_ready = None
+                        continue
+        except OSError:
+            pass
+        time.sleep(poll_interval)
+    return process.wait()
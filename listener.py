@@ -1,88 +1,747 @@
 import socket
 import subprocess
-import ast
 import sys
 import signal
 import os
-import hashlib
+import argparse
+import contextlib
+import glob
+import shutil
+import threading
+import time
+import multiprocessing
+import lzma
+import zlib
+import compression
+import delta
+import hashing
+import instrumentation
+import launcher
+import merkle
+import protocol
+from hashing import HashEngine
+from manifest import ChecksumCache, is_within, stat_signature
 
-def start_listener():
-    host = '0.0.0.0'
-    port = 65432
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((host, port))
-        s.listen()
-        print(f'Listening on {host}:{port}')
-        try:
+# Linux ioctl that clones a file's extents copy-on-write (btrfs, XFS)
+FICLONE = 0x40049409
+
+# Errors from a request whose meta or payload does not decode. Like a
+# ProtocolError they end the session, after an error reply to the request.
+MALFORMED_ERRORS = (LookupError, ValueError, TypeError, zlib.error, lzma.LZMAError)
+
+# In-progress writes live beside their destination under these suffixes and
+# are left out of checksum walks
+PARTIAL_SUFFIX = '.part'
+TEMP_SUFFIXES = (PARTIAL_SUFFIX, '.tmp')
+
+RECEIVE_MODES = ('mapped', 'buffered')
+# Smaller payloads are not worth setting up a mapping for
+MAPPED_MIN_SIZE = 4 * 1024 * 1024
+
+class ListenerServer:
+    def __init__(self, host='0.0.0.0', port=protocol.DEFAULT_PORT, max_connections=32,
+                 max_inflight=8, write_workers=4, hash_workers=None, hash_processes=False,
+                 cache_dir=None, receive_mode='mapped', allow_launch=False, editor_path=None):
+        self.host = host
+        self.port = port
+        self.max_inflight = max_inflight
+        # Accepting blocks once max_connections sessions are open, and a file
+        # push waits for a free write slot before its payload is read, so a
+        # busy node pushes back on senders through TCP flow control.
+        self.connection_slots = threading.BoundedSemaphore(max_connections)
+        self.write_slots = threading.BoundedSemaphore(write_workers)
+        self.hash_engine = HashEngine(hash_workers, hash_processes)
+        self.cache_dir = cache_dir
+        # 'mapped' receives large files through preallocated memory maps,
+        # 'buffered' through the connection's read buffer
+        self.receive_mode = receive_mode
+        self.caches = {}
+        self.caches_lock = threading.Lock()
+        # Per-phase timings, rates and latency histograms, served by the
+        # stats command
+        self.metrics = instrumentation.Metrics()
+        self.started = time.time()
+        # Session counts, for benchmarks and diagnostics
+        self.connections = 0
+        self.active_connections = 0
+        self.peak_connections = 0
+        self.connections_lock = threading.Lock()
+        # Set once the socket is listening; port 0 picks a free port, which
+        # is written back to self.port
+        self.ready = threading.Event()
+        # Whether main apps may start editors on this machine (off unless
+        # asked for), the editor to start instead of the one a request names,
+        # and the editors started here that are still running
+        self.allow_launch = allow_launch
+        self.editor_path = editor_path
+        self.editors = {}
+        self.editors_lock = threading.Lock()
+
+    def cache_for_root(self, folder, algorithm):
+        key = (os.path.normcase(os.path.abspath(folder)), algorithm)
+        with self.caches_lock:
+            cache = self.caches.get(key)
+            if cache is None:
+                cache = self.caches[key] = ChecksumCache(folder, algorithm, self.cache_dir)
+            return cache
+
+    def cache_for_path(self, path, algorithm):
+        # The innermost synced root that contains `path`, if any
+        with self.caches_lock:
+            caches = [c for c in self.caches.values()
+                      if c.algorithm == algorithm and is_within(path, c.root)]
+        return max(caches, key=lambda c: len(c.root), default=None)
+
+    def serve_forever(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind((self.host, self.port))
+            s.listen()
+            self.port = s.getsockname()[1]
+            self.ready.set()
+            print(f'Listening on {self.host}:{self.port}')
             while True:
-                conn, addr = s.accept()
-                with conn:
-                    print(f'Connected by {addr}')
-                    data_length = int.from_bytes(conn.recv(4), 'big')
-                    data = b''
-                    while len(data) < data_length:
-                        packet = conn.recv(data_length - len(data))
-                        if not packet:
-                            break
-                        data += packet
-                    message = ast.literal_eval(data.decode())
-                    if message['command'] == 'sync_file':
-                        dest_path = message['dest_path']
-                        file_data = bytes.fromhex(message['file_data'])
-                        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                        with open(dest_path, 'wb') as f:
-                            f.write(file_data)
-                        print(f'Synced file to {dest_path}')
-                    elif message['command'] == 'get_checksums':
-                        folder = message['folder']
-                        print(f'Calculating checksums for folder: {folder}')
-                        checksums = calculate_folder_checksums(folder)
-                        print(f'Sending checksums')
-                        
-                        response = str(checksums).encode('utf-8')
-                        response_length = len(response)
-                        conn.sendall(response_length.to_bytes(4, 'big'))
-                        conn.sendall(response)
-                        print('Checksums sent successfully')
-                    else:
-                        print(f'Unknown command: {message["command"]}')
-        except KeyboardInterrupt:
-            print('Listener interrupted by user')
-            sys.exit(0)
-        except Exception as e:
-            print(f'Error: {e}')
-            sys.exit(1)
-
-def calculate_checksum(file_path):
+                self.connection_slots.acquire()
+                try:
+                    conn, addr = s.accept()
+                except BaseException:
+                    self.connection_slots.release()
+                    raise
+                threading.Thread(target=self.serve_connection, args=(conn, addr), daemon=True).start()
+
+    def serve_connection(self, conn, addr):
+        # A session stays open for as many requests as the client sends
+        print(f'Connected by {addr}')
+        with self.connections_lock:
+            self.connections += 1
+            self.active_connections += 1
+            self.peak_connections = max(self.peak_connections, self.active_connections)
+        session = Connection(conn, self.max_inflight)
+        try:
+            with conn:
+                while True:
+                    frame = protocol.recv_frame(conn)
+                    if frame is None:
+                        break
+                    try:
+                        self.handle_frame(session, frame)
+                    except (protocol.ProtocolError,) + MALFORMED_ERRORS as e:
+                        # The stream may be part way through the payload, so
+                        # the peer is told why and the session ends
+                        if not isinstance(e, protocol.ProtocolError):
+                            e = protocol.ProtocolError(f'Malformed {protocol.command_name(frame.command)} '
+                                                       f'request ({type(e).__name__}: {e})')
+                        session.refuse(frame, e)
+                        raise e
+                session.drain()
+        except (protocol.ProtocolError, OSError) as e:
+            print(f'Connection error from {addr}: {e}')
+        finally:
+            self.save_caches()
+            with self.connections_lock:
+                self.active_connections -= 1
+            self.connection_slots.release()
+
+    def save_caches(self):
+        with self.caches_lock:
+            caches = list(self.caches.values())
+        for cache in caches:
+            try:
+                cache.save()
+            except OSError as e:
+                print(f'Error saving checksum manifest {cache.path}: {e}')
+
+    @contextlib.contextmanager
+    def write_slot(self):
+        # A free write slot, recording how long the request queued for it
+        started = time.perf_counter()
+        with self.write_slots:
+            self.metrics.observe('write_slot_wait', time.perf_counter() - started)
+            yield
+
+    def stats(self, reset=False):
+        with self.connections_lock:
+            connections = {'total': self.connections, 'active': self.active_connections,
+                           'peak': self.peak_connections}
+        with self.editors_lock:
+            editors = len(self.editors)
+        return dict(self.metrics.snapshot(reset), uptime=time.time() - self.started, connections=connections,
+                    receive_mode=self.receive_mode, hash_workers=self.hash_engine.workers, editors=editors)
+
+    def handle_frame(self, session, frame):
+        if frame.command == protocol.CMD_SYNC_FILE:
+            with self.write_slot():
+                self.receive_file(session, frame)
+        elif frame.command == protocol.CMD_SYNC_BATCH:
+            with self.write_slot():
+                self.receive_batch(session, frame)
+        elif frame.command == protocol.CMD_HELLO:
+            offered = frame.meta.get('algorithms', [])
+            session.algorithm = hashing.negotiate(offered)
+            session.codec = compression.negotiate(frame.meta.get('codecs', []))
+            print(f'Negotiated checksum algorithm: {session.algorithm}, compression: {session.codec or "off"}')
+            session.reply(protocol.CMD_ACK, frame, {
+                'algorithm': session.algorithm,
+                'algorithms': hashing.available_algorithms(),
+                'codec': session.codec,
+                'codecs': compression.available_codecs(),
+            })
+        elif frame.command == protocol.CMD_GET_CHECKSUMS:
+            session.run_async(self.send_checksums, session, frame)
+        elif frame.command == protocol.CMD_GET_TREE:
+            session.run_async(self.send_tree, session, frame)
+        elif frame.command == protocol.CMD_FIND_CONTENT:
+            self.find_content(session, frame)
+        elif frame.command == protocol.CMD_MATERIALIZE:
+            with self.write_slot():
+                self.materialize(session, frame)
+        elif frame.command == protocol.CMD_RESUME_OFFSET:
+            session.reply(protocol.CMD_ACK, frame, {'offset': resume_offset(frame.path, frame.meta.get('digest'))})
+        elif frame.command == protocol.CMD_GET_SIGNATURES:
+            session.run_async(self.send_signatures, session, frame)
+        elif frame.command == protocol.CMD_SYNC_DELTA:
+            with self.write_slot():
+                self.receive_delta(session, frame)
+        elif frame.command == protocol.CMD_LAUNCH_EDITOR:
+            self.launch_editor(session, frame)
+        elif frame.command == protocol.CMD_GET_STATS:
+            session.reply(protocol.CMD_STATS, frame,
+                          payload=protocol.encode_json(self.stats(frame.meta.get('reset', False))))
+        else:
+            print(f'Unknown command: {protocol.command_name(frame.command)}')
+            protocol.discard_frame(session.conn, frame, session.buffer)
+            session.reply(protocol.CMD_ERROR, frame, {'error': f'Unknown command {frame.command}'})
+
+    def launch_editor(self, session, frame):
+        # Open frame.path in the requested Multi-User session and report back
+        # on the same request: 'started', 'ready' once the editor's log shows
+        # it joined the session, and finally 'exited'. The editor keeps
+        # running if the requesting app disconnects.
+        meta = frame.meta
+        editor_path = self.editor_path or meta.get('editor_path')
+        display_name = meta.get('display_name') or socket.gethostname()
+        if not self.allow_launch:
+            session.reply(protocol.CMD_ERROR, frame,
+                          {'error': 'Launching editors is disabled on this listener (start it with --allow-launch)'})
+            return
+        if not self.editor_path and not launcher.is_editor(editor_path):
+            session.reply(protocol.CMD_ERROR, frame, {'error': f'Not an Unreal Editor executable: {editor_path}'})
+            return
+        try:
+            process = launcher.launch_editor(editor_path, frame.path, meta.get('server_name'),
+                                             meta.get('session_name'), display_name)
+        except (OSError, ValueError) as e:
+            print(f'Error launching {frame.path}: {e}')
+            session.reply(protocol.CMD_ERROR, frame, {'error': str(e)})
+            return
+        print(f'Launched {frame.path} as {display_name} (pid {process.pid})')
+        with self.editors_lock:
+            self.editors[process.pid] = process
+        self.launch_status(session, frame, {'state': 'started', 'pid': process.pid, 'display_name': display_name})
+        log_path = launcher.editor_log_path(frame.path, display_name)
+        threading.Thread(target=self.supervise_editor, args=(session, frame, process, log_path),
+                         daemon=True).start()
+
+    def supervise_editor(self, session, frame, process, log_path):
+        started = time.perf_counter()
+
+        def ready(seconds):
+            print(f'Editor {process.pid} joined the session after {seconds:.1f}s')
+            self.metrics.record('editor_session', seconds)
+            self.launch_status(session, frame, {'state': 'ready', 'pid': process.pid, 'seconds': seconds})
+
+        returncode = launcher.watch_editor(process, log_path, ready)
+        with self.editors_lock:
+            self.editors.pop(process.pid, None)
+        seconds = time.perf_counter() - started
+        print(f'Editor {process.pid} exited with code {returncode} after {seconds:.1f}s')
+        self.launch_status(session, frame, {'state': 'exited', 'pid': process.pid, 'returncode': returncode,
+                                            'seconds': seconds}, final=True)
+
+    def launch_status(self, session, frame, status, final=False):
+        # Nobody may be listening any more; the editor is unaffected
+        try:
+            session.reply(protocol.CMD_LAUNCH_STATUS, frame, status, flags=0 if final else protocol.FLAG_MORE)
+        except OSError:
+            pass
+
+    def receive_file(self, session, frame):
+        # Data goes to a partial file named after the expected digest. If the
+        # connection drops it stays on disk, and a later push of the same
+        # content resumes at its length; the destination is only replaced
+        # once the whole file is there and matches the digest.
+        started = time.perf_counter()
+        dest_path = frame.path
+        expected = frame.meta.get('digest')
+        offset = frame.meta.get('offset', 0)
+        part_path = partial_path(dest_path, expected)
+        digest = hashing.new_hasher(session.algorithm)
+        try:
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            if offset:
+                f = open(part_path, 'r+b')
+                try:
+                    hash_prefix(f, offset, digest, session.buffer)
+                except BaseException:
+                    f.close()
+                    raise
+            else:
+                f = open(part_path, 'w+b')
+        except OSError as e:
+            print(f'Error writing {dest_path}: {e}')
+            protocol.discard_frame(session.conn, frame, session.buffer)
+            session.reply(protocol.CMD_ERROR, frame, {'error': str(e)})
+            return
+        ack = {'size': frame.size, 'resumed': offset}
+        with f:
+            if frame.flags & protocol.FLAG_COMPRESSED:
+                size, cpu = compression.decompress_into(protocol.iter_chunks(session.conn), f,
+                                                        frame.meta.get('codec'), digest)
+                ack.update(size=size, cpu=cpu)
+            else:
+                self.receive_payload(session, f, frame.size, digest)
+        if expected and digest.hexdigest() != expected:
+            remove_quietly(part_path)
+            print(f'Received {dest_path} does not match its checksum, discarded')
+            session.reply(protocol.CMD_ERROR, frame, {'error': 'Received file digest mismatch'})
+            return
+        try:
+            os.replace(part_path, dest_path)
+            st = os.stat(dest_path)
+        except OSError as e:
+            # A directory in the way, or a file held open by a running
+            # editor: only this file fails and the session carries on
+            remove_quietly(part_path)
+            print(f'Error writing {dest_path}: {e}')
+            session.reply(protocol.CMD_ERROR, frame, {'error': str(e)})
+            return
+        remove_partials(dest_path)
+        cache = self.cache_for_path(dest_path, session.algorithm)
+        if cache is not None:
+            cache.update(cache.relative_path(dest_path), st, digest.hexdigest())
+        self.metrics.record('receive_file', time.perf_counter() - started, size=ack['size'])
+        print(f'Synced file to {dest_path}' + (f' (resumed at {offset} bytes)' if offset else ''))
+        session.reply(protocol.CMD_ACK, frame, ack)
+
+    def receive_payload(self, session, f, size, digest):
+        if self.receive_mode == 'mapped' and size >= MAPPED_MIN_SIZE:
+            protocol.recv_into_mapped(session.conn, f, size, digest)
+        else:
+            protocol.recv_into_file(session.conn, f, size, session.buffer, digest)
+
+    def receive_batch(self, session, frame):
+        # Unpack many small files from one frame. Each directory is created
+        # once per batch and the cache is updated as files land; a file that
+        # cannot be written or does not match its digest is reported back
+        # without failing the others.
+        started = time.perf_counter()
+        folder = frame.path
+        entries = frame.meta.get('files', [])
+        ack = {'files': len(entries)}
+        payload = None
+        if frame.flags & protocol.FLAG_COMPRESSED:
+            decompress = compression.decompress_function(frame.meta.get('codec'))
+            cpu_started = time.thread_time()
+            payload = b''.join(decompress(chunk) for chunk in protocol.iter_chunks(session.conn))
+            ack['cpu'] = time.thread_time() - cpu_started
+            expected = len(payload)
+        else:
+            expected = frame.size
+        if sum(entry[1] for entry in entries) != expected:
+            raise protocol.ProtocolError('Batch sizes do not match its payload')
+
+        cache = self.cache_for_root(folder, session.algorithm)
+        directories = set()
+        failed = {}
+        offset = 0
+        for relative_path, size, *rest in entries:
+            # Senders from before per-file digests list [path, size] only
+            expected_digest = rest[0] if rest else None
+            dest_path = os.path.join(folder, *relative_path.split(merkle.SEPARATOR))
+            digest = hashing.new_hasher(session.algorithm)
+            try:
+                directory = os.path.dirname(dest_path)
+                if directory not in directories:
+                    os.makedirs(directory, exist_ok=True)
+                    directories.add(directory)
+                part_path = partial_path(dest_path)
+                f = open(part_path, 'wb')
+            except OSError as e:
+                failed[relative_path] = str(e)
+                if payload is None:
+                    protocol.discard_payload(session.conn, size, session.buffer)
+                offset += size
+                continue
+            with f:
+                if payload is None:
+                    protocol.recv_into_file(session.conn, f, size, session.buffer, digest)
+                else:
+                    data = payload[offset:offset + size]
+                    f.write(data)
+                    digest.update(data)
+            offset += size
+            if expected_digest and digest.hexdigest() != expected_digest:
+                remove_quietly(part_path)
+                failed[relative_path] = 'Received file digest mismatch'
+                continue
+            try:
+                os.replace(part_path, dest_path)
+            except OSError as e:
+                remove_quietly(part_path)
+                failed[relative_path] = str(e)
+                continue
+            cache.update(cache.relative_path(dest_path), os.stat(dest_path), digest.hexdigest())
+        if failed:
+            ack['failed'] = failed
+        self.metrics.record('receive_batch', time.perf_counter() - started, files=len(entries) - len(failed),
+                            size=expected)
+        print(f'Unpacked {len(entries) - len(failed)} files into {folder} from a batch'
+              + (f', {len(failed)} failed' if failed else ''))
+        session.reply(protocol.CMD_ACK, frame, ack)
+
+    def receive_delta(self, session, frame):
+        # Rebuild into a temp file beside the destination and swap it in only
+        # once the result matches the sender's digest.
+        started = time.perf_counter()
+        dest_path = frame.path
+        temp_path = scratch_path(dest_path, 'delta')
+        block_size = frame.meta.get('block_size', delta.BLOCK_SIZE)
+        try:
+            basis = open(dest_path, 'rb')
+        except OSError as e:
+            print(f'Error reading delta basis {dest_path}: {e}')
+            protocol.discard_payload(session.conn, frame.size, session.buffer)
+            session.reply(protocol.CMD_ERROR, frame, {'error': str(e)})
+            return
+        digest = hashing.new_hasher(session.algorithm)
+        try:
+            with basis, open(temp_path, 'wb') as out:
+                size = delta.apply_delta(session.conn, frame.size, basis, out, block_size,
+                                         session.buffer, digest)
+        except BaseException:
+            remove_quietly(temp_path)
+            raise
+        if digest.hexdigest() != frame.meta.get('digest'):
+            remove_quietly(temp_path)
+            print(f'Delta for {dest_path} did not reproduce the source file')
+            session.reply(protocol.CMD_ERROR, frame, {'error': 'Delta result digest mismatch'})
+            return
+        os.replace(temp_path, dest_path)
+        cache = self.cache_for_path(dest_path, session.algorithm)
+        if cache is not None:
+            cache.update(cache.relative_path(dest_path), os.stat(dest_path), digest.hexdigest())
+        self.metrics.record('receive_delta', time.perf_counter() - started, size=size)
+        print(f'Patched {dest_path} from a {frame.size} byte delta')
+        session.reply(protocol.CMD_ACK, frame, {'size': size})
+
+    def find_content(self, session, frame):
+        digests = protocol.decode_json(protocol.recv_payload(session.conn, frame))
+        cache = self.cache_for_root(frame.path, session.algorithm)
+        found = [digest for digest in digests if self.unchanged_copy(cache, digest) is not None]
+        session.reply(protocol.CMD_ACK, frame, {'found': len(found)}, payload=protocol.encode_json(found))
+
+    def unchanged_copy(self, cache, digest):
+        # (relative path, stat signature) of a file under the cache's root
+        # that still holds `digest`, going by its stat signature
+        for relative_path, signature in cache.find(digest):
+            try:
+                if stat_signature(os.stat(os.path.join(cache.root, relative_path))) == signature:
+                    return relative_path, signature
+            except OSError:
+                pass
+        return None
+
+    def materialize(self, session, frame):
+        # Build dest_path from a file this listener already holds with the
+        # same digest, instead of receiving the bytes again
+        started = time.perf_counter()
+        dest_path = frame.path
+        digest = frame.meta.get('digest')
+        cache = self.cache_for_path(dest_path, session.algorithm)
+        source = self.unchanged_copy(cache, digest) if cache is not None else None
+        if source is None:
+            session.reply(protocol.CMD_ERROR, frame, {'error': 'Content not found on the listener'})
+            return
+        source_path = os.path.join(cache.root, source[0])
+        temp_path = scratch_path(dest_path, 'dedup')
+        try:
+            with open(source_path, 'rb') as src:
+                # The index is only trusted while the source is unchanged
+                if stat_signature(os.fstat(src.fileno())) != source[1]:
+                    raise OSError(f'{source_path} changed since it was indexed')
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                with open(temp_path, 'wb') as out:
+                    method = clone_file(src, out)
+            os.replace(temp_path, dest_path)
+        except OSError as e:
+            remove_quietly(temp_path)
+            print(f'Error materializing {dest_path}: {e}')
+            session.reply(protocol.CMD_ERROR, frame, {'error': str(e)})
+            return
+        st = os.stat(dest_path)
+        cache.update(cache.relative_path(dest_path), st, digest)
+        self.metrics.record('materialize', time.perf_counter() - started, size=st.st_size)
+        print(f'Materialized {dest_path} from {source_path} ({method})')
+        session.reply(protocol.CMD_ACK, frame, {'size': st.st_size, 'method': method})
+
+    def send_signatures(self, session, frame):
+        started = time.perf_counter()
+        block_size = frame.meta.get('block_size', delta.BLOCK_SIZE)
+        signatures = delta.file_signatures(frame.path, block_size)
+        self.metrics.record('signatures', time.perf_counter() - started, size=os.path.getsize(frame.path))
+        session.reply(protocol.CMD_SIGNATURES, frame, {'block_size': block_size}, payload=signatures)
+
+    def send_checksums(self, session, frame):
+        folder = frame.path
+        force = frame.meta.get('force', False)
+        print(f'Calculating checksums for folder: {folder}' + (' (full rehash)' if force else ''))
+        cache = self.cache_for_root(folder, session.algorithm)
+        checksums, hash_stats = calculate_folder_checksums(folder, self.hash_engine, cache, force,
+                                                           session.algorithm)
+        self.add_hash_stats(hash_stats)
+        print(f'Sending checksums')
+        session.reply(protocol.CMD_CHECKSUMS, frame, {
+            'algorithm': session.algorithm,
+            'cache': cache.stats(),
+            'hashing': hash_stats,
+        },
+                      payload=protocol.encode_json(checksums))
+        print('Checksums sent successfully')
+
+    def add_hash_stats(self, hash_stats):
+        # Files actually rehashed during a checksum walk, at the engine's rate
+        self.metrics.add('hash', hash_stats['seconds'], hash_stats['files'], hash_stats['bytes'])
+
+    def send_tree(self, session, frame):
+        # The first request of a sync (refresh) walks the folder and builds
+        # its hash tree; later requests on the session descend into it
+        folder = frame.path
+        directories = frame.meta.get('dirs', [''])
+        meta = {'algorithm': session.algorithm}
+        tree = session.trees.get(folder)
+        if tree is None or frame.meta.get('refresh'):
+            force = frame.meta.get('force', False)
+            print(f'Building checksum tree for folder: {folder}' + (' (full rehash)' if force else ''))
+            cache = self.cache_for_root(folder, session.algorithm)
+            started = time.perf_counter()
+            checksums, hash_stats = calculate_folder_checksums(folder, self.hash_engine, cache, force,
+                                                               session.algorithm)
+            self.add_hash_stats(hash_stats)
+            tree = session.trees[folder] = merkle.build_tree(checksums)
+            self.metrics.record('build_tree', time.perf_counter() - started, files=len(checksums))
+            meta.update({'files': len(checksums), 'cache': cache.stats(), 'hashing': hash_stats})
+        session.reply(protocol.CMD_TREE, frame, meta,
+                      payload=protocol.encode_json(merkle.select(tree, directories)))
+
+
+# Per-connection state. Frames are read in order by the connection thread;
+# slow requests such as checksum walks run on their own thread so file pushes
+# behind them on the same session keep flowing, up to max_inflight at a time.
+class Connection:
+    def __init__(self, conn, max_inflight):
+        self.conn = conn
+        self.buffer = bytearray(protocol.CHUNK_SIZE)
+        self.send_lock = threading.Lock()
+        self.inflight = threading.BoundedSemaphore(max_inflight)
+        # Peers that never say hello get the original MD5 digests and no compression
+        self.algorithm = hashing.DEFAULT_ALGORITHM
+        self.codec = None
+        # Checksum trees built for this session, by folder
+        self.trees = {}
+        self.workers = []
+
+    def reply(self, command, frame, meta=None, payload=b'', flags=0):
+        with self.send_lock:
+            protocol.send_frame(self.conn, command, frame.path, meta, payload, flags,
+                                request_id=frame.request_id)
+
+    def refuse(self, frame, error):
+        # Best-effort error reply before the session is dropped
+        try:
+            self.reply(protocol.CMD_ERROR, frame, {'error': str(error)})
+        except OSError:
+            pass
+
+    def run_async(self, handler, *args):
+        frame = args[-1]
+        self.inflight.acquire()
+
+        def run():
+            try:
+                handler(*args)
+            except Exception as e:
+                print(f'Error handling {protocol.command_name(frame.command)}: {e}')
+                self.refuse(frame, e)
+            finally:
+                self.inflight.release()
+
+        worker = threading.Thread(target=run, daemon=True)
+        self.workers = [w for w in self.workers if w.is_alive()]
+        self.workers.append(worker)
+        worker.start()
+
+    def drain(self):
+        # Let outstanding replies go out before the connection is closed
+        for worker in self.workers:
+            worker.join()
+
+
+def remove_quietly(path):
     try:
-        with open(file_path, 'rb') as f:
-            file_hash = hashlib.md5()
-            while chunk := f.read(8192):
-                file_hash.update(chunk)
-        return file_hash.hexdigest()
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def partial_path(dest_path, digest=None):
+    return f'{dest_path}.{digest[:16]}{PARTIAL_SUFFIX}' if digest else f'{dest_path}{PARTIAL_SUFFIX}'
+
+
+def scratch_path(dest_path, kind):
+    # A temp file beside the destination for the request being served. Each
+    # connection runs on its own thread, so concurrent pushes of one path
+    # never write to the same file.
+    return f'{dest_path}.{threading.get_ident()}.{kind}.tmp'
+
+
+def resume_offset(dest_path, digest):
+    # Bytes of this content already received by an interrupted transfer
+    if not digest:
+        return 0
+    try:
+        return os.path.getsize(partial_path(dest_path, digest))
+    except OSError:
+        return 0
+
+
+def remove_partials(dest_path):
+    # Leftovers from interrupted pushes of older versions of the file
+    for path in glob.glob(glob.escape(dest_path) + '.*' + PARTIAL_SUFFIX):
+        remove_quietly(path)
+
+
+def hash_prefix(f, offset, digest, buffer):
+    # Feed the first `offset` bytes of a partial file to the digest and drop
+    # anything past them, leaving the file positioned to append
+    if os.fstat(f.fileno()).st_size < offset:
+        raise OSError('Partial file is shorter than the resume offset')
+    view = memoryview(buffer)
+    remaining = offset
+    while remaining:
+        n = f.readinto(view[:min(len(buffer), remaining)])
+        if not n:
+            raise OSError('Partial file ended early')
+        digest.update(view[:n])
+        remaining -= n
+    f.truncate(offset)
+
+
+def clone_file(src, out):
+    # Copy-on-write clone where the filesystem supports it, else a plain copy.
+    # Hardlinks are not used: synced files are rewritten in place, which
+    # would change every path sharing the inode.
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(out.fileno(), FICLONE, src.fileno())
+            return 'reflink'
+        except OSError:
+            pass
+    shutil.copyfileobj(src, out, protocol.CHUNK_SIZE)
+    return 'copy'
+
+
+def start_listener(**options):
+    try:
+        ListenerServer(**options).serve_forever()
+    except KeyboardInterrupt:
+        print('Listener interrupted by user')
+        sys.exit(0)
     except Exception as e:
-        print(f'Error calculating checksum for {file_path}: {e}')
-        return None
+        print(f'Error: {e}')
+        sys.exit(1)
 
-def calculate_folder_checksums(folder):
+def calculate_folder_checksums(folder, engine, cache=None, force=False,
+                               algorithm=hashing.DEFAULT_ALGORITHM):
     checksums = {}
+    hash_stats = {'files': 0, 'bytes': 0, 'seconds': 0.0}
     try:
         print(f'Starting checksum calculation in folder: {folder}')
+        if cache is not None:
+            cache.reset_stats()
+        stale = []
         for root, dirs, files in os.walk(folder):
             for file in files:
+                if file.endswith(TEMP_SUFFIXES):
+                    continue
                 file_path = os.path.join(root, file)
                 relative_path = os.path.relpath(file_path, folder)
-                checksum = calculate_checksum(file_path)
+                try:
+                    st = os.stat(file_path)
+                except OSError as e:
+                    print(f'Error reading {file_path}: {e}')
+                    continue
+                checksum = None
+                if cache is not None and not force:
+                    checksum = cache.lookup(relative_path, st)
                 if checksum:
                     checksums[relative_path] = checksum
-                    print(f'File: {relative_path}, Checksum: {checksum}')
+                else:
+                    stale.append((relative_path, st))
+
+        # Only files whose size, mtime or inode changed are read again
+        paths = [os.path.join(folder, p) for p, st in stale]
+        digests, hash_stats = engine.hash_files(
+            paths, algorithm,
+            on_error=lambda path, e: print(f'Error calculating checksum for {path}: {e}'))
+        for (relative_path, st), checksum in zip(stale, digests):
+            if checksum:
+                checksums[relative_path] = checksum
+                if cache is not None:
+                    cache.update(relative_path, st, checksum)
+                print(f'File: {relative_path}, Checksum: {checksum}')
+        print(hashing.format_rate(hash_stats))
+
+        if cache is not None:
+            cache.prune(checksums)
+            cache.save()
+            stats = cache.stats()
+            print(f'Checksum cache: {stats["hits"]} hits, {stats["misses"]} misses '
+                  f'({stats["hit_rate"]:.0%} hit rate)')
     except Exception as e:
         print(f'Error calculating folder checksums: {e}')
-    return checksums
+    return checksums, hash_stats
 
 if __name__ == '__main__':
     # Handle SIGINT (Ctrl-C)
     signal.signal(signal.SIGINT, signal.SIG_DFL)
-    start_listener()
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser(description='Unreal sync listener')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=protocol.DEFAULT_PORT)
+    parser.add_argument('--max-connections', type=int, default=32,
+                        help='Sessions served at once; further clients wait to be accepted')
+    parser.add_argument('--max-inflight', type=int, default=8,
+                        help='Concurrent background requests per session')
+    parser.add_argument('--write-workers', type=int, default=4,
+                        help='Files received and written to disk at once')
+    parser.add_argument('--hash-workers', type=int, default=None,
+                        help='Workers used for checksum calculation (default: CPU count)')
+    parser.add_argument('--hash-processes', action='store_true',
+                        help='Hash in worker processes instead of threads')
+    parser.add_argument('--receive-mode', choices=RECEIVE_MODES, default='mapped',
+                        help='How large files are written: preallocated memory maps or a read buffer')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Where checksum manifests are kept (default: ~/.simpleUnrealSwitchboard/manifests)')
+    parser.add_argument('--allow-launch', action='store_true',
+                        help='Accept requests to start Unreal Editor on this machine')
+    parser.add_argument('--editor', dest='editor_path', default=None,
+                        help='Unreal Editor to start for launch requests, instead of the path the request names')
+    args = parser.parse_args()
+    start_listener(**vars(args))
 
@@ -1,64 +1,108 @@
 import sys
-import subprocess
-import socket
 from PyQt6 import QtWidgets, QtGui, QtCore
 import os
 import threading
 import time
 import signal
 import shutil
-import hashlib
-import ast
+import compression
+import hashing
+import instrumentation
+import launcher
+import progress
+import scheduler
+from orchestrator import SyncAndLaunch
+from sync_engine import outcome, run_sync
+from hashing import HashEngine
 from PyQt6.QtCore import QThread, pyqtSignal
 
+# How often logged lines and sync progress are pushed to the widgets
+STATUS_REFRESH_MS = 100
+# Resolution of the sync progress bar
+PROGRESS_STEPS = 1000
+
 class SyncThread(QThread):
-    progress = pyqtSignal(str)
     finished = pyqtSignal()
+    # Emitted per listener with (target, seconds) once the project can be opened
+    launchable = pyqtSignal(str, float)
+    # Emitted with the machine-readable report once a sync ends
+    report = pyqtSignal(object)
     
-    def __init__(self, app, editor_folder, listener_folder):
+    def __init__(self, app, editor_folder, listener_folder, force_rehash=False, profile=False, launch=False):
         super().__init__()
         self.app = app
         self.editor_folder = editor_folder
         self.listener_folder = listener_folder
+        self.force_rehash = force_rehash
+        self.cancelled = threading.Event()
+        # Messages go to the app's log buffer rather than through a signal
+        # per line, and file and byte counts to a progress object the UI polls
+        self.log = app.logMessage
+        self.sync_progress = progress.SyncProgress()
+        # Capture a cProfile of every pipeline thread for this one sync
+        self.profiler = instrumentation.Profiler() if profile else None
+        # Open the project on each listener once its sync is done, timed
+        # from the click that started this thread
+        self.launch = launch
+        self.clicked = time.monotonic()
+
+    def cancel(self):
+        # Stages stop at their next item and in-flight sends stop at their
+        # next chunk; the listener keeps partial files to resume from
+        if not self.cancelled.is_set():
+            self.log('Cancelling sync...')
+            self.cancelled.set()
 
     def run(self):
         try:
-            if not os.path.isdir(self.editor_folder):
-                self.progress.emit('Error: Editor folder path is invalid.')
-                return
-
-            self.progress.emit(f'Syncing from {self.editor_folder} to {self.app.listener_ip}:{self.listener_folder}')
-
-            # Get checksums of files on the listener side
-            listener_checksums = self.app.getListenerChecksums(self.listener_folder)
-            self.progress.emit('Received listener checksums')
-
-            # Send the contents of the editor folder to the listener
-            for root, dirs, files in os.walk(self.editor_folder):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(file_path, self.editor_folder)
-
-                    # Calculate checksum of the local file
-                    local_checksum = self.app.calculate_checksum(file_path)
-
-                    # Compare checksums and send file if different
-                    if listener_checksums.get(relative_path) != local_checksum:
-                        self.progress.emit(f'Syncing {relative_path}...')
-                        self.app.sendFileToListener(file_path, os.path.join(self.listener_folder, relative_path))
-                    else:
-                        self.progress.emit(f'Skipping {relative_path} (unchanged)')
-
-            self.progress.emit('Folders synced successfully.')
+            listener_ips = self.app.listenerIps()
+            options = dict(
+                algorithms=self.app.checksumAlgorithms(),
+                force_rehash=self.force_rehash,
+                transfer_workers=self.app.transferWorkers,
+                queue_depth=self.app.queueDepth,
+                delta_threshold=self.app.deltaThresholdMb * 1024 * 1024,
+                codecs=self.app.compressionCodecs(),
+                batch_size=self.app.batchSizeKb * 1024,
+                content_order=self.app.contentOrder,
+                zero_copy=self.app.zeroCopy,
+                on_launchable=self.launchable.emit,
+                cancel=self.cancelled,
+                profiler=self.profiler,
+                progress=self.sync_progress,
+                log=self.log,
+            )
+            if self.launch:
+                summary, report = SyncAndLaunch(
+                    listener_ips, self.editor_folder, self.app.listenerUprojectPath, self.app.hash_engine,
+                    self.app.listenerEditorPath(), self.app.concert_server_name, self.app.session_name,
+                    clicked=self.clicked,
+                    max_nodes=self.app.maxNodes,
+                    bandwidth=self.app.bandwidthCapMb * 1024 * 1024,
+                    **options,
+                ).run()
+            else:
+                summary, report = run_sync(
+                    listener_ips, self.editor_folder, self.listener_folder, self.app.hash_engine,
+                    max_nodes=self.app.maxNodes,
+                    bandwidth=self.app.bandwidthCapMb * 1024 * 1024,
+                    **options,
+                )
+            self.report.emit(report)
+            self.log(outcome(summary))
             self.finished.emit()
         except Exception as e:
-            self.progress.emit(f'Error syncing folders: {e}')
+            self.log(f'Error syncing folders: {e}')
             self.finished.emit()
 
 class UnrealSyncApp(QtWidgets.QWidget):
     def __init__(self):
         try:
             super().__init__()
+            # Filled from any thread, shown by refreshStatus on the GUI thread
+            self.logBuffer = progress.LogBuffer()
+            self.sync_thread = None
+            self.progress_dialog = None
             # Initialize default paths and variables
             self.unrealEditorPath = 'C:\\Program Files\\Epic Games\\UE_5.4\\Engine\\Binaries\\Win64\\UnrealEditor.exe'
             self.uprojectPath = 'C:\\Users\\dostr\\Documents\\Unreal Projects\\gitSwitchboard\\gitSwitchboard.uproject'
@@ -68,6 +112,19 @@ class UnrealSyncApp(QtWidgets.QWidget):
             self.concert_server_name = 'unrealMUS'
             self.listenerUprojectPath = 'C:\\Users\\dostr\\OneDrive - Louisiana State University\\Desktop\\synctest\\gitSwitchboard.uproject'
             self.listenerUnrealEditorPath = ''
+            self.forceRehash = False
+            self.profileNextSync = False
+            self.checksumAlgorithm = 'auto'
+            self.transferWorkers = 4
+            self.queueDepth = 256
+            self.deltaThresholdMb = 64
+            self.compressionCodec = 'off'
+            self.contentOrder = 'size'
+            self.zeroCopy = True
+            self.batchSizeKb = 4096
+            self.maxNodes = 4
+            self.bandwidthCapMb = 0
+            self.hash_engine = HashEngine()
             self.initUI()
         except Exception as e:
             self.logMessage(f'Error during initialization: {e}')
@@ -101,13 +158,75 @@ class UnrealSyncApp(QtWidgets.QWidget):
             self.concertSessionNameTextbox.textChanged.connect(self.updateConcertSessionName)
 
             # Label and textbox for Listener IP address
-            listenerIpLabel = QtWidgets.QLabel('Listener IP Address:', self)
+            listenerIpLabel = QtWidgets.QLabel('Listener IP Addresses:', self)
             self.listenerIpTextbox = QtWidgets.QLineEdit(self)
             self.listenerIpTextbox.setPlaceholderText('Listener IP Address')
             self.listenerIpTextbox.setText(self.listener_ip)
-            self.listenerIpTextbox.setToolTip('Specify the IP address of the listener application. Default is "127.0.0.1".')
+            self.listenerIpTextbox.setToolTip('Specify the IP address of the listener application, or several separated by commas to sync and launch on every node. Default is "127.0.0.1".')
             self.listenerIpTextbox.textChanged.connect(self.updateListenerIp)
 
+            # Label and combo box for checksum algorithm
+            checksumAlgorithmLabel = QtWidgets.QLabel('Checksum Algorithm:', self)
+            self.checksumAlgorithmCombo = QtWidgets.QComboBox(self)
+            self.checksumAlgorithmCombo.addItems(['auto'] + hashing.available_algorithms())
+            self.checksumAlgorithmCombo.setToolTip('Digest used to compare files. "auto" picks the fastest one the listener also supports.')
+            self.checksumAlgorithmCombo.currentTextChanged.connect(self.updateChecksumAlgorithm)
+
+            # Label and spin boxes for sync pipeline tuning
+            transferWorkersLabel = QtWidgets.QLabel('Transfer Workers:', self)
+            self.transferWorkersSpinBox = QtWidgets.QSpinBox(self)
+            self.transferWorkersSpinBox.setRange(1, 64)
+            self.transferWorkersSpinBox.setValue(self.transferWorkers)
+            self.transferWorkersSpinBox.setToolTip('Number of parallel connections used to push files to the listener.')
+            self.transferWorkersSpinBox.valueChanged.connect(self.updateTransferWorkers)
+
+            queueDepthLabel = QtWidgets.QLabel('Pipeline Queue Depth:', self)
+            self.queueDepthSpinBox = QtWidgets.QSpinBox(self)
+            self.queueDepthSpinBox.setRange(1, 65536)
+            self.queueDepthSpinBox.setValue(self.queueDepth)
+            self.queueDepthSpinBox.setToolTip('How many files each sync stage may queue ahead of the next one.')
+            self.queueDepthSpinBox.valueChanged.connect(self.updateQueueDepth)
+
+            deltaThresholdLabel = QtWidgets.QLabel('Delta Threshold (MB):', self)
+            self.deltaThresholdSpinBox = QtWidgets.QSpinBox(self)
+            self.deltaThresholdSpinBox.setRange(0, 1024 * 1024)
+            self.deltaThresholdSpinBox.setValue(self.deltaThresholdMb)
+            self.deltaThresholdSpinBox.setToolTip('Changed files at least this large are sent as block deltas against the listener copy. 0 disables delta transfer.')
+            self.deltaThresholdSpinBox.valueChanged.connect(self.updateDeltaThreshold)
+
+            contentOrderLabel = QtWidgets.QLabel('Content Order:', self)
+            self.contentOrderCombo = QtWidgets.QComboBox(self)
+            self.contentOrderCombo.addItems(scheduler.CONTENT_ORDERS)
+            self.contentOrderCombo.setToolTip('Project descriptors, Config, then code and plugins are always sent first. Content follows smallest first ("size") or most recently modified first ("recent").')
+            self.contentOrderCombo.currentTextChanged.connect(self.updateContentOrder)
+
+            batchSizeLabel = QtWidgets.QLabel('Small-File Batch (KB):', self)
+            self.batchSizeSpinBox = QtWidgets.QSpinBox(self)
+            self.batchSizeSpinBox.setRange(0, 256 * 1024)
+            self.batchSizeSpinBox.setValue(self.batchSizeKb)
+            self.batchSizeSpinBox.setToolTip('Files under 256 KB are packed together into frames of up to this size. 0 sends every file on its own.')
+            self.batchSizeSpinBox.valueChanged.connect(self.updateBatchSize)
+
+            maxNodesLabel = QtWidgets.QLabel('Max Concurrent Nodes:', self)
+            self.maxNodesSpinBox = QtWidgets.QSpinBox(self)
+            self.maxNodesSpinBox.setRange(1, 256)
+            self.maxNodesSpinBox.setValue(self.maxNodes)
+            self.maxNodesSpinBox.setToolTip('How many listeners are synced at the same time when several IP addresses are given.')
+            self.maxNodesSpinBox.valueChanged.connect(self.updateMaxNodes)
+
+            bandwidthCapLabel = QtWidgets.QLabel('Bandwidth Cap (MB/s):', self)
+            self.bandwidthCapSpinBox = QtWidgets.QSpinBox(self)
+            self.bandwidthCapSpinBox.setRange(0, 100000)
+            self.bandwidthCapSpinBox.setValue(self.bandwidthCapMb)
+            self.bandwidthCapSpinBox.setToolTip('Total outbound rate shared by all listeners and transfer workers. 0 means unlimited.')
+            self.bandwidthCapSpinBox.valueChanged.connect(self.updateBandwidthCap)
+
+            compressionLabel = QtWidgets.QLabel('Compression:', self)
+            self.compressionCombo = QtWidgets.QComboBox(self)
+            self.compressionCombo.addItems(['off', 'auto'] + compression.available_codecs())
+            self.compressionCombo.setToolTip('Compress files that sample well before sending. Helps on slow links, usually not on 10 GbE.')
+            self.compressionCombo.currentTextChanged.connect(self.updateCompression)
+
             # Label and textbox for Unreal Editor path
             unrealEditorPathLabel = QtWidgets.QLabel('Path to Unreal Editor:', self)
             self.unrealEditorPathTextbox = QtWidgets.QLineEdit(self)
@@ -150,6 +269,27 @@ class UnrealSyncApp(QtWidgets.QWidget):
             syncFoldersButton = QtWidgets.QPushButton('Sync Folders', self)
             syncFoldersButton.clicked.connect(self.syncFolders)
 
+            # Sync, then launch every listener as soon as its own sync is done
+            syncAndLaunchButton = QtWidgets.QPushButton('Sync && Launch All', self)
+            syncAndLaunchButton.setToolTip('Start the Multi-User server if needed, sync every listener and open the project on each one as soon as its sync finishes.')
+            syncAndLaunchButton.clicked.connect(self.syncAndLaunch)
+
+            # Force full rehash checkbox
+            self.forceRehashCheckbox = QtWidgets.QCheckBox('Force full rehash', self)
+            self.forceRehashCheckbox.setToolTip('Ignore the local and listener checksum caches and re-read every file on the next sync.')
+            self.forceRehashCheckbox.toggled.connect(self.updateForceRehash)
+
+            # One-shot profiling checkbox
+            self.profileCheckbox = QtWidgets.QCheckBox('Profile next sync', self)
+            self.profileCheckbox.setToolTip('Capture a cProfile of the next sync next to its report.')
+            self.profileCheckbox.toggled.connect(self.updateProfileNextSync)
+
+            # Zero-copy transfer checkbox
+            self.zeroCopyCheckbox = QtWidgets.QCheckBox('Zero-copy file sends', self)
+            self.zeroCopyCheckbox.setChecked(self.zeroCopy)
+            self.zeroCopyCheckbox.setToolTip('Send uncompressed files with sendfile instead of copying them through Python buffers.')
+            self.zeroCopyCheckbox.toggled.connect(self.updateZeroCopy)
+
             # Browse Unreal Editor button
             browseEditorButton = QtWidgets.QPushButton('Browse Unreal Editor', self)
             browseEditorButton.clicked.connect(self.browseUnrealEditor)
@@ -158,15 +298,31 @@ class UnrealSyncApp(QtWidgets.QWidget):
             browseUprojectButton = QtWidgets.QPushButton('Browse .uproject File', self)
             browseUprojectButton.clicked.connect(self.browseUproject)
 
-            # Status box for sync operation
-            self.statusBox = QtWidgets.QTextEdit(self)
+            # Status box for sync operation, keeping the latest lines only
+            self.statusBox = QtWidgets.QPlainTextEdit(self)
             self.statusBox.setReadOnly(True)
+            self.statusBox.setMaximumBlockCount(progress.LOG_CAPACITY)
             self.statusBox.setPlaceholderText('Status messages will appear here...')
 
+            # Logged lines and sync progress are shown in batches on a timer
+            self.statusTimer = QtCore.QTimer(self)
+            self.statusTimer.setInterval(STATUS_REFRESH_MS)
+            self.statusTimer.timeout.connect(self.refreshStatus)
+            self.statusTimer.start()
+
             # Adding widgets to form layout
             formLayout.addRow(concertServerNameLabel, self.concertServerNameTextbox)
             formLayout.addRow(concertSessionNameLabel, self.concertSessionNameTextbox)
             formLayout.addRow(listenerIpLabel, self.listenerIpTextbox)
+            formLayout.addRow(checksumAlgorithmLabel, self.checksumAlgorithmCombo)
+            formLayout.addRow(transferWorkersLabel, self.transferWorkersSpinBox)
+            formLayout.addRow(queueDepthLabel, self.queueDepthSpinBox)
+            formLayout.addRow(deltaThresholdLabel, self.deltaThresholdSpinBox)
+            formLayout.addRow(compressionLabel, self.compressionCombo)
+            formLayout.addRow(contentOrderLabel, self.contentOrderCombo)
+            formLayout.addRow(batchSizeLabel, self.batchSizeSpinBox)
+            formLayout.addRow(maxNodesLabel, self.maxNodesSpinBox)
+            formLayout.addRow(bandwidthCapLabel, self.bandwidthCapSpinBox)
             formLayout.addRow(unrealEditorPathLabel, self.unrealEditorPathTextbox)
             formLayout.addRow(uprojectPathLabel, self.uprojectPathTextbox)
             formLayout.addRow(listenerUprojectPathLabel, self.listenerUprojectPathTextbox)
@@ -177,6 +333,10 @@ class UnrealSyncApp(QtWidgets.QWidget):
             layout.addWidget(launchEditorButton)
             layout.addWidget(launchClientButton)
             layout.addWidget(syncFoldersButton)
+            layout.addWidget(syncAndLaunchButton)
+            layout.addWidget(self.forceRehashCheckbox)
+            layout.addWidget(self.profileCheckbox)
+            layout.addWidget(self.zeroCopyCheckbox)
             layout.addWidget(browseEditorButton)
             layout.addWidget(browseUprojectButton)
             layout.addLayout(formLayout)
@@ -187,8 +347,29 @@ class UnrealSyncApp(QtWidgets.QWidget):
             self.logMessage(f'Error during UI setup: {e}')
 
     def logMessage(self, message):
-        print(message)  # Print to command prompt
-        self.statusBox.append(message)  # Append message to status box
+        # Safe from any thread; the message shows up on the next refresh
+        self.logBuffer.append(message)
+
+    def refreshStatus(self):
+        # Runs on the GUI thread: everything logged since the last tick goes
+        # to the console and the status box in one write each, and the
+        # progress dialog follows the sync's file and byte counters
+        lines, dropped = self.logBuffer.drain()
+        if dropped:
+            lines.insert(0, f'... {dropped} lines skipped')
+        if lines:
+            text = '\n'.join(lines)
+            print(text)  # Print to command prompt
+            self.statusBox.appendPlainText(text)
+        if self.progress_dialog is not None and self.progress_dialog.isVisible():
+            state = self.sync_thread.sync_progress.snapshot()
+            if state['fraction'] is None:
+                # Busy indicator until the files to send are known
+                self.progress_dialog.setMaximum(0)
+            else:
+                self.progress_dialog.setMaximum(PROGRESS_STEPS)
+                self.progress_dialog.setValue(int(state['fraction'] * PROGRESS_STEPS))
+            self.progress_dialog.setLabelText(progress.describe(state))
 
     def startServer(self):
         try:
@@ -221,27 +402,13 @@ class UnrealSyncApp(QtWidgets.QWidget):
 
     def _startServerProcess(self):
         try:
-            server_path = os.path.join(os.path.dirname(self.unrealEditorPath), 'UnrealMultiUserSlateServer.exe')
-            if not os.path.isfile(server_path):
+            command = launcher.server_command(self.unrealEditorPath, self.concert_server_name)
+            if not os.path.isfile(command[0]):
                 self.logMessage('Error: Unreal Multi-User Slate Server executable not found.')
                 return
 
-            command = [
-                server_path,
-                f'-CONCERTSERVER={self.concert_server_name}',
-                '-UDPMESSAGING_SHARE_KNOWN_NODES=1',
-                '-UDPMESSAGING_TRANSPORT_UNICAST=127.0.0.1:9030',
-                '-UDPMESSAGING_TRANSPORT_MULTICAST=230.0.0.1:6666',
-                '-messaging'
-            ]
-
             self.logMessage(f"Executing command: {' '.join(command)}")
-            self.serverProcess = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
+            self.serverProcess = launcher.start_server(self.unrealEditorPath, self.concert_server_name)
             self.logMessage('Multi-User Server Started Successfully')
 
             # Monitor the server output
@@ -283,37 +450,31 @@ class UnrealSyncApp(QtWidgets.QWidget):
 
     def launchClient(self):
         try:
-            if not os.path.isfile(self.unrealEditorPath):
-                self.logMessage('Error: Unreal Editor path not set.')
-                return
-            if not os.path.isfile(self.uprojectPath):
-                self.logMessage('Error: .uproject file path not set.')
-                return
             if not self.session_name:
                 self.logMessage('Error: Multi-User session not started.')
                 return
+            if not self.listenerUprojectPath:
+                self.logMessage('Error: Listener .uproject path not set.')
+                return
 
-            data = {
-                'unrealEditorPath': self.unrealEditorPath,
-                'uprojectPath': self.uprojectPath,
-                'session_name': self.session_name,
-                'concert_server_name': self.concert_server_name,
-                'listenerUprojectPath': self.listenerUprojectPath,
-                'listenerUnrealEditorPath': self.listenerUnrealEditorPath
-            }
-            self.logMessage(f"Sending data to listener: {data}")
-            self.sendDataToListener(data)
+            # Every listener opens the project without syncing first; the
+            # listeners report back as their editors start and join
+            threading.Thread(target=self.launchListeners, args=(time.monotonic(),), daemon=True).start()
         except Exception as e:
             self.logMessage(f'Error launching client: {e}')
 
-    def sendDataToListener(self, data):
+    def launchListeners(self, clicked):
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((self.listener_ip, 65432))
-                s.sendall(str(data).encode())
-                self.logMessage('Data sent to listener')
+            SyncAndLaunch(self.listenerIps(), os.path.dirname(self.uprojectPath), self.listenerUprojectPath,
+                          self.hash_engine, self.listenerEditorPath(), self.concert_server_name, self.session_name,
+                          sync=False, clicked=clicked, log=self.logMessage).run()
         except Exception as e:
-            self.logMessage(f'Error sending data to listener: {e}')
+            self.logMessage(f'Error launching client: {e}')
+
+    def ensureServer(self):
+        # Start the Multi-User server unless one started here is running
+        if self.serverProcess is None or self.serverProcess.poll() is not None:
+            threading.Thread(target=self._startServerProcess, daemon=True).start()
 
     def launchLocalServer(self):
         try:
@@ -327,19 +488,11 @@ class UnrealSyncApp(QtWidgets.QWidget):
                 self.logMessage('Error: Multi-User session not started.')
                 return
 
-            command = [
-                self.unrealEditorPath, self.uprojectPath,
-                'Log=Editor_1.log',
-                '-CONCERTRETRYAUTOCONNECTONERROR', '-CONCERTAUTOCONNECT',
-                f'-CONCERTSERVER="{self.concert_server_name}"', f'-CONCERTSESSION="{self.session_name}"',
-                '-CONCERTDISPLAYNAME="Editor_1"', '-StageFriendlyName="Editor_1"',
-                '-DPCVars="Slate.bAllowThrottling=0"', '-ConcertReflectVisibility=1',
-                '-UDPMESSAGING_TRANSPORT_MULTICAST="230.0.0.1:6666"',
-                '-UDPMESSAGING_TRANSPORT_UNICAST="127.0.0.1:0"',
-                '-UDPMESSAGING_TRANSPORT_STATIC="127.0.0.1:9030"'
-            ]
+            command = launcher.editor_command(self.unrealEditorPath, self.uprojectPath,
+                                              self.concert_server_name, self.session_name)
             self.logMessage(f"Executing command: {' '.join(command)}")
-            subprocess.Popen(command)
+            launcher.launch_editor(self.unrealEditorPath, self.uprojectPath,
+                                   self.concert_server_name, self.session_name)
             self.logMessage('Local Unreal Project launched and joined the session')
         except Exception as e:
             self.logMessage(f'Error launching local server: {e}')
@@ -374,14 +527,81 @@ class UnrealSyncApp(QtWidgets.QWidget):
     def updateListenerUnrealEditorPath(self, text):
         self.listenerUnrealEditorPath = text
 
+    def updateForceRehash(self, checked):
+        self.forceRehash = checked
+
+    def updateProfileNextSync(self, checked):
+        self.profileNextSync = checked
+
+    def updateZeroCopy(self, checked):
+        self.zeroCopy = checked
+
+    def updateChecksumAlgorithm(self, text):
+        self.checksumAlgorithm = text
+
+    def updateTransferWorkers(self, value):
+        self.transferWorkers = value
+
+    def updateQueueDepth(self, value):
+        self.queueDepth = value
+
+    def updateDeltaThreshold(self, value):
+        self.deltaThresholdMb = value
+
+    def updateCompression(self, text):
+        self.compressionCodec = text
+
+    def updateContentOrder(self, text):
+        self.contentOrder = text
+
+    def updateBatchSize(self, value):
+        self.batchSizeKb = value
+
+    def updateMaxNodes(self, value):
+        self.maxNodes = value
+
+    def updateBandwidthCap(self, value):
+        self.bandwidthCapMb = value
+
+    def listenerEditorPath(self):
+        # Listeners usually have the engine installed at the same path
+        return self.listenerUnrealEditorPath or self.unrealEditorPath
+
+    def listenerIps(self):
+        # The IP field takes one address or a comma-separated list of them
+        return [ip.strip() for ip in self.listener_ip.split(',') if ip.strip()] or ['127.0.0.1']
+
+    def compressionCodecs(self):
+        # Codec preference offered to the listener, empty to send uncompressed
+        return compression.codec_preference(self.compressionCodec)
+
+    def checksumAlgorithms(self):
+        # Preference list offered to the listener
+        return hashing.algorithm_preference(self.checksumAlgorithm)
+
     def syncFolders(self):
+        self.startSync()
+
+    def syncAndLaunch(self):
+        if not self.listenerUprojectPath.lower().endswith('.uproject'):
+            self.logMessage('Error: Listener .uproject path not set.')
+            return
+        if not self.session_name:
+            self.logMessage('Error: Multi-User session not started.')
+            return
+        self.ensureServer()
+        self.startSync(launch=True)
+
+    def startSync(self, launch=False):
         try:
             editor_folder = os.path.dirname(self.uprojectPath)
             listener_folder = os.path.dirname(self.listenerUprojectPath)
 
             # Create and start sync thread
-            self.sync_thread = SyncThread(self, editor_folder, listener_folder)
-            self.sync_thread.progress.connect(self.logMessage)
+            self.sync_thread = SyncThread(self, editor_folder, listener_folder, self.forceRehash,
+                                          self.profileNextSync, launch)
+            self.profileCheckbox.setChecked(False)
+            self.sync_thread.launchable.connect(self.projectLaunchable)
             self.sync_thread.start()
 
             # Create progress dialog
@@ -389,73 +609,24 @@ class UnrealSyncApp(QtWidgets.QWidget):
             self.progress_dialog.setWindowTitle("Sync Progress")
             self.progress_dialog.setWindowModality(QtCore.Qt.WindowModality.WindowModal)
             self.progress_dialog.setAutoClose(False)
-            self.progress_dialog.canceled.connect(self.sync_thread.terminate)
-            self.sync_thread.finished.connect(self.progress_dialog.close)
+            self.progress_dialog.setAutoReset(False)
+            self.progress_dialog.canceled.connect(self.sync_thread.cancel)
+            self.sync_thread.finished.connect(self.syncFinished)
             self.progress_dialog.show()
 
         except Exception as e:
             self.logMessage(f'Error starting sync: {e}')
 
-    def calculate_checksum(self, file_path):
-        try:
-            with open(file_path, 'rb') as f:
-                file_hash = hashlib.md5()
-                while chunk := f.read(8192):
-                    file_hash.update(chunk)
-            return file_hash.hexdigest()
-        except Exception as e:
-            self.logMessage(f'Error calculating checksum for {file_path}: {e}')
-            return None
-
-    def getListenerChecksums(self, listener_folder):
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((self.listener_ip, 65432))
-                message = {'command': 'get_checksums', 'folder': listener_folder}
-                
-                # Send the request
-                message_str = str(message).encode('utf-8')
-                message_length = len(message_str)
-                s.sendall(message_length.to_bytes(4, 'big'))
-                s.sendall(message_str)
-
-                # Receive the response
-                data_length = int.from_bytes(s.recv(4), 'big')
-                data = b''
-                while len(data) < data_length:
-                    chunk = s.recv(min(4096, data_length - len(data)))
-                    if not chunk:
-                        break
-                    data += chunk
-
-                if len(data) == data_length:
-                    response = data.decode('utf-8')
-                    return ast.literal_eval(response)
-                else:
-                    self.logMessage('Error: Incomplete data received')
-                    return {}
-
-        except Exception as e:
-            self.logMessage(f'Error getting checksums from listener: {str(e)}')
-            return {}
+    def syncFinished(self):
+        # Closing the dialog emits canceled, which must not reach a finished sync
+        self.progress_dialog.canceled.disconnect(self.sync_thread.cancel)
+        self.progress_dialog.close()
+        self.progress_dialog = None
+        self.refreshStatus()
 
-    def sendFileToListener(self, file_path, dest_path):
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((self.listener_ip, 65432))
-                with open(file_path, 'rb') as f:
-                    data = f.read()
-                message = {
-                    'command': 'sync_file',
-                    'dest_path': dest_path,
-                    'file_data': data.hex()
-                }
-                message_str = str(message).encode()
-                message_length = len(message_str)
-                s.sendall(message_length.to_bytes(4, 'big') + message_str)
-                self.logMessage(f'Sent file {file_path} to listener')
-        except Exception as e:
-            self.logMessage(f'Error sending file to listener: {e}')
+    def projectLaunchable(self, target, seconds):
+        # The rest of the content may still be transferring
+        self.logMessage(f'{target} is launchable after {seconds:.2f}s')
 
 def main():
     try:
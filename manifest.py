@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import threading
+
+# Checksum manifests live outside the synced project so they never show up in
+# a folder walk or get synced themselves.
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.simpleUnrealSwitchboard', 'manifests')
+MANIFEST_VERSION = 1
+
+
+def normalize_root(root):
+    return os.path.normcase(os.path.abspath(root))
+
+
+def is_within(path, root):
+    path = normalize_root(path)
+    root = normalize_root(root)
+    return path != root and path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def stat_signature(st):
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+# On-disk map of relative path -> (size, mtime_ns, inode, digest) for one
+# synced root. A file is only rehashed when its stat signature changes.
+class ChecksumCache:
+    def __init__(self, root, algorithm='md5', cache_dir=None, kind='listener'):
+        self.root = os.path.abspath(root)
+        self.algorithm = algorithm
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        key = hashlib.sha1(normalize_root(root).encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(self.cache_dir, f'{kind}-{algorithm}-{key}.json')
+        self.entries = {}
+        # digest -> relative paths of every file with that content
+        self.by_digest = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if (data.get('version') == MANIFEST_VERSION and data.get('algorithm') == self.algorithm
+                    and normalize_root(data.get('root', '')) == normalize_root(self.root)):
+                self.from_dict(data)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f'Ignoring unreadable checksum manifest {self.path}: {e}')
+            self.from_dict({})
+
+    def from_dict(self, data):
+        self.entries = data.get('entries', {})
+        self.by_digest = {}
+        for relative_path, entry in self.entries.items():
+            self.by_digest.setdefault(entry[3], set()).add(relative_path)
+
+    def to_dict(self):
+        return {'version': MANIFEST_VERSION, 'root': self.root, 'algorithm': self.algorithm,
+                'entries': self.entries}
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            text = json.dumps(self.to_dict(), separators=(',', ':'))
+            self.dirty = False
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp_path, self.path)
+
+    def lookup(self, relative_path, st):
+        with self.lock:
+            entry = self.entries.get(relative_path)
+            if entry is not None and entry[:3] == stat_signature(st):
+                self.hits += 1
+                return entry[3]
+            self.misses += 1
+            return None
+
+    def update(self, relative_path, st, digest):
+        with self.lock:
+            self._unindex(relative_path)
+            self.entries[relative_path] = stat_signature(st) + [digest]
+            self.by_digest.setdefault(digest, set()).add(relative_path)
+            self.dirty = True
+
+    def remove(self, relative_path):
+        with self.lock:
+            self._unindex(relative_path)
+            if self.entries.pop(relative_path, None) is not None:
+                self.dirty = True
+
+    def _unindex(self, relative_path):
+        # Other paths with the same content stay findable
+        entry = self.entries.get(relative_path)
+        if entry is None:
+            return
+        paths = self.by_digest.get(entry[3])
+        if paths is not None:
+            paths.discard(relative_path)
+            if not paths:
+                del self.by_digest[entry[3]]
+
+    def find(self, digest):
+        # [(relative path, stat signature)] of every file last seen with
+        # `digest`; callers check the signature before trusting a copy
+        with self.lock:
+            return [(relative_path, self.entries[relative_path][:3])
+                    for relative_path in sorted(self.by_digest.get(digest, ()))]
+
+    def prune(self, keep):
+        # Drop entries for files that no longer exist under the root
+        with self.lock:
+            stale = [p for p in self.entries if p not in keep]
+            for relative_path in stale:
+                self._unindex(relative_path)
+                del self.entries[relative_path]
+            if stale:
+                self.dirty = True
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def relative_path(self, path):
+        # Relative path of `path` inside this root, or None if it lies outside
+        if not is_within(path, self.root):
+            return None
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+
+# Sender-side manifest. On top of the local stat -> digest cache it remembers
+# the last digest each listener acknowledged for every file, keyed by target
+# ("host:folder"), so a sync can tell when a listener copy drifted on its own.
+class SenderManifest(ChecksumCache):
+    def __init__(self, root, algorithm='md5', cache_dir=None):
+        self.confirmed = {}
+        super().__init__(root, algorithm, cache_dir, kind='sender')
+
+    def from_dict(self, data):
+        super().from_dict(data)
+        self.confirmed = data.get('confirmed', {})
+
+    def to_dict(self):
+        data = super().to_dict()
+        data['confirmed'] = self.confirmed
+        return data
+
+    def confirmed_digest(self, target, relative_path):
+        with self.lock:
+            return self.confirmed.get(target, {}).get(relative_path)
+
+    def confirm(self, target, relative_path, digest):
+        with self.lock:
+            self.confirmed.setdefault(target, {})[relative_path] = digest
+            self.dirty = True
+
+    def prune(self, keep):
+        super().prune(keep)
+        with self.lock:
+            for digests in self.confirmed.values():
+                stale = [p for p in digests if p not in keep]
+                for relative_path in stale:
+                    del digests[relative_path]
+                if stale:
+                    self.dirty = True
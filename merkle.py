@@ -0,0 +1,92 @@
+import hashlib
+import os
+
+# Directory hash tree over a {relative_path: digest} map. Every directory's
+# hash covers the names and digests of its files and the names and hashes of
+# its subdirectories, so two trees with equal root hashes hold the same files
+# and a differing subtree can be found by descending only where hashes differ.
+#
+# Paths are keyed with '/' whatever the local separator, so trees built on
+# different operating systems compare equal. The root directory is ''.
+
+SEPARATOR = '/'
+
+
+def normalize(relative_path):
+    return relative_path.replace(os.sep, SEPARATOR).replace('\\', SEPARATOR)
+
+
+def join(directory, name):
+    return f'{directory}{SEPARATOR}{name}' if directory else name
+
+
+def parent(path):
+    directory, _, name = path.rpartition(SEPARATOR)
+    return directory, name
+
+
+def contains(directory, path):
+    # True when `path` is `directory` itself or anywhere below it
+    return not directory or path == directory or path.startswith(directory + SEPARATOR)
+
+
+def new_node():
+    return {'hash': None, 'files': {}, 'dirs': {}}
+
+
+def node_hash(node):
+    h = hashlib.blake2b(digest_size=16)
+    for name in sorted(node['files']):
+        h.update(f'f\0{name}\0{node["files"][name]}\0'.encode('utf-8'))
+    for name in sorted(node['dirs']):
+        h.update(f'd\0{name}\0{node["dirs"][name]}\0'.encode('utf-8'))
+    return h.hexdigest()
+
+
+def build_tree(checksums):
+    # {directory: {'hash', 'files': {name: digest}, 'dirs': {name: hash}}}
+    tree = {'': new_node()}
+    for relative_path, digest in checksums.items():
+        directory, name = parent(normalize(relative_path))
+        node = tree.get(directory)
+        if node is None:
+            node = tree[directory] = new_node()
+            # Link every missing ancestor down to this directory
+            child = directory
+            while child:
+                up, child_name = parent(child)
+                known = up in tree
+                if not known:
+                    tree[up] = new_node()
+                tree[up]['dirs'][child_name] = None
+                child = '' if known else up
+        node['files'][name] = digest
+
+    # Hash deepest directories first so each parent sees its children's hashes
+    for directory in sorted(tree, key=lambda d: d.count(SEPARATOR) + (1 if d else 0), reverse=True):
+        node = tree[directory]
+        node['hash'] = node_hash(node)
+        if directory:
+            up, name = parent(directory)
+            tree[up]['dirs'][name] = node['hash']
+    return tree
+
+
+def iter_files(tree, directory, skip=()):
+    # Every file path in the subtree rooted at `directory`, leaving out the
+    # subtrees named in `skip`
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        node = tree[current]
+        for name in node['files']:
+            yield join(current, name)
+        for name in node['dirs']:
+            child = join(current, name)
+            if child not in skip:
+                stack.append(child)
+
+
+def select(tree, directories):
+    # The requested nodes, None for directories the tree does not have
+    return {directory: tree.get(directory) for directory in directories}
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+
+import instrumentation
+import protocol
+from client import ListenerSession
+from progress import SyncProgress
+from sync_engine import CONNECT_TIMEOUT, run_sync
+
+# Sync a project to every listener and open it there in the Multi-User
+# session. Each node is launched as soon as its own sync ends rather than
+# after the slowest one, and every node is timed from the start (the user's
+# click) to the moment its editor joins the session.
+
+# How long run() waits for launched editors to join before reporting
+SESSION_TIMEOUT = 600
+# Node states that run() still waits on
+WAITING_STATES = ('syncing', 'launching', 'started')
+
+
+class SyncAndLaunch:
+    def __init__(self, listener_ips, editor_folder, listener_uproject, hash_engine, editor_path, server_name,
+                 session_name, sync=True, session_timeout=SESSION_TIMEOUT, clicked=None, max_nodes=4,
+                 bandwidth=0, report_dir=None, **options):
+        self.listener_ips = list(dict.fromkeys(listener_ips))
+        self.editor_folder = editor_folder
+        self.listener_uproject = listener_uproject
+        self.hash_engine = hash_engine
+        # Editor executable on the listeners
+        self.editor_path = editor_path
+        self.server_name = server_name
+        self.session_name = session_name
+        # Without sync, every node is launched straight away
+        self.sync = sync
+        self.session_timeout = session_timeout
+        self.clicked = time.monotonic() if clicked is None else clicked
+        self.max_nodes = max_nodes
+        self.bandwidth = bandwidth
+        self.report_dir = report_dir
+        self.port = options.get('port', protocol.DEFAULT_PORT)
+        self.log = options.get('log', print)
+        self.cancelled = options.setdefault('cancel', threading.Event())
+        self.progress = options.setdefault('progress', SyncProgress())
+        self.options = options
+        self.metrics = instrumentation.Metrics()
+        # State of each node plus its timeline in seconds since the click
+        self.nodes = {ip: {'state': 'syncing' if sync else 'launching'} for ip in self.listener_ips}
+        self.changed = threading.Condition()
+
+    def elapsed(self):
+        return time.monotonic() - self.clicked
+
+    def update(self, ip, **fields):
+        with self.changed:
+            self.nodes[ip].update(fields)
+            self.changed.notify_all()
+
+    def run(self):
+        # Returns (sync summary or None, report); the report's 'launch' entry
+        # has the per-node timelines
+        summary = report = None
+        if self.sync:
+            summary, report = run_sync(self.listener_ips, self.editor_folder,
+                                       os.path.dirname(self.listener_uproject), self.hash_engine,
+                                       self.max_nodes, self.bandwidth, self.report_dir,
+                                       on_synced=self.synced, **self.options)
+            # Nodes that could not be reached never report a finished sync
+            for ip in self.listener_ips:
+                if self.nodes[ip]['state'] == 'syncing':
+                    self.update(ip, state='not launched', error='sync failed')
+        else:
+            for ip in self.listener_ips:
+                self.start_launch(ip)
+        self.wait()
+        launch = self.summary()
+        self.report(launch)
+
+        if report is None:
+            report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'listeners': self.listener_ips}
+        report['launch'] = launch
+        try:
+            path = report.get('path') or instrumentation.report_path('launch', directory=self.report_dir)
+            report['path'] = instrumentation.write_report(report, path)
+            self.log(f'Launch report written to {report["path"]}')
+        except OSError as e:
+            self.log(f'Error writing launch report: {e}')
+        return summary, report
+
+    def synced(self, ip, summary):
+        # Called from the node's pipeline the moment its sync ends
+        if summary['cancelled'] or summary['errors'] or summary['failed']:
+            self.update(ip, state='not launched', synced=self.elapsed(), error='sync incomplete')
+            self.log(f'[{ip}] Sync incomplete, not launching')
+            return
+        self.update(ip, synced=self.elapsed())
+        self.start_launch(ip)
+
+    def start_launch(self, ip):
+        self.update(ip, state='launching', requested=self.elapsed())
+        self.progress.launch(launched=1)
+        # The thread lives as long as the editor so its exit gets reported
+        threading.Thread(target=self.launch, args=(ip,), daemon=True).start()
+
+    def launch(self, ip):
+        try:
+            with ListenerSession(ip, self.port, timeout=CONNECT_TIMEOUT) as session:
+                future = session.launch_editor(self.editor_path, self.listener_uproject, self.server_name,
+                                               self.session_name, on_status=lambda status: self.status(ip, status))
+                self.status(ip, future.result().frame.meta)
+        except Exception as e:
+            self.update(ip, state='failed', error=str(e))
+            self.log(f'[{ip}] Launch failed: {e}')
+
+    def status(self, ip, status):
+        now = self.elapsed()
+        state = status.get('state')
+        if state == 'started':
+            self.update(ip, state='started', started=now, pid=status.get('pid'))
+            self.log(f'[{ip}] Editor started as {status.get("display_name")} (pid {status.get("pid")})')
+        elif state == 'ready':
+            self.update(ip, state='joined', joined=now)
+            self.metrics.record('time_to_session', now)
+            self.progress.launch(joined=1)
+            self.log(f'[{ip}] Joined session {self.session_name} {now:.1f}s after start')
+        elif state == 'exited':
+            self.update(ip, state='exited', exited=now, returncode=status.get('returncode'))
+            self.log(f'[{ip}] Editor exited with code {status.get("returncode")}')
+
+    def wait(self):
+        # Until every launched editor has joined the session or stopped, the
+        # timeout passes or the run is cancelled. Editors still starting keep
+        # being reported on afterwards.
+        deadline = self.clicked + self.session_timeout
+        with self.changed:
+            if any(node['state'] in WAITING_STATES for node in self.nodes.values()):
+                self.progress.set_phase('launching')
+            while not self.cancelled.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not any(node['state'] in WAITING_STATES for node in self.nodes.values()):
+                    break
+                # Wakes up now and then to notice a cancel
+                self.changed.wait(min(remaining, 0.5))
+
+    def summary(self):
+        with self.changed:
+            nodes = {ip: dict(node) for ip, node in self.nodes.items()}
+        return {
+            'session': self.session_name,
+            'seconds': self.elapsed(),
+            'nodes': nodes,
+            'joined': sum(1 for node in nodes.values() if 'joined' in node),
+            'metrics': self.metrics.snapshot(),
+        }
+
+    def report(self, launch):
+        self.log('Time to session, from start:')
+        for ip, node in launch['nodes'].items():
+            steps = [f'{name} {node[name]:.1f}s' for name in ('synced', 'started', 'joined') if name in node]
+            if node['state'] in ('not launched', 'failed'):
+                steps.append(f'{node["state"]}: {node["error"]}')
+            elif node['state'] == 'exited' and 'joined' not in node:
+                steps.append(f'exited with code {node["returncode"]} before joining')
+            elif node['state'] in WAITING_STATES:
+                steps.append(f'not in the session after {launch["seconds"]:.0f}s')
+            self.log(f'  {ip}: {", ".join(steps)}')
+        latency = launch['metrics']['latency'].get('time_to_session')
+        text = f'{launch["joined"]} of {len(launch["nodes"])} nodes joined session {self.session_name}'
+        if latency:
+            text += f', median {latency["p50"]:.1f}s, slowest {latency["max"]:.1f}s'
+        self.log(text)
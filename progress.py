@@ -0,0 +1,138 @@
+import collections
+import threading
+import time
+
+# Log and progress state shared between sync threads and whatever displays
+# them. Producers only touch these objects, never a widget, so they can run on
+# any thread at any rate; the display polls them on a timer and renders each
+# batch at once.
+
+LOG_CAPACITY = 10000
+
+
+# Bounded, thread-safe log. When more lines arrive between two drains than it
+# holds, the oldest are dropped and counted instead of piling up.
+class LogBuffer:
+    def __init__(self, capacity=LOG_CAPACITY):
+        self.lines = collections.deque(maxlen=capacity)
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def append(self, message):
+        with self.lock:
+            if len(self.lines) == self.lines.maxlen:
+                self.dropped += 1
+            self.lines.append(message)
+
+    def drain(self):
+        # (lines, dropped) since the last drain
+        with self.lock:
+            lines = list(self.lines)
+            self.lines.clear()
+            dropped, self.dropped = self.dropped, 0
+        return lines, dropped
+
+
+# Aggregate counters for one sync: files walked, then the files and bytes
+# planned for transfer and how many of them have been acknowledged. Several
+# pipelines (one per listener) can add to the same instance.
+class SyncProgress:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.transfer_started = None
+        self.phase = 'starting'
+        self.scanned = 0
+        self.total_files = 0
+        self.total_bytes = 0
+        self.done_files = 0
+        self.done_bytes = 0
+        self.failed = 0
+        # Editors started on listeners and how many have joined the session
+        self.launched = 0
+        self.joined = 0
+
+    def set_phase(self, phase):
+        with self.lock:
+            self.phase = phase
+
+    def scan(self, files=1):
+        with self.lock:
+            self.scanned += files
+
+    def plan(self, files, size):
+        with self.lock:
+            self.total_files += files
+            self.total_bytes += size
+            if self.transfer_started is None:
+                self.transfer_started = time.monotonic()
+            self.phase = 'transferring'
+
+    def advance(self, files=0, size=0, failed=0):
+        # Failed files count as finished so the bar still reaches the end
+        with self.lock:
+            self.done_files += files + failed
+            self.done_bytes += size
+            self.failed += failed
+
+    def launch(self, launched=0, joined=0):
+        with self.lock:
+            self.launched += launched
+            self.joined += joined
+
+    def snapshot(self):
+        with self.lock:
+            state = {
+                'phase': self.phase,
+                'elapsed': time.monotonic() - self.started,
+                'scanned': self.scanned,
+                'total_files': self.total_files,
+                'total_bytes': self.total_bytes,
+                'done_files': self.done_files,
+                'done_bytes': self.done_bytes,
+                'failed': self.failed,
+                'launched': self.launched,
+                'joined': self.joined,
+            }
+            transfer_elapsed = time.monotonic() - self.transfer_started if self.transfer_started else 0.0
+        # Bytes drive the fraction and ETA; files only when nothing has size
+        if state['total_bytes']:
+            fraction = min(1.0, state['done_bytes'] / state['total_bytes'])
+        elif state['total_files']:
+            fraction = min(1.0, state['done_files'] / state['total_files'])
+        else:
+            fraction = None
+        eta = None
+        if fraction and transfer_elapsed:
+            eta = transfer_elapsed * (1 - fraction) / fraction
+        state.update(fraction=fraction, eta=eta,
+                     bytes_per_second=state['done_bytes'] / transfer_elapsed if transfer_elapsed else None)
+        return state
+
+
+def describe(state):
+    # One status line for a snapshot
+    if state['phase'] == 'launching':
+        return f'{state["joined"]:,} of {state["launched"]:,} editors joined the session'
+    if state['fraction'] is None:
+        if state['phase'] == 'transferring':
+            return 'Nothing to transfer'
+        return f'{state["phase"].capitalize()}: {state["scanned"]:,} files scanned'
+    text = (f'{state["done_files"]:,} of {state["total_files"]:,} files, '
+            f'{state["done_bytes"] / 1e9:.2f} of {state["total_bytes"] / 1e9:.2f} GB')
+    if state['bytes_per_second']:
+        text += f' at {state["bytes_per_second"] / 1e6:.1f} MB/s'
+    if state['eta'] is not None and state['fraction'] < 1:
+        text += f', {format_duration(state["eta"])} left'
+    if state['failed']:
+        text += f' ({state["failed"]:,} failed)'
+    return text
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f'{seconds}s'
+    if seconds < 3600:
+        return f'{seconds // 60}m {seconds % 60:02d}s'
+    return f'{seconds // 3600}h {seconds // 60 % 60:02d}m'
@@ -0,0 +1,295 @@
+import json
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+# Wire protocol shared by main.py and listener.py.
+#
+# Every message is a fixed binary header followed by the UTF-8 path, an
+# optional JSON metadata block and `size` bytes of raw payload:
+#
+#   magic(4) version(1) command(1) flags(2) request_id(4) path_len(2)
+#   meta_len(4) size(8)
+#
+# A connection carries any number of frames. Replies echo the request_id of
+# the frame they answer, so a client can pipeline requests on one session.
+
+MAGIC = b'USWB'
+PROTOCOL_VERSION = 2
+DEFAULT_PORT = 65432
+CHUNK_SIZE = 1024 * 1024
+# Receive window mapped at a time by recv_into_mapped
+MAP_WINDOW = 64 * 1024 * 1024
+
+CMD_SYNC_FILE = 1
+CMD_GET_CHECKSUMS = 2
+CMD_CHECKSUMS = 3
+CMD_ACK = 4
+CMD_HELLO = 5
+CMD_GET_SIGNATURES = 6
+CMD_SIGNATURES = 7
+CMD_SYNC_DELTA = 8
+CMD_GET_TREE = 9
+CMD_TREE = 10
+CMD_FIND_CONTENT = 11
+CMD_MATERIALIZE = 12
+CMD_SYNC_BATCH = 13
+CMD_RESUME_OFFSET = 14
+CMD_GET_STATS = 15
+CMD_STATS = 16
+CMD_LAUNCH_EDITOR = 17
+CMD_LAUNCH_STATUS = 18
+CMD_ERROR = 255
+
+COMMAND_NAMES = {
+    CMD_SYNC_FILE: 'sync_file',
+    CMD_GET_CHECKSUMS: 'get_checksums',
+    CMD_CHECKSUMS: 'checksums',
+    CMD_ACK: 'ack',
+    CMD_HELLO: 'hello',
+    CMD_GET_SIGNATURES: 'get_signatures',
+    CMD_SIGNATURES: 'signatures',
+    CMD_SYNC_DELTA: 'sync_delta',
+    CMD_GET_TREE: 'get_tree',
+    CMD_TREE: 'tree',
+    CMD_FIND_CONTENT: 'find_content',
+    CMD_MATERIALIZE: 'materialize',
+    CMD_SYNC_BATCH: 'sync_batch',
+    CMD_RESUME_OFFSET: 'resume_offset',
+    CMD_GET_STATS: 'get_stats',
+    CMD_STATS: 'stats',
+    CMD_LAUNCH_EDITOR: 'launch_editor',
+    CMD_LAUNCH_STATUS: 'launch_status',
+    CMD_ERROR: 'error',
+}
+
+# Frame flags
+FLAG_COMPRESSED = 0x1
+FLAG_CHUNKED = 0x2
+# Set on a reply when more replies to the same request will follow
+FLAG_MORE = 0x4
+
+HEADER = struct.Struct('!4sBBHIHIQ')
+# Chunked payloads (FLAG_CHUNKED) have no size up front; each chunk carries a
+# length prefix and a zero-length chunk ends the payload.
+CHUNK_HEADER = struct.Struct('!I')
+
+Frame = namedtuple('Frame', ['command', 'flags', 'request_id', 'path', 'meta', 'size'])
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+def command_name(command):
+    return COMMAND_NAMES.get(command, f'unknown({command})')
+
+
+def pack_header(command, path='', meta=None, size=0, flags=0, request_id=0):
+    path_bytes = path.encode('utf-8')
+    meta_bytes = json.dumps(meta).encode('utf-8') if meta else b''
+    if len(path_bytes) > 0xFFFF:
+        raise ProtocolError(f'Path too long for frame header: {path}')
+    header = HEADER.pack(MAGIC, PROTOCOL_VERSION, command, flags, request_id,
+                         len(path_bytes), len(meta_bytes), size)
+    return header + path_bytes + meta_bytes
+
+
+def send_frame(sock, command, path='', meta=None, payload=b'', flags=0, request_id=0):
+    sock.sendall(pack_header(command, path, meta, len(payload), flags, request_id) + payload)
+
+
+def send_file(sock, command, path, file_path, meta=None, flags=0, request_id=0,
+              chunk_size=CHUNK_SIZE, offset=0, zero_copy=False):
+    # Stream the file from `offset`. With zero_copy the kernel moves the bytes
+    # from the page cache to the socket (sendfile); otherwise they go in
+    # fixed-size chunks through one reusable buffer, so memory use does not
+    # depend on the file size either way.
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size - offset
+        if size < 0:
+            raise ProtocolError(f'{file_path} is shorter than the resume offset')
+        f.seek(offset)
+        sock.sendall(pack_header(command, path, meta, size, flags, request_id))
+        if zero_copy and size:
+            if sock.sendfile(f, offset, size) != size:
+                raise ProtocolError(f'{file_path} shrank while it was being sent')
+            return size
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        remaining = size
+        while remaining:
+            n = f.readinto(view[:min(chunk_size, remaining)])
+            if not n:
+                raise ProtocolError(f'{file_path} shrank while it was being sent')
+            sock.sendall(view[:n])
+            remaining -= n
+    return size
+
+
+def send_stream(sock, command, path, chunks, size, meta=None, flags=0, request_id=0):
+    # Send a payload of known total size produced piece by piece
+    sock.sendall(pack_header(command, path, meta, size, flags, request_id))
+    sent = 0
+    for chunk in chunks:
+        sock.sendall(chunk)
+        sent += len(chunk)
+    if sent != size:
+        raise ProtocolError(f'Stream for {path} produced {sent} bytes, expected {size}')
+    return size
+
+
+def send_chunked(sock, command, path, chunks, meta=None, flags=0, request_id=0):
+    sock.sendall(pack_header(command, path, meta, 0, flags | FLAG_CHUNKED, request_id))
+    for chunk in chunks:
+        if chunk:
+            sock.sendall(CHUNK_HEADER.pack(len(chunk)))
+            sock.sendall(chunk)
+    sock.sendall(CHUNK_HEADER.pack(0))
+
+
+def iter_chunks(sock):
+    while True:
+        (length,) = CHUNK_HEADER.unpack(recv_exact(sock, CHUNK_HEADER.size))
+        if not length:
+            return
+        yield recv_exact(sock, length)
+
+
+def recv_into_file(sock, f, size, buffer=None, digest=None):
+    # Write `size` payload bytes straight to an open file, reusing `buffer`
+    # between calls when the caller provides one. If a hash object is given
+    # it is fed the same bytes, so the receiver gets the digest for free.
+    if buffer is None:
+        buffer = bytearray(min(size, CHUNK_SIZE) or 1)
+    view = memoryview(buffer)
+    remaining = size
+    while remaining:
+        n = sock.recv_into(view, min(len(view), remaining))
+        if not n:
+            raise ProtocolError(f'Connection closed with {remaining} of {size} bytes outstanding')
+        f.write(view[:n])
+        if digest is not None:
+            digest.update(view[:n])
+        remaining -= n
+    return size
+
+
+def recv_into_mapped(sock, f, size, digest=None, window=MAP_WINDOW):
+    # Receive `size` bytes straight into the page cache of `f`, which must be
+    # open for reading and writing, at its current position. The file is
+    # preallocated first so the filesystem can lay it out in one piece, then
+    # mapped a window at a time and filled with recv_into. If the transfer is
+    # cut short the file is truncated back to what actually arrived.
+    start = f.tell()
+    end = start + size
+    if not size:
+        return size
+    preallocate(f, start, size)
+    pos = start
+    try:
+        while pos < end:
+            map_start = pos - pos % mmap.ALLOCATIONGRANULARITY
+            length = min(end, map_start + window) - map_start
+            with mmap.mmap(f.fileno(), length, offset=map_start) as mapped, memoryview(mapped) as view:
+                i = pos - map_start
+                while i < length:
+                    n = sock.recv_into(view[i:length])
+                    if not n:
+                        raise ProtocolError(f'Connection closed with {end - pos} of {size} bytes outstanding')
+                    if digest is not None:
+                        digest.update(view[i:i + n])
+                    i += n
+                    pos += n
+    except BaseException:
+        f.truncate(pos)
+        raise
+    f.seek(end)
+    return size
+
+
+def preallocate(f, offset, size):
+    # Reserve the blocks where the platform can (posix_fallocate), else just
+    # extend the file so it can be mapped
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), offset, size)
+            return
+        except OSError:
+            pass
+    f.truncate(offset + size)
+
+
+def discard_payload(sock, size, buffer=None):
+    if buffer is None:
+        buffer = bytearray(min(size, CHUNK_SIZE) or 1)
+    view = memoryview(buffer)
+    remaining = size
+    while remaining:
+        n = sock.recv_into(view, min(len(view), remaining))
+        if not n:
+            raise ProtocolError(f'Connection closed with {remaining} of {size} bytes outstanding')
+        remaining -= n
+
+
+def discard_frame(sock, frame, buffer=None):
+    if frame.flags & FLAG_CHUNKED:
+        for _ in iter_chunks(sock):
+            pass
+    else:
+        discard_payload(sock, frame.size, buffer)
+
+
+def recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if not n:
+            raise ProtocolError(f'Connection closed after {received} of {size} bytes')
+        received += n
+    return bytes(buffer)
+
+
+def recv_frame(sock):
+    first = sock.recv(HEADER.size)
+    if not first:
+        return None
+    if len(first) < HEADER.size:
+        first += recv_exact(sock, HEADER.size - len(first))
+    magic, version, command, flags, request_id, path_len, meta_len, size = HEADER.unpack(first)
+    if magic != MAGIC:
+        raise ProtocolError('Bad frame magic, peer is not speaking the sync protocol')
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f'Unsupported protocol version {version} (expected {PROTOCOL_VERSION})')
+    path = recv_exact(sock, path_len) if path_len else b''
+    meta = recv_exact(sock, meta_len) if meta_len else b''
+    try:
+        path = path.decode('utf-8')
+        meta = json.loads(meta) if meta else {}
+    except ValueError as e:
+        raise ProtocolError(f'Malformed {command_name(command)} frame header: {e}') from None
+    if not isinstance(meta, dict):
+        raise ProtocolError(f'Malformed {command_name(command)} frame header: meta is not an object')
+    return Frame(command, flags, request_id, path, meta, size)
+
+
+def recv_payload(sock, frame):
+    return recv_exact(sock, frame.size) if frame.size else b''
+
+
+def encode_json(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def decode_json(data):
+    try:
+        return json.loads(data.decode('utf-8'))
+    except ValueError as e:
+        raise ProtocolError(f'Malformed JSON payload: {e}') from None
@@ -0,0 +1,126 @@
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+
+import merkle
+
+# Transfer order for one sync. Changed files are handed to transfer workers
+# by priority class rather than walk order, so the files a node needs to open
+# the project land first even when gigabytes of content are queued behind
+# them. Within the content class, files go smallest first or newest first.
+
+PROJECT = 0
+CONFIG = 1
+CODE = 2
+CONTENT = 3
+CLASS_NAMES = {PROJECT: 'project', CONFIG: 'config', CODE: 'code', CONTENT: 'content'}
+
+DESCRIPTOR_EXTENSIONS = {'.uproject', '.uplugin'}
+CODE_FOLDERS = {'source', 'plugins', 'binaries'}
+CONTENT_EXTENSIONS = {'.uasset', '.umap', '.uexp', '.ubulk', '.uptnl', '.pak', '.utoc', '.ucas'}
+
+CONTENT_ORDERS = ('size', 'recent')
+
+
+def priority_class(relative_path):
+    path = merkle.normalize(relative_path).lower()
+    extension = os.path.splitext(path)[1]
+    if extension in DESCRIPTOR_EXTENSIONS:
+        return PROJECT
+    top = path.split(merkle.SEPARATOR, 1)[0]
+    if extension == '.ini' or top == 'config':
+        return CONFIG
+    if top in CODE_FOLDERS and extension not in CONTENT_EXTENSIONS:
+        return CODE
+    return CONTENT
+
+
+def is_launchable(relative_path):
+    # Part of the minimum set a node needs before it can open the project
+    return priority_class(relative_path) < CONTENT
+
+
+# Priority queue between the diff stage and the transfer workers, with the
+# queue.Queue put/get interface the pipeline stages use. It also counts the
+# launchable files still in flight and calls on_launchable once the diff has
+# finished and every one of them has been acknowledged. `stopped`, if given,
+# returns True once the sync is stopping early; the diff may not have queued
+# the whole set then, so it is never reported as landed.
+class TransferScheduler:
+    def __init__(self, content_order='size', on_launchable=None, stopped=None):
+        self.content_order = content_order
+        self.on_launchable = on_launchable
+        self.stopped = stopped
+        self.heap = []
+        self.order = itertools.count()
+        self.ready = threading.Condition()
+        self.started = time.perf_counter()
+        self.closed = False
+        self.launchable = 0
+        self.remaining = 0
+        self.launchable_seconds = None
+
+    def key(self, item):
+        priority = priority_class(item.relative_path)
+        if priority != CONTENT:
+            return priority, 0
+        if self.content_order == 'recent':
+            return priority, -item.mtime
+        return priority, item.size
+
+    def put(self, item):
+        reached = False
+        with self.ready:
+            if not hasattr(item, 'relative_path'):
+                # End-of-input markers sort after every transfer
+                heapq.heappush(self.heap, ((CONTENT + 1, 0), next(self.order), item))
+                self.closed = True
+                reached = self._reached()
+            else:
+                heapq.heappush(self.heap, (self.key(item), next(self.order), item))
+                if is_launchable(item.relative_path):
+                    self.launchable += 1
+                    self.remaining += 1
+            self.ready.notify()
+        if reached:
+            self._announce()
+
+    def get(self, timeout=None):
+        # Like queue.Queue.get: raises queue.Empty if nothing arrives in time
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.heap, timeout):
+                raise queue.Empty
+            return heapq.heappop(self.heap)[2]
+
+    def track(self, items, future):
+        # Count launchable items as landed once the listener acknowledges them
+        items = [item for item in items if is_launchable(item.relative_path)]
+        if items:
+            future.add_done_callback(lambda f: self._landed(items, f))
+
+    def _landed(self, items, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        failed = future.result().frame.meta.get('failed', {})
+        count = sum(1 for item in items if merkle.normalize(item.relative_path) not in failed)
+        with self.ready:
+            self.remaining -= count
+            reached = self._reached()
+        if reached:
+            self._announce()
+
+    def _reached(self):
+        # True exactly once, when the launchable set has fully landed
+        if self.closed and self.remaining <= 0 and self.launchable_seconds is None:
+            if self.stopped is not None and self.stopped():
+                return False
+            self.launchable_seconds = time.perf_counter() - self.started
+            return True
+        return False
+
+    def _announce(self):
+        if self.on_launchable:
+            self.on_launchable(self.launchable_seconds)
@@ -0,0 +1,1120 @@
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import batching
+import compression
+import delta
+import hashing
+import instrumentation
+import merkle
+import protocol
+import scheduler
+from client import FOLDER_TIMEOUT, ListenerSession, ReplyTimeout, SessionLost, Throttle, reply_timeout
+from manifest import SenderManifest
+from progress import SyncProgress
+
+DONE = object()
+CONNECT_TIMEOUT = 10
+# Longest wait for the listener's first checksum tree. A cold listener
+# hashes the whole project before answering, which can take many minutes.
+TREE_TIMEOUT = FOLDER_TIMEOUT
+
+# Only send a delta when it is meaningfully smaller than the whole file
+DELTA_MAX_RATIO = 0.9
+
+# Once the listener's tree is in, finished subtrees are compared before the
+# walk ends when they hold this much freshly hashed data. Small files count
+# as STREAM_DIFF_MIN_FILE each.
+STREAM_DIFF_BYTES = 64 * 1024 * 1024
+STREAM_DIFF_MIN_FILE = 64 * 1024
+
+# Smaller files are cheaper to send than to look up on the listener
+DEDUP_MIN_SIZE = 64 * 1024
+
+# Files this large ask the listener for a partial copy to resume before sending
+RESUME_MIN_SIZE = 8 * 1024 * 1024
+
+# `have` marks content the listener already holds under another path
+Transfer = namedtuple('Transfer', ['relative_path', 'file_path', 'size', 'digest', 'remote_digest', 'have',
+                                   'mtime'], defaults=[False, 0])
+
+
+# Busy time and item count for one pipeline stage. Time a stage spends blocked
+# on its queues (or waiting for results from an earlier stage) is not counted,
+# so utilization shows which stage the others are waiting on.
+class Stage:
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self.busy = 0.0
+        self.items = 0
+        self.lock = threading.Lock()
+
+    def work(self, seconds, items=0):
+        with self.lock:
+            self.busy += seconds
+            self.items += items
+
+    def utilization(self, wall):
+        return min(1.0, self.busy / (wall * self.workers)) if wall else 0.0
+
+
+# One worker's view of its input and output queues. It records how long the
+# worker sat blocked, and remembers whether the end-of-input marker was seen
+# so a failed worker can drain its input instead of stalling the producer.
+class StageRun:
+    def __init__(self, in_queue=None, out_queue=None):
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.idle = 0.0
+        self.items_seen = 0
+        self.finished = in_queue is None
+
+    def items(self, timeout=None):
+        # `timeout`, if given, returns how long to wait for the next item
+        # (None for as long as it takes); None is yielded when that runs out
+        while not self.finished:
+            started = time.perf_counter()
+            try:
+                item = self.in_queue.get(timeout=timeout() if timeout else None)
+            except queue.Empty:
+                item = None
+            self.idle += time.perf_counter() - started
+            if item is DONE:
+                self.finished = True
+                return
+            if item is None:
+                yield None
+                continue
+            self.items_seen += 1
+            yield item
+
+    def put(self, item):
+        started = time.perf_counter()
+        self.out_queue.put(item)
+        self.idle += time.perf_counter() - started
+
+    def wait(self, future, session=None, timeout=None):
+        # A reply on `session` that does not come within the session's
+        # timeout (or `timeout`) drops that session and raises
+        started = time.perf_counter()
+        try:
+            if session is None:
+                return future.result()
+            if timeout is None:
+                return session.wait(future)
+            return session.wait(future, timeout)
+        finally:
+            self.idle += time.perf_counter() - started
+
+
+# Staged sync: walk -> hash -> diff -> N transfer workers, joined by bounded
+# queues. The listener builds its checksum tree while we walk and hash, and
+# only the diff stage waits for it.
+class SyncPipeline:
+    def __init__(self, listener_ip, editor_folder, listener_folder, hash_engine,
+                 algorithms=None, force_rehash=False, transfer_workers=4, queue_depth=256,
+                 delta_threshold=delta.DELTA_THRESHOLD, block_size=delta.BLOCK_SIZE, codecs=(),
+                 batch_size=batching.MAX_BATCH_BYTES, content_order='size', on_launchable=None,
+                 zero_copy=True, manifest=None, index=None, throttle=None, cancel=None,
+                 port=protocol.DEFAULT_PORT, cache_dir=None, profiler=None, progress=None, dry_run=False,
+                 on_synced=None, log=print):
+        self.listener_ip = listener_ip
+        self.port = port
+        self.editor_folder = editor_folder
+        self.listener_folder = listener_folder
+        self.hash_engine = hash_engine
+        self.algorithms = algorithms
+        self.force_rehash = force_rehash
+        self.transfer_workers = max(1, transfer_workers)
+        self.queue_depth = max(1, queue_depth)
+        self.delta_threshold = delta_threshold
+        self.block_size = block_size
+        self.codecs = list(codecs)
+        self.batch_size = batch_size
+        self.content_order = content_order
+        self.zero_copy = zero_copy
+        # Called with (target, seconds) once the files needed to open the
+        # project have landed, before the rest of the content
+        self.on_launchable = on_launchable
+        # Called with (listener_ip, summary) as soon as this listener's sync
+        # ends, while other listeners of a fan-out sync may still be running
+        self.on_synced = on_synced
+        self.compression = compression.CompressionStats()
+        # Per-phase timings and per-file latency for the end-of-sync report,
+        # and an optional instrumentation.Profiler that every stage runs under
+        self.metrics = instrumentation.Metrics()
+        self.profiler = profiler
+        # Aggregate file and byte counters for a progress display, shared
+        # between the pipelines of a fan-out sync
+        self.progress = progress or SyncProgress()
+        # A dry run compares both sides and lists what a sync would send
+        # without sending anything
+        self.dry_run = dry_run
+        self.differences = []
+        # Fan-out syncs share one manifest and a pre-hashed local index
+        # between nodes, and one throttle for the outbound bandwidth cap
+        self.manifest = manifest
+        self.cache_dir = cache_dir
+        self.index = index
+        self.throttle = throttle
+        self.log = log
+        self.target = f'{listener_ip}:{listener_folder}'
+        self.stages = {
+            'walk': Stage('walk'),
+            'hash': Stage('hash', hash_engine.workers),
+            'diff': Stage('diff'),
+            'transfer': Stage('transfer', self.transfer_workers),
+        }
+        self.errors = []
+        self.seen = set()
+        self.hashed_bytes = 0
+        self.sent = 0
+        self.sent_bytes = 0
+        self.wire_bytes = 0
+        self.delta_files = 0
+        self.delta_saved = 0
+        self.dedup_files = 0
+        self.dedup_saved = 0
+        self.batches = 0
+        self.batch_files = 0
+        self.failed = 0
+        self.resumed_bytes = 0
+        self.lock = threading.Lock()
+        # abort stops this sync after an error; cancelled is the caller's
+        # cooperative cancel, which may be shared by several pipelines
+        self.abort = threading.Event()
+        self.cancelled = cancel or threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def stopping(self):
+        return self.abort.is_set() or self.cancelled.is_set()
+
+    def run(self, control=None, listener_reply=None):
+        if control is None:
+            with ListenerSession(self.listener_ip, self.port, timeout=CONNECT_TIMEOUT, throttle=self.throttle,
+                                 cancel=self.cancelled) as control:
+                control.hello(self.algorithms, self.codecs)
+                return self.run(control)
+
+        if not os.path.isdir(self.editor_folder):
+            raise ValueError('Editor folder path is invalid.')
+
+        self.log(f'Syncing from {self.editor_folder} to {self.target}')
+        self.progress.set_phase('scanning')
+        start = time.perf_counter()
+        self.algorithm = control.algorithm
+        self.log(f'Using {self.algorithm} checksums')
+        self.owns_manifest = owns_manifest = self.manifest is None
+        if owns_manifest:
+            self.manifest = SenderManifest(self.editor_folder, self.algorithm, self.cache_dir)
+
+        # Ask for the listener's checksum tree first; it is built while we hash
+        self.control = control
+        self.listener_reply = listener_reply or control.request_tree(self.listener_folder, refresh=True,
+                                                                     force=self.force_rehash)
+
+        hash_queue = queue.Queue(self.queue_depth)
+        diff_queue = queue.Queue(self.queue_depth)
+        # Transfers leave in priority order rather than walk order
+        self.scheduler = transfer_queue = scheduler.TransferScheduler(self.content_order, self.launchable,
+                                                                      self.stopping)
+        workers = [
+            (self.walk, None, hash_queue, 1),
+            (self.hash, hash_queue, diff_queue, 1),
+            (self.diff, diff_queue, transfer_queue, self.transfer_workers),
+        ] + [(self.transfer, transfer_queue, None, 0)] * self.transfer_workers
+        threads = [threading.Thread(target=self._run_stage, args=worker, daemon=True)
+                   for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if owns_manifest:
+            # A stopped walk has not seen every file, so nothing is pruned
+            if not self.errors and not self.cancelled.is_set():
+                self.manifest.prune(self.seen)
+            self.manifest.save()
+        wall = time.perf_counter() - start
+        # Cumulative since the listener started; a cancelled session cannot send
+        self.listener_stats = None
+        if not self.cancelled.is_set():
+            try:
+                self.listener_stats = control.stats()
+            except Exception as e:
+                self.log(f'Could not fetch listener stats: {e}')
+        self.report(wall)
+        summary = self.summary(wall)
+        if self.on_synced is not None:
+            self.on_synced(self.listener_ip, summary)
+        return summary
+
+    def _run_stage(self, func, in_queue, out_queue, consumers):
+        run = StageRun(in_queue, out_queue)
+        stage = self.stages[func.__name__]
+        started = time.perf_counter()
+        try:
+            if self.profiler is not None:
+                self.profiler.run(func, run)
+            else:
+                func(run)
+        except protocol.Cancelled:
+            # Cancelled while waiting on the listener; not an error
+            for _ in run.items():
+                pass
+        except Exception as e:
+            with self.lock:
+                self.errors.append(e)
+            self.log(f'Error in {stage.name} stage: {e}')
+            self.abort.set()
+            # Keep consuming so the stage feeding us does not block forever
+            for _ in run.items():
+                pass
+        finally:
+            if out_queue is not None:
+                for _ in range(consumers):
+                    out_queue.put(DONE)
+            if func != self.hash:
+                stage.work(time.perf_counter() - started - run.idle, run.items_seen)
+
+    def walk(self, run):
+        if self.index is not None:
+            for relative_path, file_path, st, digest in self.index:
+                if self.stopping():
+                    return
+                self.seen.add(relative_path)
+                run.items_seen += 1
+                run.put((relative_path, file_path, st, digest))
+            return
+        for root, dirs, files in os.walk(self.editor_folder):
+            for file in files:
+                if self.stopping():
+                    return
+                file_path = os.path.join(root, file)
+                relative_path = os.path.relpath(file_path, self.editor_folder)
+                try:
+                    st = os.stat(file_path)
+                except OSError as e:
+                    # A broken symlink or a file deleted mid-walk is skipped
+                    # like one that fails to hash
+                    self.log(f'Error reading {file_path}: {e}')
+                    continue
+                digest = None if self.force_rehash else self.manifest.lookup(relative_path, st)
+                self.seen.add(relative_path)
+                run.items_seen += 1
+                self.progress.scan()
+                run.put((relative_path, file_path, st, digest))
+
+    def hash(self, run):
+        # Stale files go to the shared hash engine; their futures travel
+        # downstream in walk order, so the bounded diff queue caps how far
+        # hashing can run ahead of the diff.
+        for relative_path, file_path, st, digest in run.items():
+            if digest is None and not self.stopping():
+                digest = self.hash_engine.submit(file_path, self.algorithm)
+            run.put((relative_path, file_path, st, digest))
+
+    def diff(self, run):
+        # Files arrive in walk order, which finishes each directory's whole
+        # subtree before moving on. Once the listener's tree is in, finished
+        # subtrees holding enough freshly hashed files are compared straight
+        # away so their transfers overlap the rest of the hashing. Subtrees
+        # whose digests all came from the manifest wait for the final compare
+        # from the root, so a sync with no changes stays at one round trip.
+        self.local = {}
+        self.compared = set()
+        self.round_trips = 0
+        self.tree_bytes = 0
+        self.handed_off = 0
+        self.remote_root = None
+        uncompared = []
+        # Directories from the root down to the one being walked, each with
+        # the weight of freshly hashed files finished below it
+        open_dirs = [['', 0]]
+        # Finished subtrees not compared yet, by weight
+        pending = {}
+        # The listener folder is empty, so every file is sent as it is hashed
+        missing = False
+        for relative_path, file_path, st, digest in run.items():
+            if digest is None or self.stopping():
+                continue
+            weight = 0
+            if not isinstance(digest, str):
+                digest, result, seconds = run.wait(digest)
+                if digest is None:
+                    self.log(f'Error calculating checksum for {file_path}: {result}')
+                    continue
+                self.stages['hash'].work(seconds, 1)
+                self.metrics.record('hash', seconds, size=result)
+                self.hashed_bytes += result
+                self.manifest.update(relative_path, st, digest)
+                weight = max(result, STREAM_DIFF_MIN_FILE)
+            key = merkle.normalize(relative_path)
+            entry = self.local[key] = (relative_path, file_path, st, digest)
+
+            if self.remote_root is None and self.listener_reply.done():
+                missing = self.receive_tree(run)
+                if missing:
+                    self.send_missing(run, [self.local[key] for key in uncompared])
+                    uncompared = []
+            if missing:
+                self.send_missing(run, [entry])
+                continue
+            uncompared.append(key)
+
+            directory = merkle.parent(key)[0]
+            while not merkle.contains(open_dirs[-1][0], directory):
+                finished, finished_weight = open_dirs.pop()
+                if finished_weight:
+                    for child in [child for child in pending if merkle.contains(finished, child)]:
+                        del pending[child]
+                    pending[finished] = finished_weight
+                    open_dirs[-1][1] += finished_weight
+            top = open_dirs[-1][0]
+            if directory != top:
+                for name in directory[len(top) + 1 if top else 0:].split(merkle.SEPARATOR):
+                    open_dirs.append([merkle.join(open_dirs[-1][0], name), 0])
+            open_dirs[-1][1] += weight
+
+            if pending and sum(pending.values()) >= STREAM_DIFF_BYTES and self.remote_root is not None:
+                uncompared = self.compare_finished(run, pending, uncompared)
+                # Their weight no longer counts towards the open directory
+                # above them, which is still their parent
+                for root, root_weight in pending.items():
+                    for open_dir in open_dirs:
+                        if open_dir[0] == merkle.parent(root)[0]:
+                            open_dir[1] -= root_weight
+                pending.clear()
+        if self.stopping():
+            return
+
+        if self.remote_root is None:
+            missing = self.receive_tree(run)
+            if missing:
+                self.send_missing(run, [self.local[key] for key in uncompared])
+        if not missing:
+            if not self.handed_off:
+                self.progress.set_phase('comparing')
+            local_tree = merkle.build_tree({key: entry[3] for key, entry in self.local.items()})
+            self.hand_off(run, self.compare_trees(run, local_tree, [''], {'': self.remote_root}))
+        self.log(f'Compared checksum trees in {self.round_trips} round trips ({self.tree_bytes / 1e3:.1f} KB)')
+
+    def receive_tree(self, run):
+        # Takes in the listener's root node; True when its folder is empty
+        waited = time.perf_counter()
+        reply = run.wait(self.listener_reply, self.control, TREE_TIMEOUT)
+        self.metrics.add('listener_tree_wait', time.perf_counter() - waited)
+        info = reply.frame.meta
+        self.log(f'Received listener checksum tree ({info.get("files", 0)} files)')
+        cache_stats = info.get('cache')
+        if cache_stats:
+            self.log(f'Listener checksum cache: {cache_stats["hits"]} hits, '
+                     f'{cache_stats["misses"]} rehashed ({cache_stats["hit_rate"]:.0%} hit rate)')
+        if info.get('hashing'):
+            self.log(f'Listener: {hashing.format_rate(info["hashing"])}')
+        self.round_trips += 1
+        self.tree_bytes += len(reply.payload)
+        self.remote_root = protocol.decode_json(reply.payload).get('') or merkle.new_node()
+        return not self.remote_root['files'] and not self.remote_root['dirs']
+
+    def request_nodes(self, run, directories):
+        # The listener's tree nodes for `directories`, in one round trip
+        waited = time.perf_counter()
+        reply = run.wait(self.control.request_tree(self.listener_folder, directories), self.control)
+        self.metrics.record('tree_round_trip', time.perf_counter() - waited, files=0, size=len(reply.payload))
+        self.round_trips += 1
+        self.tree_bytes += len(reply.payload)
+        return protocol.decode_json(reply.payload)
+
+    def compare_finished(self, run, roots, uncompared):
+        # Compares the finished subtrees `roots` and hands their changes to
+        # the transfer workers; returns the files still waiting
+        files = {}
+        waiting = []
+        for key in uncompared:
+            directory = merkle.parent(key)[0]
+            while directory and directory not in roots:
+                directory = merkle.parent(directory)[0]
+            if directory:
+                files[key] = self.local[key][3]
+            else:
+                waiting.append(key)
+        local_tree = merkle.build_tree(files)
+        self.hand_off(run, self.compare_trees(run, local_tree, list(roots), self.request_nodes(run, roots)))
+        self.compared.update(roots)
+        return waiting
+
+    def compare_trees(self, run, local_tree, level, remote):
+        # Descend one level per round trip from `level`, only into
+        # directories whose hashes differ from the listener's. Subtrees
+        # compared earlier are left out.
+        changed = []
+        while level and not self.stopping():
+            next_level = []
+            for directory in level:
+                node = local_tree[directory]
+                remote_node = remote.get(directory) or merkle.new_node()
+                if remote_node['hash'] == node['hash']:
+                    self.unchanged(local_tree, directory)
+                    continue
+                for name in node['files']:
+                    self.compare(changed, self.local[merkle.join(directory, name)], remote_node['files'].get(name))
+                for name, subtree_hash in node['dirs'].items():
+                    child = merkle.join(directory, name)
+                    if child in self.compared:
+                        continue
+                    if remote_node['dirs'].get(name) == subtree_hash:
+                        self.unchanged(local_tree, child)
+                    elif name in remote_node['dirs']:
+                        next_level.append(child)
+                    else:
+                        # Missing on the listener, nothing to compare against
+                        for key in merkle.iter_files(local_tree, child, self.compared):
+                            self.compare(changed, self.local[key], None)
+            if next_level:
+                remote = self.request_nodes(run, next_level)
+            level = next_level
+        return changed
+
+    def send_missing(self, run, entries):
+        changed = []
+        for entry in entries:
+            self.compare(changed, entry, None)
+        self.hand_off(run, changed, dedup=False)
+
+    def hand_off(self, run, changed, dedup=True):
+        # Moved or duplicated assets: ask which contents the listener already
+        # has under another path so they can be copied there instead of sent
+        wanted = {item.digest for item in changed if item.size >= DEDUP_MIN_SIZE} if dedup else ()
+        have = set()
+        if wanted and not self.stopping():
+            waited = time.perf_counter()
+            reply = run.wait(self.control.find_content(self.listener_folder, wanted), self.control)
+            self.metrics.record('find_content', time.perf_counter() - waited, files=len(wanted))
+            have = set(protocol.decode_json(reply.payload))
+        if self.dry_run:
+            self.differences.extend({'path': merkle.normalize(item.relative_path), 'size': item.size,
+                                     'state': 'changed' if item.remote_digest else 'missing'} for item in changed)
+            return
+        if not changed:
+            return
+        self.handed_off += len(changed)
+        self.progress.plan(len(changed), sum(item.size for item in changed))
+        for item in changed:
+            run.put(item._replace(have=item.digest in have))
+
+    def compare(self, changed, entry, listener_checksum):
+        relative_path, file_path, st, digest = entry
+        if listener_checksum != digest:
+            if listener_checksum and self.manifest.confirmed_digest(self.target, relative_path) == digest:
+                self.log(f'{relative_path} was changed on the listener since the last sync, overwriting')
+            self.log(f'Would sync {relative_path}' if self.dry_run else f'Syncing {relative_path}...')
+            changed.append(Transfer(relative_path, file_path, st.st_size, digest, listener_checksum,
+                                    mtime=st.st_mtime))
+        else:
+            self.manifest.confirm(self.target, relative_path, digest)
+            self.log(f'Skipping {relative_path} (unchanged)')
+
+    def unchanged(self, local_tree, directory):
+        count = 0
+        for key in merkle.iter_files(local_tree, directory, self.compared):
+            relative_path, _, _, digest = self.local[key]
+            self.manifest.confirm(self.target, relative_path, digest)
+            count += 1
+        self.log(f'Skipping {directory or "."} ({count} files unchanged)')
+
+    def transfer(self, run):
+        # Each worker pushes over its own session so transfers overlap on the wire
+        if self.dry_run:
+            for _ in run.items():
+                pass
+            return
+        pending = []
+        batch_limit = min(batching.MAX_FILE_SIZE, self.batch_size)
+        batch = batching.Batch(self.batch_size)
+        batch_class = None
+        session = self.open_session()
+        sessions = [session]
+
+        def live():
+            # A send cut off part way closes its session; carry on over a new one
+            nonlocal session
+            if session.closed:
+                session = self.open_session()
+                sessions.append(session)
+            return session
+
+        try:
+            for item in run.items(lambda: batch.time_left()):
+                if item is None:
+                    # No file came to fill the open batch before its delay ran out
+                    if not self.stopping():
+                        pending.extend(self.send_batch(live(), batch))
+                    batch = batching.Batch(self.batch_size)
+                    continue
+                if self.stopping():
+                    continue
+                session = live()
+                priority = scheduler.priority_class(item.relative_path)
+                if batch.items and priority != batch_class:
+                    # Do not hold higher-priority files back behind the next class
+                    pending.extend(self.send_batch(session, batch))
+                    batch = batching.Batch(self.batch_size)
+                if item.size < batch_limit and not item.have:
+                    batch_class = priority
+                    batch.add(item)
+                    if batch.full():
+                        pending.extend(self.send_batch(session, batch))
+                        batch = batching.Batch(self.batch_size)
+                    continue
+                dest_path = os.path.join(self.listener_folder, item.relative_path)
+                started = time.perf_counter()
+                sent = None
+                try:
+                    if item.have:
+                        sent = ('dedup', 0, session.materialize(dest_path, item.digest))
+                    if (sent is None and self.delta_threshold and item.remote_digest
+                            and item.size >= self.delta_threshold):
+                        sent = self.send_delta(session, item, dest_path)
+                    if sent is None and session.codec:
+                        sent = self.send_compressed(session, item, dest_path)
+                    if sent is None:
+                        sent = self.send_full(session, item, dest_path)
+                except Exception as e:
+                    # Only this file fails; a file deleted since it was hashed
+                    # leaves the session usable
+                    if isinstance(e, ReplyTimeout):
+                        self.stalled(e)
+                    self.fail_items([item], e)
+                    continue
+                self.measure(sent[0], started, sent[2], 1, sent[1])
+                self.scheduler.track([item], sent[2])
+                pending.append((item,) + sent + (session,))
+            if batch.items and not self.stopping():
+                pending.extend(self.send_batch(live(), batch))
+
+            # Wait for the listener to acknowledge each write
+            while pending:
+                item, kind, wire_size, future, sent_on = pending.pop(0)
+                if kind == 'batch':
+                    pending.extend(self.finish_batch(run, live, item, wire_size, future, sent_on))
+                    continue
+                try:
+                    try:
+                        reply = run.wait(future, sent_on, reply_timeout(item.size))
+                        if 'cpu' in reply.frame.meta:
+                            self.compression.add_remote(reply.frame.meta['cpu'])
+                    except Exception as e:
+                        lost = isinstance(e, SessionLost) and not self.stopping()
+                        if isinstance(e, ReplyTimeout) or (kind not in ('delta', 'dedup') and not lost):
+                            raise
+                        # A delta the listener could not apply, content it no
+                        # longer has, or a send on a session that broke under
+                        # another file falls back to a full copy
+                        if lost:
+                            self.log(f'Sending {item.relative_path} failed ({e}), retrying on a new session')
+                        elif kind == 'delta':
+                            self.log(f'Patching {item.relative_path} failed ({e}), sending the whole file')
+                        else:
+                            self.log(f'Copying {item.relative_path} from content already on the listener '
+                                     f'failed ({e}), sending the whole file')
+                        dest_path = os.path.join(self.listener_folder, item.relative_path)
+                        sent_on = live()
+                        kind, retry_size, retry = self.send_full(sent_on, item, dest_path)
+                        self.scheduler.track([item], retry)
+                        run.wait(retry, sent_on, reply_timeout(item.size))
+                        wire_size += retry_size
+                    self.manifest.confirm(self.target, item.relative_path, item.digest)
+                    self.progress.advance(1, item.size)
+                    with self.lock:
+                        self.sent += 1
+                        self.sent_bytes += item.size
+                        self.wire_bytes += wire_size
+                        if kind == 'delta':
+                            self.delta_files += 1
+                            self.delta_saved += item.size - wire_size
+                        elif kind == 'dedup':
+                            self.dedup_files += 1
+                            self.dedup_saved += item.size
+                except Exception as e:
+                    if isinstance(e, ReplyTimeout):
+                        self.stalled(e)
+                    self.fail_items([item], e)
+        finally:
+            for session in sessions:
+                session.close()
+
+    def open_session(self):
+        session = ListenerSession(self.listener_ip, self.port, timeout=CONNECT_TIMEOUT, throttle=self.throttle,
+                                  cancel=self.cancelled, zero_copy=self.zero_copy)
+        try:
+            session.hello([self.algorithm], self.codecs)
+        except Exception:
+            session.close()
+            raise
+        return session
+
+    def stalled(self, error):
+        # The listener stopped answering: its session is already dropped, and
+        # the sync stops rather than waiting out every remaining reply
+        with self.lock:
+            first = not self.abort.is_set()
+            if first:
+                self.errors.append(error)
+            self.abort.set()
+        if first:
+            self.log(f'Error in transfer stage: {error}')
+
+    def fail_items(self, items, error):
+        self.progress.advance(failed=len(items))
+        with self.lock:
+            self.failed += len(items)
+        if not self.cancelled.is_set():
+            for item in items:
+                self.log(f'Error syncing {item.relative_path}: {error}')
+
+    def launchable(self, seconds):
+        if self.dry_run:
+            return
+        self.log(f'Launchable set landed after {seconds:.2f}s '
+                 f'({self.scheduler.launchable} project, config and code files sent)')
+        if self.on_launchable:
+            self.on_launchable(self.target, seconds)
+
+    def measure(self, kind, started, future, files, wire_size):
+        # Time from starting a send until the listener acknowledges it
+        def done(future):
+            if not future.cancelled() and future.exception() is None:
+                self.metrics.record(f'send_{kind}', time.perf_counter() - started, files, wire_size)
+        future.add_done_callback(done)
+
+    def send_batch(self, session, batch):
+        started = time.perf_counter()
+        items, entries, payload, errors = batch.read()
+        for item, e in errors:
+            self.fail_items([item], e)
+        if not items:
+            return []
+        chunks = None
+        if session.codec:
+            chunks = batching.compress_payload(payload, session.codec, self.compression)
+        wire_size = sum(len(chunk) for chunk in chunks) if chunks is not None else len(payload)
+        try:
+            future = session.send_batch(self.listener_folder, entries, payload, chunks)
+        except Exception as e:
+            self.fail_items(items, e)
+            return []
+        self.measure('batch', started, future, len(items), wire_size)
+        self.scheduler.track(items, future)
+        return [(items, 'batch', wire_size, future, session)]
+
+    def finish_batch(self, run, live, items, wire_size, future, session):
+        # Returns full-file retries for every item if the batch was refused
+        # or lost; live() gives the session to resend them on
+        try:
+            reply = run.wait(future, session, reply_timeout(sum(item.size for item in items)))
+        except Exception as e:
+            if isinstance(e, ReplyTimeout):
+                self.stalled(e)
+            if self.stopping():
+                self.fail_items(items, e)
+                return []
+            self.log(f'Batch of {len(items)} files failed ({e}), sending them one by one')
+            retries = []
+            for item in items:
+                try:
+                    session = live()
+                    retry = self.send_full(session, item, os.path.join(self.listener_folder, item.relative_path))
+                except Exception as e:
+                    self.fail_items([item], e)
+                    continue
+                self.scheduler.track([item], retry[2])
+                retries.append((item,) + retry + (session,))
+            return retries
+        failed = reply.frame.meta.get('failed', {})
+        if 'cpu' in reply.frame.meta:
+            self.compression.add_remote(reply.frame.meta['cpu'])
+        done = 0
+        done_bytes = 0
+        for item in items:
+            error = failed.get(merkle.normalize(item.relative_path))
+            if error:
+                self.log(f'Error syncing {item.relative_path}: {error}')
+                continue
+            self.manifest.confirm(self.target, item.relative_path, item.digest)
+            done += 1
+            done_bytes += item.size
+        self.progress.advance(done, done_bytes, len(items) - done)
+        with self.lock:
+            self.sent += done
+            self.sent_bytes += done_bytes
+            self.wire_bytes += wire_size
+            self.failed += len(items) - done
+            self.batches += 1
+            self.batch_files += done
+        return []
+
+    def resume_offset(self, session, item, dest_path):
+        if item.size < RESUME_MIN_SIZE:
+            return 0
+        offset = session.resume_offset(dest_path, item.digest)
+        if offset >= item.size:
+            return 0
+        if offset:
+            self.log(f'Resuming {item.relative_path} at {offset / 1e6:.1f} of {item.size / 1e6:.1f} MB')
+            with self.lock:
+                self.resumed_bytes += offset
+        return offset
+
+    def send_full(self, session, item, dest_path):
+        offset = self.resume_offset(session, item, dest_path)
+        future = session.send_file(item.file_path, dest_path, {'digest': item.digest}, offset)
+        return 'full', item.size - offset, future
+
+    def send_compressed(self, session, item, dest_path):
+        try:
+            worthwhile = compression.should_compress(item.file_path, item.size, session.codec)
+        except OSError:
+            worthwhile = False
+        if not worthwhile:
+            self.compression.skip()
+            return None
+        offset = self.resume_offset(session, item, dest_path)
+        meta = {'digest': item.digest, 'offset': offset} if offset else {'digest': item.digest}
+        wire_size = 0
+
+        def counted(chunks):
+            nonlocal wire_size
+            for chunk in chunks:
+                wire_size += len(chunk)
+                yield chunk
+
+        chunks = compression.iter_compressed(item.file_path, session.codec, self.compression, offset=offset)
+        future = session.send_compressed(dest_path, counted(chunks), meta)
+        return 'compressed', wire_size, future
+
+    def send_delta(self, session, item, dest_path):
+        try:
+            table = delta.parse_signatures(session.get_signatures(dest_path, self.block_size, item.size))
+            ops = delta.compute_delta(item.file_path, table, self.block_size)
+        except ReplyTimeout:
+            raise
+        except Exception as e:
+            self.log(f'No delta for {item.relative_path} ({e}), sending the whole file')
+            return None
+        size = delta.delta_size(ops)
+        if size >= item.size * DELTA_MAX_RATIO:
+            return None
+        self.log(f'Sending {item.relative_path} as a delta: {size / 1e6:.1f} of {item.size / 1e6:.1f} MB')
+        meta = {'block_size': self.block_size, 'digest': item.digest}
+        return 'delta', size, session.send_stream(protocol.CMD_SYNC_DELTA, dest_path,
+                                                  delta.iter_delta(item.file_path, ops), size, meta)
+
+    def report(self, wall):
+        if self.owns_manifest:
+            stats = self.manifest.stats()
+            self.log(f'Local checksum cache: {stats["hits"]} hits, '
+                     f'{stats["misses"]} rehashed ({stats["hit_rate"]:.0%} hit rate)')
+            hash_stage = self.stages['hash']
+            self.log('Local: ' + hashing.format_rate({'files': hash_stage.items, 'bytes': self.hashed_bytes,
+                                                      'seconds': hash_stage.busy / hash_stage.workers}))
+        if self.dry_run:
+            self.log(f'Verified in {wall:.2f}s: {len(self.differences)} files differ from the listener')
+            return
+        launchable_seconds = self.scheduler.launchable_seconds
+        if launchable_seconds is None and not self.scheduler.remaining:
+            self.log('Launchable set incomplete: the sync stopped before it was all sent')
+        elif launchable_seconds is None:
+            self.log(f'Launchable set incomplete: {self.scheduler.remaining} project, config or code files did not land')
+        else:
+            self.log(f'Time to launchable: {launchable_seconds:.2f}s, full sync: {wall:.2f}s')
+        usage = ', '.join(f'{name} {stage.utilization(wall):.0%}' for name, stage in self.stages.items())
+        self.log(f'Stage utilization over {wall:.2f}s: {usage}')
+        self.log(f'Sent {self.sent} files ({self.sent_bytes / 1e6:.1f} MB, {self.wire_bytes / 1e6:.1f} MB on the wire) '
+                 f'with {self.transfer_workers} transfer workers')
+        if self.delta_files:
+            self.log(f'Delta transfer saved {self.delta_saved / 1e6:.1f} MB across {self.delta_files} files')
+        if self.batches:
+            self.log(f'Packed {self.batch_files} small files into {self.batches} batch frames')
+        if self.resumed_bytes:
+            self.log(f'Resumed interrupted transfers, skipping {self.resumed_bytes / 1e6:.1f} MB already on the listener')
+        if self.cancelled.is_set():
+            self.log('Sync cancelled; interrupted files resume on the next sync')
+        if self.dedup_files:
+            self.log(f'Deduplication saved {self.dedup_saved / 1e6:.1f} MB: {self.dedup_files} files '
+                     f'copied from content already on the listener')
+        if self.codecs:
+            self.log(self.compression.describe())
+        for line in instrumentation.describe(self.metrics.snapshot()):
+            self.log(f'Phase {line}')
+        if self.listener_stats:
+            write_phases = ('receive_file', 'receive_batch', 'receive_delta', 'materialize', 'hash')
+            for line in instrumentation.describe(self.listener_stats, write_phases):
+                self.log(f'Listener {line}')
+
+    def summary(self, wall):
+        return {
+            'seconds': wall,
+            'launchable_seconds': None if self.dry_run else self.scheduler.launchable_seconds,
+            'cancelled': self.cancelled.is_set(),
+            'resumed_bytes': self.resumed_bytes,
+            'files': len(self.seen),
+            'hashed': self.stages['hash'].items,
+            'hashed_bytes': self.hashed_bytes,
+            'sent': self.sent,
+            'sent_bytes': self.sent_bytes,
+            'wire_bytes': self.wire_bytes,
+            'delta_files': self.delta_files,
+            'delta_saved': self.delta_saved,
+            'dedup_files': self.dedup_files,
+            'dedup_saved': self.dedup_saved,
+            'batches': self.batches,
+            'batch_files': self.batch_files,
+            'compression': self.compression.as_dict(),
+            'failed': self.failed,
+            'errors': [str(e) for e in self.errors],
+            'utilization': {name: stage.utilization(wall) for name, stage in self.stages.items()},
+            'stages': {name: {'workers': stage.workers, 'busy': stage.busy, 'items': stage.items}
+                       for name, stage in self.stages.items()},
+            'metrics': self.metrics.snapshot(),
+            'listener': self.listener_stats,
+            'dry_run': self.dry_run,
+            'differences': self.differences,
+        }
+
+
+def build_local_index(editor_folder, manifest, hash_engine, algorithm, force_rehash=False, log=print,
+                      progress=None):
+    # One walk and hashing pass over the editor project, reusing manifest
+    # digests for files whose stat did not change
+    index = []
+    stale = []
+    for root, dirs, files in os.walk(editor_folder):
+        for file in files:
+            file_path = os.path.join(root, file)
+            relative_path = os.path.relpath(file_path, editor_folder)
+            try:
+                st = os.stat(file_path)
+            except OSError as e:
+                log(f'Error reading {file_path}: {e}')
+                continue
+            digest = None if force_rehash else manifest.lookup(relative_path, st)
+            if digest is None:
+                stale.append(len(index))
+            index.append((relative_path, file_path, st, digest))
+            if progress is not None:
+                progress.scan()
+
+    digests, stats = hash_engine.hash_files(
+        [index[i][1] for i in stale], algorithm,
+        on_error=lambda path, e: log(f'Error calculating checksum for {path}: {e}'))
+    for i, digest in zip(stale, digests):
+        relative_path, file_path, st, _ = index[i]
+        index[i] = (relative_path, file_path, st, digest)
+        if digest:
+            manifest.update(relative_path, st, digest)
+    return [entry for entry in index if entry[3]], stats
+
+
+# Sync one editor project to many listeners. The local tree is walked and
+# hashed once while every listener builds its checksum list; then each node
+# gets its own diff/transfer pipeline, at most max_nodes at a time, with all
+# of them sharing one outbound bandwidth cap. A node that fails is reported
+# in the summary without holding up the others.
+class MultiTargetSync:
+    def __init__(self, listener_ips, editor_folder, listener_folder, hash_engine, algorithms=None,
+                 force_rehash=False, max_nodes=4, bandwidth=0, log=print, **pipeline_options):
+        self.listener_ips = list(dict.fromkeys(listener_ips))
+        self.editor_folder = editor_folder
+        self.listener_folder = listener_folder
+        self.hash_engine = hash_engine
+        self.algorithms = algorithms or hashing.available_algorithms()
+        self.force_rehash = force_rehash
+        self.max_nodes = max(1, max_nodes)
+        self.throttle = Throttle(bandwidth) if bandwidth else None
+        self.log = log
+        self.pipeline_options = pipeline_options
+        # One cancel event stops every node's pipeline, and one progress
+        # object adds up all of their transfers
+        self.cancelled = pipeline_options.setdefault('cancel', threading.Event())
+        self.progress = pipeline_options.setdefault('progress', SyncProgress())
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def connect(self, ip):
+        session = ListenerSession(ip, self.pipeline_options.get('port', protocol.DEFAULT_PORT),
+                                  timeout=CONNECT_TIMEOUT, throttle=self.throttle,
+                                  cancel=self.cancelled)
+        try:
+            session.hello(self.algorithms, self.pipeline_options.get('codecs', ()))
+        except Exception:
+            session.close()
+            raise
+        return session
+
+    def common_algorithm(self, sessions):
+        # First algorithm in our preference list that every node supports
+        for name in self.algorithms:
+            if all(name in session.peer_algorithms for session in sessions):
+                return name
+        return hashing.DEFAULT_ALGORITHM
+
+    def run(self):
+        if not os.path.isdir(self.editor_folder):
+            raise ValueError('Editor folder path is invalid.')
+        start = time.perf_counter()
+        results = {}
+        sessions = {}
+        self.log(f'Syncing from {self.editor_folder} to {len(self.listener_ips)} listeners')
+
+        # Connect and hello time out, so a node that accepts the connection
+        # but never answers is reported as failed instead of holding up the rest
+        with ThreadPoolExecutor(max_workers=len(self.listener_ips)) as pool:
+            futures = {pool.submit(self.connect, ip): ip for ip in self.listener_ips}
+            for future in as_completed(futures):
+                ip = futures[future]
+                try:
+                    sessions[ip] = future.result()
+                except Exception as e:
+                    results[ip] = {'error': f'Could not connect: {e}'}
+                    self.log(f'[{ip}] Could not connect: {e}')
+        if not sessions:
+            return self.summary(results, time.perf_counter() - start)
+
+        try:
+            algorithm = self.common_algorithm(sessions.values())
+            for ip, session in list(sessions.items()):
+                if session.algorithm != algorithm:
+                    try:
+                        session.hello([algorithm], self.pipeline_options.get('codecs', ()))
+                    except Exception as e:
+                        results[ip] = {'error': f'Could not agree on {algorithm}: {e}'}
+                        self.log(f'[{ip}] Could not agree on {algorithm}: {e}')
+                        session.close()
+                        del sessions[ip]
+            if not sessions:
+                return self.summary(results, time.perf_counter() - start)
+            self.log(f'Using {algorithm} checksums on every node')
+
+            # Every listener builds its checksum list while we hash once locally
+            replies = {ip: session.request_tree(self.listener_folder, refresh=True, force=self.force_rehash)
+                       for ip, session in sessions.items()}
+            manifest = SenderManifest(self.editor_folder, algorithm, self.pipeline_options.get('cache_dir'))
+            self.progress.set_phase('scanning')
+            index, hash_stats = build_local_index(self.editor_folder, manifest, self.hash_engine,
+                                                  algorithm, self.force_rehash, self.log, self.progress)
+            self.log(f'Local: {hashing.format_rate(hash_stats)}')
+
+            def sync_node(ip):
+                pipeline = SyncPipeline(ip, self.editor_folder, self.listener_folder, self.hash_engine,
+                                        force_rehash=self.force_rehash, manifest=manifest, index=index,
+                                        throttle=self.throttle, log=lambda message: self.log(f'[{ip}] {message}'),
+                                        **self.pipeline_options)
+                return pipeline.run(sessions[ip], replies[ip])
+
+            with ThreadPoolExecutor(max_workers=self.max_nodes) as pool:
+                # Each node's waits on its listener are bounded, so one that
+                # stops acknowledging fails on its own while the rest finish
+                futures = {pool.submit(sync_node, ip): ip for ip in sessions}
+                for future in as_completed(futures):
+                    ip = futures[future]
+                    try:
+                        results[ip] = future.result()
+                    except Exception as e:
+                        results[ip] = {'error': str(e)}
+                        self.log(f'[{ip}] Sync failed: {e}')
+
+            manifest.prune({entry[0] for entry in index})
+            manifest.save()
+        finally:
+            for session in sessions.values():
+                session.close()
+
+        return self.summary(results, time.perf_counter() - start)
+
+    def summary(self, results, wall):
+        self.log(f'Fan-out sync finished in {wall:.2f}s:')
+        for ip in self.listener_ips:
+            result = results.get(ip, {'error': 'not synced'})
+            if 'error' in result:
+                self.log(f'  {ip}: FAILED - {result["error"]}')
+            elif result['errors']:
+                # Stopped part way, for example when the listener stopped answering
+                self.log(f'  {ip}: FAILED - {result["errors"][0]}, {result["sent"]} files sent before that')
+            else:
+                state = 'ok' if not result['failed'] and not result['errors'] else 'incomplete'
+                self.log(f'  {ip}: {state}, {result["sent"]} files sent ({result["wire_bytes"] / 1e6:.1f} MB on the wire), '
+                         f'{result["failed"]} failed, {result["seconds"]:.2f}s')
+        return {
+            'seconds': wall,
+            'cancelled': self.cancelled.is_set(),
+            'nodes': results,
+            'sent': sum(r.get('sent', 0) for r in results.values()),
+            'failed': sum(r.get('failed', 0) for r in results.values()),
+            'errors': [f'{ip}: {r["error"]}' for ip, r in results.items() if 'error' in r]
+                      + [f'{ip}: {e}' for ip, r in results.items() for e in r.get('errors', [])],
+        }
+
+
+def create_sync(listener_ips, editor_folder, listener_folder, hash_engine, max_nodes=4, bandwidth=0,
+                **options):
+    # A single-listener pipeline, or a fan-out sync when there are several
+    # listeners. `bandwidth` caps the total outbound rate in bytes per second.
+    if len(listener_ips) > 1:
+        return MultiTargetSync(listener_ips, editor_folder, listener_folder, hash_engine,
+                               max_nodes=max_nodes, bandwidth=bandwidth, **options)
+    return SyncPipeline(listener_ips[0], editor_folder, listener_folder, hash_engine,
+                        throttle=Throttle(bandwidth) if bandwidth else None, **options)
+
+
+def run_sync(listener_ips, editor_folder, listener_folder, hash_engine, max_nodes=4, bandwidth=0,
+             report_dir=None, **options):
+    # One sync the way the GUI and the command line run it: under the
+    # profiler when one is given, followed by a JSON report (and the profile)
+    # under report_dir. Returns (summary, report); report['path'] is missing
+    # if the report could not be written.
+    log = options.get('log', print)
+    profiler = options.get('profiler')
+    pipeline = create_sync(listener_ips, editor_folder, listener_folder, hash_engine, max_nodes, bandwidth,
+                           **options)
+    summary = profiler.run(pipeline.run) if profiler is not None else pipeline.run()
+    settings = dict(options, max_nodes=max_nodes, bandwidth=bandwidth)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'editor_folder': editor_folder,
+        'listener_folder': listener_folder,
+        'listeners': list(listener_ips),
+        'settings': {key: value for key, value in settings.items()
+                     if isinstance(value, (str, int, float, bool, list, type(None)))},
+        'summary': summary,
+    }
+    try:
+        report['path'] = instrumentation.write_report(report, instrumentation.report_path(directory=report_dir))
+        log(f'Sync report written to {report["path"]}')
+        if profiler is not None:
+            profile_path = profiler.save(instrumentation.report_path(extension='prof', directory=report_dir))
+            if profile_path:
+                report['profile'] = profile_path
+                log(f'Profile written to {profile_path} (open with python -m pstats)')
+    except OSError as e:
+        log(f'Error writing sync report: {e}')
+    return summary, report
+
+
+def outcome(summary):
+    # Closing status line for a sync summary
+    if summary['cancelled']:
+        return 'Sync cancelled. Interrupted files resume on the next sync.'
+    if summary['errors']:
+        return 'Sync stopped because of errors.'
+    if summary['failed']:
+        return f'Sync finished with {summary["failed"]} of {summary["failed"] + summary["sent"]} files failed.'
+    return 'Folders synced successfully.'
@@ -0,0 +1,77 @@
+import os
+import queue
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batching
+from scheduler import TransferScheduler
+from sync_engine import DONE, StageRun, Transfer
+
+
+def transfer(relative_path, size):
+    return Transfer(relative_path, relative_path, size, 'digest', None)
+
+
+# [user-014] Small files packed into batch frames
+class BatchTest(unittest.TestCase):
+    def test_full_by_size_and_count(self):
+        batch = batching.Batch(max_bytes=100)
+        batch.add(transfer('a.ini', 60))
+        self.assertFalse(batch.full())
+        batch.add(transfer('b.ini', 60))
+        self.assertTrue(batch.full())
+
+        batch = batching.Batch()
+        for i in range(batching.MAX_BATCH_FILES):
+            batch.add(transfer(f'{i}.ini', 1))
+        self.assertTrue(batch.full())
+
+    def test_time_left(self):
+        batch = batching.Batch()
+        self.assertIsNone(batch.time_left())
+        batch.add(transfer('a.ini', 1))
+        self.assertLessEqual(batch.time_left(), batching.MAX_BATCH_DELAY)
+        time.sleep(batching.MAX_BATCH_DELAY)
+        self.assertEqual(batch.time_left(), 0)
+        self.assertTrue(batch.full())
+
+    def test_read_leaves_out_unreadable_files(self):
+        path = os.path.abspath(__file__)
+        batch = batching.Batch()
+        batch.add(Transfer('ok.py', path, os.path.getsize(path), 'digest', None))
+        batch.add(Transfer('gone.py', path + '.gone', 1, 'digest', None))
+        items, entries, payload, errors = batch.read()
+        self.assertEqual([item.relative_path for item in items], ['ok.py'])
+        self.assertEqual(entries, [['ok.py', len(payload), 'digest']])
+        self.assertEqual([item.relative_path for item, _ in errors], ['gone.py'])
+
+
+# [user-014] The transfer stage wakes up when an open batch is due, even if no
+# further file arrives to notice it
+class BatchDelayTest(unittest.TestCase):
+    def test_scheduler_get_times_out(self):
+        with self.assertRaises(queue.Empty):
+            TransferScheduler().get(timeout=0.01)
+
+    def test_items_yields_none_when_the_wait_runs_out(self):
+        scheduler = TransferScheduler()
+        scheduler.put(transfer('a.ini', 1))
+        run = StageRun(scheduler)
+        batch = batching.Batch()
+        seen = []
+        for item in run.items(lambda: batch.time_left()):
+            seen.append(item)
+            if item is None:
+                batch = batching.Batch()
+                scheduler.put(DONE)
+            else:
+                batch.add(item)
+        self.assertEqual([item and item.relative_path for item in seen], ['a.ini', None])
+        self.assertEqual(run.items_seen, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import cli
+import listener
+
+
+# [user-021] The command line drives the sync engine without the GUI
+class ArgumentTest(unittest.TestCase):
+    def test_project_folder(self):
+        self.assertEqual(cli.project_folder(os.path.join('Proj', 'Game.uproject')), 'Proj')
+        self.assertEqual(cli.project_folder('Proj'), 'Proj')
+
+    def test_listener_list(self):
+        self.assertEqual(cli.listener_list(' 10.0.0.5, 10.0.0.6,'), ['10.0.0.5', '10.0.0.6'])
+        with self.assertRaises(argparse.ArgumentTypeError):
+            cli.listener_list(' , ')
+
+    def test_startup_imports(self):
+        # Parsing arguments loads neither the engine nor PyQt6
+        code = ('import sys, cli; cli.build_parser().parse_args(["stats", "--listeners", "x"]); '
+                'print(sorted({"sync_engine", "PyQt6", "listener"} & set(sys.modules)))')
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), '[]')
+
+
+class CommandTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        self.source = os.path.join(self.tmp.name, 'source')
+        self.destination = os.path.join(self.tmp.name, 'destination')
+        os.makedirs(os.path.join(self.source, 'Content'))
+        with open(os.path.join(self.source, 'Game.uproject'), 'w') as f:
+            f.write('{}')
+        self.server = listener.ListenerServer('127.0.0.1', 0, cache_dir=os.path.join(self.tmp.name, 'listener'))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.assertTrue(self.server.ready.wait(10))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_cli(self, *argv):
+        # Returns (exit status, stdout). The sender's manifest cache goes
+        # under a home folder of the test's own.
+        result = subprocess.run([sys.executable, 'cli.py', *argv], cwd=ROOT, capture_output=True, text=True,
+                                timeout=60, env=dict(os.environ, HOME=self.tmp.name, USERPROFILE=self.tmp.name))
+        return result.returncode, result.stdout
+
+    def sync_args(self, command):
+        return [command, '--listeners', '127.0.0.1', '--port', str(self.server.port),
+                '--project', os.path.join(self.source, 'Game.uproject'), '--listener-project', self.destination,
+                '--report-dir', os.path.join(self.tmp.name, 'reports'), '--quiet']
+
+    def test_sync_then_verify(self):
+        status, output = self.run_cli(*self.sync_args('sync'), '--json')
+        self.assertEqual(status, cli.EXIT_OK)
+        self.assertEqual(json.loads(output)['sent'], 1)
+        self.assertTrue(os.path.isfile(os.path.join(self.destination, 'Game.uproject')))
+        self.assertEqual(self.run_cli(*self.sync_args('verify')), (cli.EXIT_OK, ''))
+
+        with open(os.path.join(self.source, 'Content', 'a.uasset'), 'wb') as f:
+            f.write(b'new')
+        status, output = self.run_cli(*self.sync_args('verify'))
+        self.assertEqual(status, cli.EXIT_FAILED)
+        self.assertEqual(output.split('\t')[0], '127.0.0.1')
+        self.assertIn(os.path.join('Content', 'a.uasset'), output)
+
+    def test_stats(self):
+        status, output = self.run_cli('stats', '--listeners', '127.0.0.1', '--port', str(self.server.port), '--json')
+        self.assertEqual(status, cli.EXIT_OK)
+        self.assertIn('uptime', json.loads(output)['127.0.0.1'])
+
+    def test_stats_unreachable(self):
+        status, output = self.run_cli('stats', '--listeners', '127.0.0.1', '--port', '1', '--timeout', '1')
+        self.assertEqual(status, cli.EXIT_FAILED)
+        self.assertTrue(output.startswith('127.0.0.1: '))
+
+
+if __name__ == '__main__':
+    unittest.main()
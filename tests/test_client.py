@@ -0,0 +1,156 @@
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import client
+import protocol
+
+
+class SocketPairTest(unittest.TestCase):
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+        self.receiver.settimeout(10)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+        self.tmp.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def drain(self, received):
+        # Read everything the sender writes until it closes its end
+        def run():
+            while data := self.receiver.recv(65536):
+                received.append(data)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+
+# [user-017] Zero-copy sends still pass through the throttle and cancel checks,
+# one CHUNK_SIZE slice at a time
+class SendfileSliceTest(SocketPairTest):
+    def test_throttled(self):
+        data = os.urandom(2 * protocol.CHUNK_SIZE + 100)
+        path = self.write('a.uasset', data)
+        consumed = []
+
+        class RecordingThrottle:
+            def consume(self, size):
+                consumed.append(size)
+
+        received = []
+        thread = self.drain(received)
+        with open(path, 'rb') as f:
+            sent = client.ThrottledSocket(self.sender, RecordingThrottle()).sendfile(f, 0, len(data))
+        self.sender.close()
+        thread.join(10)
+        self.assertEqual(sent, len(data))
+        self.assertEqual(consumed, [protocol.CHUNK_SIZE, protocol.CHUNK_SIZE, 100])
+        self.assertEqual(b''.join(received), data)
+
+    def test_cancelled_part_way(self):
+        # The cancel comes in while the first slice is on the wire
+        data = os.urandom(4 * protocol.CHUNK_SIZE)
+        path = self.write('a.uasset', data)
+        cancel = threading.Event()
+        sock = self.sender
+
+        class CancelAfterSlice:
+            def sendfile(self, file, offset, count):
+                sent = sock.sendfile(file, offset, count)
+                cancel.set()
+                return sent
+
+        received = []
+        thread = self.drain(received)
+        with open(path, 'rb') as f, self.assertRaises(protocol.Cancelled):
+            client.CancellableSocket(CancelAfterSlice(), cancel).sendfile(f, 0, len(data))
+        self.sender.close()
+        thread.join(10)
+        self.assertEqual(b''.join(received), data[:protocol.CHUNK_SIZE])
+
+
+# A listener that accepts connections and never answers
+class SilentListenerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.connections = []
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def tearDown(self):
+        for conn in self.connections:
+            conn.close()
+        self.server.close()
+
+    def accept(self):
+        try:
+            while True:
+                self.connections.append(self.server.accept()[0])
+        except OSError:
+            pass
+
+    def session(self, cancel=None):
+        session = client.ListenerSession('127.0.0.1', self.server.getsockname()[1], timeout=10, cancel=cancel)
+        self.addCleanup(session.close, 1)
+        return session
+
+
+# [user-011] Replies are waited for with a limit, so a listener that goes quiet
+# fails its session instead of stalling the sync
+class ReplyTimeoutTest(SilentListenerTest):
+    def test_timeout(self):
+        session = self.session()
+        other = session.request(protocol.CMD_GET_STATS)
+        started = time.monotonic()
+        with self.assertRaises(client.ReplyTimeout):
+            session.wait(session.request(protocol.CMD_HELLO), timeout=0.3)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertTrue(session.closed)
+        # Dropping the session fails everything else still waiting on it
+        with self.assertRaises(client.SessionLost):
+            other.result(5)
+
+    def test_timeout_grows_with_size(self):
+        self.assertEqual(client.reply_timeout(0), client.REPLY_TIMEOUT)
+        self.assertEqual(client.reply_timeout(10 * client.SLOW_DISK_RATE), client.REPLY_TIMEOUT + 10)
+
+
+# [user-016] A cancel ends a wait for a reply straight away
+class CancelTest(SilentListenerTest):
+    def test_cancel(self):
+        cancel = threading.Event()
+        session = self.session(cancel)
+        threading.Timer(0.2, cancel.set).start()
+        started = time.monotonic()
+        with self.assertRaises(protocol.Cancelled):
+            session.wait(session.request(protocol.CMD_HELLO))
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertTrue(session.closed)
+
+
+# [user-011] One bandwidth cap shared by every session of a fan-out sync
+class ThrottleTest(unittest.TestCase):
+    def test_rate(self):
+        throttle = client.Throttle(1024 * 1024, burst=64 * 1024)
+        started = time.monotonic()
+        for _ in range(4):
+            throttle.consume(64 * 1024)
+        # The burst goes at once; the other 192 KB wait for tokens at 1 MB/s
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+
+
+if __name__ == '__main__':
+    unittest.main()
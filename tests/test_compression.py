@@ -0,0 +1,63 @@
+import io
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compression
+import hashing
+
+
+# [user-010] Per-file compression, chosen by a trial on each file's first
+# bytes; corrupt input is covered in test_protocol
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_negotiate(self):
+        self.assertEqual(compression.negotiate(['zstd', 'zlib'], ['zlib', 'lzma']), 'zlib')
+        self.assertIsNone(compression.negotiate(['zstd'], ['zlib']))
+        self.assertEqual(compression.codec_preference('off'), [])
+        self.assertEqual(compression.codec_preference('auto'), compression.available_codecs())
+
+    def test_should_compress(self):
+        text = self.path('a.ini', b'[Section]\nKey=Value\n' * 1000)
+        noise = self.path('b.uasset', random.Random(1).randbytes(64 * 1024))
+        packed = self.path('c.pak', b'\0' * 64 * 1024)
+        tiny = self.path('d.ini', b'\0' * 100)
+        self.assertTrue(compression.should_compress(text, os.path.getsize(text), 'zlib'))
+        self.assertFalse(compression.should_compress(noise, os.path.getsize(noise), 'zlib'))
+        self.assertFalse(compression.should_compress(packed, os.path.getsize(packed), 'zlib'))
+        self.assertFalse(compression.should_compress(tiny, os.path.getsize(tiny), 'zlib'))
+
+    def test_round_trip(self):
+        data = b'[Section]\nKey=Value\n' * 20000
+        path = self.path('a.ini', data)
+        for codec in compression.available_codecs():
+            with self.subTest(codec=codec):
+                stats = compression.CompressionStats()
+                chunks = list(compression.iter_compressed(path, codec, stats, chunk_size=64 * 1024, offset=7))
+                self.assertGreater(len(chunks), 1)
+                out = io.BytesIO()
+                digest = hashing.new_hasher()
+                written, _ = compression.decompress_into(chunks, out, codec, digest)
+                self.assertEqual(out.getvalue(), data[7:])
+                self.assertEqual(written, len(data) - 7)
+                self.assertEqual(stats.as_dict()['bytes_in'], len(data) - 7)
+                self.assertLess(stats.as_dict()['ratio'], compression.MAX_RATIO)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import io
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import delta
+import protocol
+
+BLOCK_SIZE = 4096
+
+
+# [user-009] Which blocks a delta copies and which bytes it sends; wire round
+# trips of whole deltas are in test_protocol
+class DeltaTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.basis_data = random.Random(9).randbytes(20 * BLOCK_SIZE)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def round_trip(self, data):
+        # Returns (ops, rebuilt bytes) for turning the basis into `data`
+        basis_path = self.path('basis', self.basis_data)
+        source_path = self.path('source', data)
+        table = delta.parse_signatures(delta.file_signatures(basis_path, BLOCK_SIZE))
+        ops = delta.compute_delta(source_path, table, BLOCK_SIZE)
+        payload = b''.join(delta.iter_delta(source_path, ops))
+        self.assertEqual(len(payload), delta.delta_size(ops))
+        out = io.BytesIO()
+        with open(basis_path, 'rb') as basis:
+            self.assertEqual(self.apply(payload, basis, out), len(data))
+        return ops, out.getvalue()
+
+    def apply(self, payload, basis, out):
+        sender, receiver = socket.socketpair()
+        with sender, receiver:
+            thread = threading.Thread(target=sender.sendall, args=(payload,))
+            thread.start()
+            try:
+                return delta.apply_delta(receiver, len(payload), basis, out, BLOCK_SIZE)
+            finally:
+                thread.join()
+
+    def test_unchanged(self):
+        ops, rebuilt = self.round_trip(self.basis_data)
+        self.assertEqual(ops, [('copy', 0, 20)])
+        self.assertEqual(rebuilt, self.basis_data)
+
+    def test_insert_shifts_the_rest(self):
+        # Blocks after an insertion match at their new offsets
+        data = self.basis_data[:5 * BLOCK_SIZE + 100] + b'inserted' + self.basis_data[5 * BLOCK_SIZE + 100:]
+        ops, rebuilt = self.round_trip(data)
+        self.assertEqual(rebuilt, data)
+        self.assertLessEqual(delta.literal_bytes(ops), BLOCK_SIZE + len(b'inserted'))
+
+    def test_overrun(self):
+        # A literal longer than the frame that carries it
+        payload = delta.LITERAL.pack(delta.OP_LITERAL, 100) + bytes(10)
+        with self.assertRaises(protocol.ProtocolError):
+            self.apply(payload, io.BytesIO(), io.BytesIO())
+
+
+if __name__ == '__main__':
+    unittest.main()
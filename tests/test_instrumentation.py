@@ -0,0 +1,39 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import instrumentation
+
+
+# [user-019] Per-phase counters and latency histograms
+class MetricsTest(unittest.TestCase):
+    def test_snapshot(self):
+        metrics = instrumentation.Metrics()
+        metrics.record('hash', 0.5, files=1, size=1000)
+        metrics.record('hash', 1.5, files=1, size=3000)
+        snapshot = metrics.snapshot()
+        hash_phase = snapshot['phases']['hash']
+        self.assertEqual((hash_phase['calls'], hash_phase['files'], hash_phase['bytes']), (2, 2, 4000))
+        self.assertEqual(hash_phase['bytes_per_second'], 2000)
+        self.assertEqual(snapshot['latency']['hash']['count'], 2)
+
+    def test_snapshot_reset_loses_nothing(self):
+        # Counts added while snapshots reset the metrics show up in exactly one snapshot
+        metrics = instrumentation.Metrics()
+        calls = 20000
+        recorder = threading.Thread(target=lambda: [metrics.add('send', 0.001) for _ in range(calls)])
+        recorder.start()
+        seen = 0
+        while recorder.is_alive():
+            seen += metrics.snapshot(reset=True)['phases'].get('send', {}).get('calls', 0)
+        recorder.join()
+        seen += metrics.snapshot(reset=True)['phases'].get('send', {}).get('calls', 0)
+        self.assertEqual(seen, calls)
+        self.assertEqual(metrics.snapshot()['phases'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import launcher
+
+JOINED = 'LogConcert: Display: Editor_1 joined session Session_1\n'
+
+
+# Stands in for an editor process that runs until exit() is called
+class FakeProcess:
+    def __init__(self):
+        self.exited = threading.Event()
+
+    def exit(self):
+        self.exited.set()
+
+    def poll(self):
+        return 0 if self.exited.is_set() else None
+
+    def wait(self):
+        self.exited.wait(10)
+        return 0
+
+
+# [user-021] Unreal command lines, shared by the GUI and the command line
+class CommandTest(unittest.TestCase):
+    def test_editor_command(self):
+        command = launcher.editor_command('UnrealEditor.exe', 'Game.uproject', 'unrealMUS', 'Session_1', 'Node_2')
+        self.assertEqual(command[:3], ['UnrealEditor.exe', 'Game.uproject', 'Log=Node_2.log'])
+        self.assertIn('-CONCERTSESSION="Session_1"', command)
+        self.assertIn('-CONCERTDISPLAYNAME="Node_2"', command)
+
+    def test_server_command(self):
+        editor = os.path.join('Engine', 'Binaries', 'Win64', 'UnrealEditor.exe')
+        command = launcher.server_command(editor, 'unrealMUS')
+        self.assertEqual(command[0], os.path.join('Engine', 'Binaries', 'Win64', launcher.SERVER_EXECUTABLE))
+        self.assertIn('-CONCERTSERVER=unrealMUS', command)
+
+    def test_check_paths(self):
+        with self.assertRaises(ValueError):
+            launcher.check_paths('', __file__)
+        with self.assertRaises(ValueError):
+            launcher.check_paths(__file__, __file__ + '.missing')
+        launcher.check_paths(__file__, __file__)
+
+
+# [user-022] Editors launched on behalf of a main app: only Unreal binaries,
+# and ready once their log shows they joined the session
+class EditorTest(unittest.TestCase):
+    def test_is_editor(self):
+        self.assertTrue(launcher.is_editor(os.path.join('Win64', 'UnrealEditor.exe')))
+        self.assertTrue(launcher.is_editor('/opt/ue/UnrealEditor-Cmd'))
+        self.assertFalse(launcher.is_editor(os.path.join('Win64', 'cmd.exe')))
+        self.assertFalse(launcher.is_editor(''))
+
+
+class WatchEditorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.log_path = launcher.editor_log_path(os.path.join(self.tmp.name, 'Game.uproject'))
+        os.makedirs(os.path.dirname(self.log_path))
+        self.process = FakeProcess()
+        self.ready = []
+
+    def tearDown(self):
+        self.process.exit()
+        self.tmp.cleanup()
+
+    def watch(self):
+        return launcher.watch_editor(self.process, self.log_path, self.ready.append, poll_interval=0.01)
+
+    def write_later(self, lines, encoding='utf-8'):
+        def write():
+            with open(self.log_path, 'a', encoding=encoding) as f:
+                for line in lines:
+                    f.write(line)
+                    f.flush()
+                    time.sleep(0.05)
+            self.process.exit()
+        threading.Timer(0.05, write).start()
+
+    def test_joined(self):
+        self.write_later(['LogInit: Display: Starting\n', JOINED, 'LogConcert: more\n'])
+        self.assertEqual(self.watch(), 0)
+        self.assertEqual(len(self.ready), 1)
+
+    def test_utf16_log(self):
+        self.write_later([JOINED], encoding='utf-16-le')
+        self.watch()
+        self.assertEqual(len(self.ready), 1)
+
+    def test_stale_log_ignored(self):
+        # A log from an earlier run already says joined; it must not count
+        with open(self.log_path, 'w') as f:
+            f.write(JOINED)
+        old = time.time() - 3600
+        os.utime(self.log_path, (old, old))
+        threading.Timer(0.3, self.process.exit).start()
+        self.watch()
+        self.assertEqual(self.ready, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
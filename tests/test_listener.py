@@ -0,0 +1,128 @@
+import os
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import delta
+import hashing
+import listener
+import protocol
+
+# Listener request handlers, served over a socket pair: the test holds the
+# sender's end and the listener's serve_connection runs on the other.
+
+
+class ListenerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = self.tmp.name
+        self.client, server_end = socket.socketpair()
+        self.client.settimeout(10)
+        self.server = listener.ListenerServer(cache_dir=os.path.join(self.folder, 'manifests'))
+        self.server.connection_slots.acquire()
+        self.thread = threading.Thread(target=self.server.serve_connection, args=(server_end, 'test'),
+                                       daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.client.close()
+        self.thread.join(10)
+        self.tmp.cleanup()
+
+    def reply(self):
+        frame = protocol.recv_frame(self.client)
+        return frame, protocol.recv_payload(self.client, frame)
+
+    def send_file(self, dest_path, data, request_id=1):
+        digest = hashing.new_hasher()
+        digest.update(data)
+        protocol.send_frame(self.client, protocol.CMD_SYNC_FILE, dest_path, {'digest': digest.hexdigest()}, data,
+                            request_id=request_id)
+        return digest.hexdigest()
+
+    def assert_session_alive(self):
+        protocol.send_frame(self.client, protocol.CMD_HELLO, meta={'algorithms': [hashing.DEFAULT_ALGORITHM]},
+                            request_id=99)
+        frame, _ = self.reply()
+        self.assertEqual((frame.command, frame.request_id), (protocol.CMD_ACK, 99))
+
+
+class ReceiveFileTest(ListenerTest):
+    def test_receive(self):
+        dest = os.path.join(self.folder, 'Content', 'a.uasset')
+        self.send_file(dest, b'content')
+        frame, _ = self.reply()
+        self.assertEqual(frame.command, protocol.CMD_ACK)
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), b'content')
+
+    def test_destination_cannot_be_replaced(self):
+        # A directory where the file should go fails that file only
+        dest = os.path.join(self.folder, 'Content', 'a.uasset')
+        os.makedirs(os.path.join(dest, 'inside'))
+        digest = self.send_file(dest, b'content', request_id=5)
+        frame, _ = self.reply()
+        self.assertEqual((frame.command, frame.request_id), (protocol.CMD_ERROR, 5))
+        self.assertFalse(os.path.exists(listener.partial_path(dest, digest)))
+        self.assert_session_alive()
+
+    def test_digest_mismatch(self):
+        dest = os.path.join(self.folder, 'a.uasset')
+        protocol.send_frame(self.client, protocol.CMD_SYNC_FILE, dest, {'digest': 'not the digest'}, b'content')
+        frame, _ = self.reply()
+        self.assertEqual(frame.command, protocol.CMD_ERROR)
+        self.assertFalse(os.path.exists(dest))
+        self.assert_session_alive()
+
+
+class ReceiveDeltaTest(ListenerTest):
+    def send_delta(self, dest_path, source_path, block_size=4096):
+        table = delta.parse_signatures(delta.file_signatures(dest_path, block_size))
+        ops = delta.compute_delta(source_path, table, block_size)
+        with open(source_path, 'rb') as f:
+            digest = hashing.new_hasher()
+            digest.update(f.read())
+        payload = b''.join(delta.iter_delta(source_path, ops))
+        protocol.send_frame(self.client, protocol.CMD_SYNC_DELTA, dest_path,
+                            {'block_size': block_size, 'digest': digest.hexdigest()}, payload)
+
+    # [user-016] The rebuilt file is written to a temp file private to the
+    # connection, which is gone once the destination is replaced
+    def test_patch(self):
+        dest = os.path.join(self.folder, 'a.uasset')
+        source = os.path.join(self.folder, 'source.uasset')
+        with open(dest, 'wb') as f:
+            f.write(b'x' * 16384)
+        with open(source, 'wb') as f:
+            f.write(b'x' * 8192 + b'changed' + b'x' * 8192)
+        self.send_delta(dest, source)
+        frame, _ = self.reply()
+        self.assertEqual(frame.command, protocol.CMD_ACK)
+        with open(dest, 'rb') as f, open(source, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+        self.assertEqual(sorted(os.listdir(self.folder)), ['a.uasset', 'source.uasset'])
+
+    def test_scratch_paths_differ_per_thread(self):
+        # Two connections served at once never share a temp file
+        paths = []
+        both_running = threading.Barrier(2)
+
+        def serve():
+            paths.append(listener.scratch_path('a.uasset', 'delta'))
+            both_running.wait(10)
+
+        threads = [threading.Thread(target=serve) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(paths)), 2)
+        self.assertTrue(all(path.endswith('.tmp') for path in paths))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from manifest import ChecksumCache
+
+
+class ChecksumCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, 'project')
+        os.makedirs(self.root)
+        self.cache = ChecksumCache(self.root, cache_dir=os.path.join(self.tmp.name, 'manifests'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add(self, relative_path, digest):
+        path = os.path.join(self.root, relative_path)
+        with open(path, 'wb') as f:
+            f.write(digest.encode('utf-8'))
+        self.cache.update(relative_path, os.stat(path), digest)
+
+    def paths(self, digest):
+        return [relative_path for relative_path, _ in self.cache.find(digest)]
+
+    def test_duplicates_stay_findable(self):
+        self.add('a.uasset', 'same')
+        self.add('b.uasset', 'same')
+        self.assertEqual(self.paths('same'), ['a.uasset', 'b.uasset'])
+
+        self.cache.remove('a.uasset')
+        self.assertEqual(self.paths('same'), ['b.uasset'])
+        # Rewriting the remaining copy with new content drops the old digest
+        self.add('b.uasset', 'other')
+        self.assertEqual(self.paths('same'), [])
+        self.assertEqual(self.paths('other'), ['b.uasset'])
+
+    def test_prune_and_reload(self):
+        self.add('a.uasset', 'same')
+        self.add('b.uasset', 'same')
+        self.add('c.uasset', 'same')
+        self.cache.prune({'b.uasset', 'c.uasset'})
+        self.assertEqual(self.paths('same'), ['b.uasset', 'c.uasset'])
+        self.cache.save()
+
+        reloaded = ChecksumCache(self.root, cache_dir=self.cache.cache_dir)
+        self.assertEqual([relative_path for relative_path, _ in reloaded.find('same')], ['b.uasset', 'c.uasset'])
+        self.assertEqual(reloaded.find('missing'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import merkle
+
+CHECKSUMS = {
+    'Game.uproject': 'p',
+    'Config/Game.ini': 'c',
+    'Content/Maps/Main.umap': 'm',
+    'Content/Props/Chair.uasset': 'a',
+    'Content/Props/Table.uasset': 't',
+}
+
+
+# [user-012] Directory hash tree structure; tree exchange over the wire is in
+# test_protocol
+class TreeTest(unittest.TestCase):
+    def test_structure(self):
+        tree = merkle.build_tree(CHECKSUMS)
+        self.assertEqual(sorted(tree), ['', 'Config', 'Content', 'Content/Maps', 'Content/Props'])
+        self.assertEqual(tree['Content/Props']['files'], {'Chair.uasset': 'a', 'Table.uasset': 't'})
+        self.assertEqual(tree['Content']['dirs'], {'Maps': tree['Content/Maps']['hash'],
+                                                   'Props': tree['Content/Props']['hash']})
+
+    def test_change_reaches_only_ancestors(self):
+        before = merkle.build_tree(CHECKSUMS)
+        after = merkle.build_tree(dict(CHECKSUMS, **{'Content/Props/Chair.uasset': 'changed'}))
+        for directory in ['', 'Content', 'Content/Props']:
+            self.assertNotEqual(before[directory]['hash'], after[directory]['hash'])
+        for directory in ['Config', 'Content/Maps']:
+            self.assertEqual(before[directory]['hash'], after[directory]['hash'])
+
+    def test_renamed_file_changes_the_hash(self):
+        renamed = dict(CHECKSUMS)
+        renamed['Config/Engine.ini'] = renamed.pop('Config/Game.ini')
+        self.assertNotEqual(merkle.build_tree(renamed)['']['hash'], merkle.build_tree(CHECKSUMS)['']['hash'])
+
+    def test_iter_files_below(self):
+        tree = merkle.build_tree(CHECKSUMS)
+        self.assertEqual(sorted(merkle.iter_files(tree, 'Content', skip={'Content/Props'})),
+                         ['Content/Maps/Main.umap'])
+
+    def test_select(self):
+        tree = merkle.build_tree(CHECKSUMS)
+        self.assertEqual(merkle.select(tree, ['Config', 'Missing']), {'Config': tree['Config'], 'Missing': None})
+
+
+if __name__ == '__main__':
+    unittest.main()
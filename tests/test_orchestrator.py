@@ -0,0 +1,82 @@
+import os
+import stat
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import listener
+from hashing import HashEngine
+from orchestrator import SyncAndLaunch
+
+# Stands in for UnrealEditor: logs that it joined the session, under the name
+# given by its Log= argument, then exits
+FAKE_EDITOR = '''#!{python}
+import os, sys, time
+log_name = next(arg[4:] for arg in sys.argv if arg.startswith('Log='))
+log_path = os.path.join(os.path.dirname(sys.argv[1]), 'Saved', 'Logs', log_name)
+os.makedirs(os.path.dirname(log_path), exist_ok=True)
+time.sleep(0.2)
+with open(log_path, 'a') as f:
+    f.write('LogConcert: Display: Node joined session Session_1\\n')
+time.sleep(0.5)
+'''
+
+
+# [user-022] Sync to each listener and open the project there once its own
+# sync ends, timing every node up to the moment it joins the session
+@unittest.skipIf(os.name == 'nt', 'the stand-in editor is a script run through its shebang')
+class SyncAndLaunchTest(unittest.TestCase):
+    def setUp(self):
+        # Listener threads outlive the test and may still be saving their caches
+        self.tmp = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        self.source = os.path.join(self.tmp.name, 'source')
+        self.destination = os.path.join(self.tmp.name, 'destination')
+        os.makedirs(self.source)
+        with open(os.path.join(self.source, 'Game.uproject'), 'w') as f:
+            f.write('{}')
+        self.editor = os.path.join(self.tmp.name, 'UnrealEditor')
+        with open(self.editor, 'w') as f:
+            f.write(FAKE_EDITOR.format(python=sys.executable))
+        os.chmod(self.editor, os.stat(self.editor).st_mode | stat.S_IXUSR)
+        self.log = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def start_listener(self, **options):
+        server = listener.ListenerServer('127.0.0.1', 0, cache_dir=os.path.join(self.tmp.name, 'listener'),
+                                         **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.assertTrue(server.ready.wait(10))
+        return server
+
+    def run_launch(self, server):
+        orchestrator = SyncAndLaunch(['127.0.0.1'], self.source, os.path.join(self.destination, 'Game.uproject'),
+                                     HashEngine(), self.editor, 'unrealMUS', 'Session_1', session_timeout=30,
+                                     report_dir=os.path.join(self.tmp.name, 'reports'), port=server.port,
+                                     cache_dir=os.path.join(self.tmp.name, 'sender'), log=self.log.append)
+        return orchestrator.run()
+
+    def test_synced_then_joined(self):
+        summary, report = self.run_launch(self.start_listener(allow_launch=True))
+        self.assertEqual(summary['sent'], 1)
+        self.assertEqual(report['launch']['joined'], 1)
+        node = report['launch']['nodes']['127.0.0.1']
+        self.assertLessEqual(node['synced'], node['started'])
+        self.assertLessEqual(node['started'], node['joined'])
+        self.assertTrue(os.path.isfile(report['path']))
+
+    def test_launch_disabled(self):
+        summary, report = self.run_launch(self.start_listener())
+        self.assertEqual(summary['sent'], 1)
+        self.assertEqual(report['launch']['joined'], 0)
+        node = report['launch']['nodes']['127.0.0.1']
+        self.assertEqual(node['state'], 'failed')
+        self.assertIn('--allow-launch', node['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,402 @@
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compression
+import delta
+import hashing
+import listener
+import merkle
+import protocol
+
+# Loopback round trips for the wire format: frames go through a real socket
+# pair, with the sending side on its own thread so payloads larger than the
+# socket buffer do not deadlock.
+
+
+def random_bytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+class LoopbackTest(unittest.TestCase):
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+        self.receiver.settimeout(10)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = self.tmp.name
+        self.threads = []
+        self.send_error = None
+
+    def tearDown(self):
+        for thread in self.threads:
+            thread.join(10)
+        self.sender.close()
+        self.receiver.close()
+        self.tmp.cleanup()
+
+    def send(self, func, *args, **kwargs):
+        # Run a send on its own thread; errors are re-raised by finish()
+        def run():
+            try:
+                func(self.sender, *args, **kwargs)
+            except Exception as e:
+                self.send_error = e
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def finish(self):
+        for thread in self.threads:
+            thread.join(10)
+        if self.send_error is not None:
+            raise self.send_error
+
+    def write(self, name, data):
+        path = os.path.join(self.folder, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+
+class FrameTest(LoopbackTest):
+    def test_header_round_trip(self):
+        meta = {'digest': 'abc', 'files': [['Content/é.uasset', 3]]}
+        protocol.send_frame(self.sender, protocol.CMD_SYNC_FILE, 'Content/Maps/Ünïcode.umap', meta, b'xyz',
+                            protocol.FLAG_MORE, request_id=0xDEADBEEF)
+        frame = protocol.recv_frame(self.receiver)
+        self.assertEqual(frame.command, protocol.CMD_SYNC_FILE)
+        self.assertEqual(frame.flags, protocol.FLAG_MORE)
+        self.assertEqual(frame.request_id, 0xDEADBEEF)
+        self.assertEqual(frame.path, 'Content/Maps/Ünïcode.umap')
+        self.assertEqual(frame.meta, meta)
+        self.assertEqual(frame.size, 3)
+        self.assertEqual(protocol.recv_payload(self.receiver, frame), b'xyz')
+
+    def test_empty_frame(self):
+        protocol.send_frame(self.sender, protocol.CMD_HELLO)
+        frame = protocol.recv_frame(self.receiver)
+        self.assertEqual((frame.path, frame.meta, frame.size), ('', {}, 0))
+        self.assertEqual(protocol.recv_payload(self.receiver, frame), b'')
+
+    def test_closed_connection(self):
+        self.sender.close()
+        self.assertIsNone(protocol.recv_frame(self.receiver))
+
+    def test_bad_magic(self):
+        self.sender.sendall(b'XXXX' + bytes(protocol.HEADER.size - 4))
+        with self.assertRaises(protocol.ProtocolError):
+            protocol.recv_frame(self.receiver)
+
+    def test_bad_version(self):
+        header = protocol.HEADER.pack(protocol.MAGIC, protocol.PROTOCOL_VERSION + 1, protocol.CMD_HELLO,
+                                      0, 0, 0, 0, 0)
+        self.sender.sendall(header)
+        with self.assertRaises(protocol.ProtocolError):
+            protocol.recv_frame(self.receiver)
+
+    def test_truncated_payload(self):
+        self.sender.sendall(protocol.pack_header(protocol.CMD_SYNC_FILE, 'a', size=10) + b'12345')
+        self.sender.shutdown(socket.SHUT_WR)
+        frame = protocol.recv_frame(self.receiver)
+        with self.assertRaises(protocol.ProtocolError):
+            protocol.recv_payload(self.receiver, frame)
+
+    def test_chunked(self):
+        chunks = [random_bytes(size, size) for size in (1, 0, 70000, protocol.CHUNK_SIZE, 5)]
+        self.send(protocol.send_chunked, protocol.CMD_SYNC_BATCH, 'folder', chunks, {'n': 1}, request_id=7)
+        frame = protocol.recv_frame(self.receiver)
+        self.assertTrue(frame.flags & protocol.FLAG_CHUNKED)
+        self.assertEqual(frame.request_id, 7)
+        # Empty chunks are not sent, since a zero length ends the stream
+        self.assertEqual(list(protocol.iter_chunks(self.receiver)), [chunk for chunk in chunks if chunk])
+        self.finish()
+
+    def test_discard_chunked_frame(self):
+        protocol.send_chunked(self.sender, protocol.CMD_SYNC_BATCH, '', [b'a' * 100, b'b' * 100])
+        protocol.send_frame(self.sender, protocol.CMD_HELLO, 'next')
+        protocol.discard_frame(self.receiver, protocol.recv_frame(self.receiver))
+        self.assertEqual(protocol.recv_frame(self.receiver).path, 'next')
+
+    def test_stream_size_mismatch(self):
+        with self.assertRaises(protocol.ProtocolError):
+            protocol.send_stream(self.sender, protocol.CMD_SYNC_FILE, 'a', [b'abc'], 4)
+
+
+class MalformedTest(LoopbackTest):
+    def serve(self):
+        # The listener's side of the session runs on the receiving socket
+        server = listener.ListenerServer(cache_dir=os.path.join(self.folder, 'manifests'))
+        server.connection_slots.acquire()
+        thread = threading.Thread(target=server.serve_connection, args=(self.receiver, 'test'), daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        self.sender.settimeout(10)
+
+    def assert_refused(self, message):
+        frame = protocol.recv_frame(self.sender)
+        self.assertEqual(frame.command, protocol.CMD_ERROR)
+        self.assertIn(message, frame.meta['error'])
+        # The session ends after the error reply; unread request bytes make
+        # that a reset rather than a clean close
+        protocol.recv_payload(self.sender, frame)
+        try:
+            self.assertIsNone(protocol.recv_frame(self.sender))
+        except ConnectionResetError:
+            pass
+
+    def test_bad_meta(self):
+        for meta in (b'{not json', b'[1, 2]', b'\xff'):
+            with self.subTest(meta=meta):
+                sender, receiver = socket.socketpair()
+                with sender, receiver:
+                    header = protocol.HEADER.pack(protocol.MAGIC, protocol.PROTOCOL_VERSION, protocol.CMD_HELLO,
+                                                  0, 1, 0, len(meta), 0)
+                    sender.sendall(header + meta)
+                    with self.assertRaises(protocol.ProtocolError):
+                        protocol.recv_frame(receiver)
+
+    def test_bad_json_payload(self):
+        with self.assertRaises(protocol.ProtocolError):
+            protocol.decode_json(b'{"a": ')
+
+    def test_corrupt_compressed_chunk(self):
+        for codec in compression.available_codecs():
+            with self.subTest(codec=codec):
+                with self.assertRaises(protocol.ProtocolError):
+                    compression.decompress_function(codec)(b'not compressed data')
+        with self.assertRaises(protocol.ProtocolError):
+            compression.decompress_function('rot13')
+
+    def test_listener_refuses_corrupt_file(self):
+        self.serve()
+        dest = os.path.join(self.folder, 'dest.uasset')
+        protocol.send_chunked(self.sender, protocol.CMD_SYNC_FILE, dest, [b'garbage'], {'codec': 'zlib'},
+                              protocol.FLAG_COMPRESSED, request_id=3)
+        self.assert_refused('Corrupt zlib data')
+        self.assertFalse(os.path.exists(dest))
+
+    def test_listener_refuses_malformed_batch(self):
+        self.serve()
+        protocol.send_frame(self.sender, protocol.CMD_SYNC_BATCH, self.folder, {'files': [['only a path']]},
+                            request_id=4)
+        self.assert_refused('Malformed sync_batch request')
+
+
+class FileTransferTest(LoopbackTest):
+    def receive_file(self, dest_path, digest=None, mapped=False):
+        frame = protocol.recv_frame(self.receiver)
+        with open(dest_path, 'w+b' if mapped else 'wb') as f:
+            if mapped:
+                protocol.recv_into_mapped(self.receiver, f, frame.size, digest, window=64 * 1024)
+            else:
+                protocol.recv_into_file(self.receiver, f, frame.size, bytearray(4096), digest)
+        return frame
+
+    def test_send_file(self):
+        data = random_bytes(3 * 1024 * 1024 + 17)
+        source = self.write('source.uasset', data)
+        for zero_copy in (False, True):
+            for mapped in (False, True):
+                with self.subTest(zero_copy=zero_copy, mapped=mapped):
+                    self.send(protocol.send_file, protocol.CMD_SYNC_FILE, 'dest', source, {'digest': 'x'},
+                              chunk_size=65536, zero_copy=zero_copy)
+                    digest = hashing.new_hasher()
+                    dest = os.path.join(self.folder, 'dest')
+                    frame = self.receive_file(dest, digest, mapped)
+                    self.finish()
+                    self.assertEqual(frame.meta, {'digest': 'x'})
+                    with open(dest, 'rb') as f:
+                        self.assertEqual(f.read(), data)
+                    self.assertEqual(digest.hexdigest(), hashing.hash_file(source)[0])
+
+    # [user-017] A mapped receive cut short keeps only the bytes that arrived
+    def test_mapped_receive_cut_short(self):
+        protocol.send_frame(self.sender, protocol.CMD_SYNC_FILE, 'dest', payload=b'')
+        self.sender.sendall(b'x' * 1000)
+        self.sender.close()
+        dest = os.path.join(self.folder, 'dest')
+        with open(dest, 'w+b') as f, self.assertRaises(protocol.ProtocolError):
+            protocol.recv_frame(self.receiver)
+            protocol.recv_into_mapped(self.receiver, f, 100000, window=64 * 1024)
+        self.assertEqual(os.path.getsize(dest), 1000)
+
+    def test_compressed(self):
+        data = (b'Unreal config line\n' * 50000) + random_bytes(100000)
+        source = self.write('Config/Default.ini', data)
+        stats = compression.CompressionStats()
+        self.send(protocol.send_chunked, protocol.CMD_SYNC_FILE, 'dest',
+                  compression.iter_compressed(source, 'zlib', stats, chunk_size=65536),
+                  {'codec': 'zlib'}, protocol.FLAG_COMPRESSED)
+        frame = protocol.recv_frame(self.receiver)
+        self.assertTrue(frame.flags & protocol.FLAG_COMPRESSED)
+        dest = os.path.join(self.folder, 'dest')
+        with open(dest, 'wb') as f:
+            size, _ = compression.decompress_into(protocol.iter_chunks(self.receiver), f, frame.meta['codec'])
+        self.finish()
+        self.assertEqual(size, len(data))
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertLess(stats.as_dict()['bytes_out'], len(data))
+
+    def test_resume_offset(self):
+        # An interrupted transfer leaves a .part file named after the digest;
+        # the next send starts at its length and the listener hashes the
+        # prefix it already has before appending the rest
+        data = random_bytes(1024 * 1024 + 3)
+        source = self.write('source.umap', data)
+        expected = hashing.hash_file(source)[0]
+        dest = os.path.join(self.folder, 'Maps', 'dest.umap')
+        os.makedirs(os.path.dirname(dest))
+        part_path = listener.partial_path(dest, expected)
+        with open(part_path, 'wb') as f:
+            f.write(data[:300000])
+        offset = listener.resume_offset(dest, expected)
+        self.assertEqual(offset, 300000)
+        self.assertEqual(listener.resume_offset(dest, 'another digest'), 0)
+
+        self.send(protocol.send_file, protocol.CMD_SYNC_FILE, dest, source, {'offset': offset}, offset=offset)
+        frame = protocol.recv_frame(self.receiver)
+        self.assertEqual(frame.size, len(data) - offset)
+        digest = hashing.new_hasher()
+        buffer = bytearray(65536)
+        with open(part_path, 'r+b') as f:
+            listener.hash_prefix(f, frame.meta['offset'], digest, buffer)
+            protocol.recv_into_file(self.receiver, f, frame.size, buffer, digest)
+        self.finish()
+        self.assertEqual(digest.hexdigest(), expected)
+        with open(part_path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_resume_past_end(self):
+        source = self.write('short', b'abc')
+        with self.assertRaises(protocol.ProtocolError):
+            protocol.send_file(self.sender, protocol.CMD_SYNC_FILE, 'dest', source, offset=10)
+
+
+class DeltaTest(LoopbackTest):
+    BLOCK_SIZE = 4096
+
+    def round_trip(self, basis_data, new_data):
+        basis = self.write('basis', basis_data)
+        source = self.write('source', new_data)
+        table = delta.parse_signatures(delta.file_signatures(basis, self.BLOCK_SIZE))
+        ops = delta.compute_delta(source, table, self.BLOCK_SIZE)
+        size = delta.delta_size(ops)
+        self.send(protocol.send_stream, protocol.CMD_SYNC_DELTA, 'dest',
+                  delta.iter_delta(source, ops, chunk_size=1000), size)
+        frame = protocol.recv_frame(self.receiver)
+        digest = hashing.new_hasher()
+        dest = os.path.join(self.folder, 'dest')
+        with open(basis, 'rb') as basis_f, open(dest, 'wb') as out:
+            written = delta.apply_delta(self.receiver, frame.size, basis_f, out, self.BLOCK_SIZE, digest=digest)
+        self.finish()
+        self.assertEqual(written, len(new_data))
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), new_data)
+        self.assertEqual(digest.hexdigest(), hashing.hash_file(source)[0])
+        return ops
+
+    def test_changed_region(self):
+        basis = random_bytes(64 * self.BLOCK_SIZE)
+        new = basis[:10000] + random_bytes(5000, 1) + basis[10000:]
+        ops = self.round_trip(basis, new)
+        self.assertLess(delta.literal_bytes(ops), 2 * self.BLOCK_SIZE + 5000)
+
+    def test_identical(self):
+        data = random_bytes(16 * self.BLOCK_SIZE + 100)
+        ops = self.round_trip(data, data)
+        self.assertEqual(delta.literal_bytes(ops), 0)
+
+    def test_unrelated_and_empty(self):
+        self.round_trip(random_bytes(10 * self.BLOCK_SIZE), random_bytes(7 * self.BLOCK_SIZE + 1, 2))
+        self.round_trip(random_bytes(10 * self.BLOCK_SIZE), b'')
+        self.round_trip(b'', random_bytes(3 * self.BLOCK_SIZE, 3))
+
+    def test_bad_instruction(self):
+        self.sender.sendall(b'X' + bytes(20))
+        with open(self.write('basis', b''), 'rb') as basis, open(os.path.join(self.folder, 'out'), 'wb') as out:
+            with self.assertRaises(protocol.ProtocolError):
+                delta.apply_delta(self.receiver, 21, basis, out, self.BLOCK_SIZE)
+
+
+class MerkleTest(LoopbackTest):
+    def checksums(self, root):
+        result = {}
+        for directory, _, files in os.walk(root):
+            for name in files:
+                path = os.path.join(directory, name)
+                result[os.path.relpath(path, root)] = hashing.hash_file(path)[0]
+        return result
+
+    def make_project(self, root):
+        rng = random.Random(5)
+        for directory in ('Config', 'Content/Maps', 'Content/Props/Rocks', 'Source/Game', ''):
+            for i in range(3):
+                name = f'{directory}/file{i}.bin' if directory else f'file{i}.bin'
+                path = os.path.join(root, *name.split('/'))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(rng.randbytes(rng.randint(0, 2000)))
+
+    def changed_files(self, local, remote_tree):
+        # The diff stage's descent, with each level sent over the socket as
+        # the listener would answer it
+        changed = []
+        level = ['']
+        while level:
+            protocol.send_frame(self.sender, protocol.CMD_TREE,
+                                payload=protocol.encode_json(merkle.select(remote_tree, level)))
+            frame = protocol.recv_frame(self.receiver)
+            remote = protocol.decode_json(protocol.recv_payload(self.receiver, frame))
+            next_level = []
+            for directory in level:
+                node = local[directory]
+                remote_node = remote.get(directory) or merkle.new_node()
+                if node['hash'] == remote_node['hash']:
+                    continue
+                changed += [merkle.join(directory, name) for name, digest in node['files'].items()
+                            if remote_node['files'].get(name) != digest]
+                for name, subtree_hash in node['dirs'].items():
+                    if remote_node['dirs'].get(name) != subtree_hash:
+                        next_level.append(merkle.join(directory, name))
+            level = next_level
+        return sorted(changed)
+
+    def test_tree_round_trip(self):
+        source = os.path.join(self.folder, 'source')
+        dest = os.path.join(self.folder, 'dest')
+        self.make_project(source)
+        self.make_project(dest)
+        local = merkle.build_tree(self.checksums(source))
+        remote = merkle.build_tree(self.checksums(dest))
+        self.assertEqual(local['']['hash'], remote['']['hash'])
+        self.assertEqual(self.changed_files(local, remote), [])
+
+        with open(os.path.join(dest, 'Content', 'Props', 'Rocks', 'file1.bin'), 'ab') as f:
+            f.write(b'changed')
+        os.remove(os.path.join(dest, 'Config', 'file0.bin'))
+        remote = merkle.build_tree(self.checksums(dest))
+        self.assertNotEqual(local['']['hash'], remote['']['hash'])
+        self.assertEqual(local['Source']['hash'], remote['Source']['hash'])
+        self.assertEqual(self.changed_files(local, remote),
+                         ['Config/file0.bin', 'Content/Props/Rocks/file1.bin'])
+
+    def test_paths_normalized(self):
+        windows = merkle.build_tree({'Content\\Maps\\a.umap': 'd1', 'b.ini': 'd2'})
+        posix = merkle.build_tree({'Content/Maps/a.umap': 'd1', 'b.ini': 'd2'})
+        self.assertEqual(windows['']['hash'], posix['']['hash'])
+        self.assertEqual(sorted(merkle.iter_files(posix, '')), ['Content/Maps/a.umap', 'b.ini'])
+        self.assertEqual(list(merkle.iter_files(posix, '', skip={'Content'})), ['b.ini'])
+        self.assertTrue(merkle.contains('Content', 'Content/Maps'))
+        self.assertFalse(merkle.contains('Content', 'ContentExtra'))
+
+
+if __name__ == '__main__':
+    unittest.main()
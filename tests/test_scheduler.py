@@ -0,0 +1,85 @@
+import os
+import sys
+import unittest
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scheduler
+from client import Reply
+from sync_engine import DONE, Transfer
+
+
+def transfer(relative_path, size=1, mtime=0):
+    return Transfer(relative_path, relative_path, size, 'digest', None, mtime=mtime)
+
+
+def acked(meta=None):
+    future = Future()
+    future.set_result(Reply(SimpleNamespace(meta=meta or {}), b''))
+    return future
+
+
+# [user-015] Transfers leave by priority class, not walk order
+class OrderTest(unittest.TestCase):
+    def drain(self, transfer_scheduler):
+        transfer_scheduler.put(DONE)
+        names = []
+        while (item := transfer_scheduler.get()) is not DONE:
+            names.append(item.relative_path)
+        return names
+
+    def test_priority_classes(self):
+        transfer_scheduler = scheduler.TransferScheduler()
+        for name in ['Content/big.uasset', 'Source/Game.cpp', 'Config/Game.ini', 'Game.uproject']:
+            transfer_scheduler.put(transfer(name))
+        self.assertEqual(self.drain(transfer_scheduler),
+                         ['Game.uproject', 'Config/Game.ini', 'Source/Game.cpp', 'Content/big.uasset'])
+
+    def test_content_order(self):
+        files = [transfer('Content/a.uasset', 30, 3), transfer('Content/b.uasset', 10, 1),
+                 transfer('Content/c.uasset', 20, 2)]
+        for order, expected in [('size', ['b', 'c', 'a']), ('recent', ['a', 'c', 'b'])]:
+            transfer_scheduler = scheduler.TransferScheduler(order)
+            for item in files:
+                transfer_scheduler.put(item)
+            self.assertEqual([os.path.basename(name)[0] for name in self.drain(transfer_scheduler)], expected)
+
+
+# [user-015] The launchable milestone is reported once its files are acked,
+# and never for a sync that stopped early
+class LaunchableTest(unittest.TestCase):
+    def setUp(self):
+        self.announced = []
+        self.stopping = False
+        self.scheduler = scheduler.TransferScheduler(on_launchable=self.announced.append,
+                                                     stopped=lambda: self.stopping)
+
+    def test_reported_once_acked(self):
+        uproject = transfer('Game.uproject')
+        self.scheduler.put(uproject)
+        self.scheduler.put(transfer('Content/a.uasset'))
+        self.scheduler.put(DONE)
+        self.assertEqual(self.announced, [])
+        self.scheduler.track([uproject], acked())
+        self.assertEqual(len(self.announced), 1)
+        self.assertIsNotNone(self.scheduler.launchable_seconds)
+
+    def test_failed_in_batch(self):
+        uproject = transfer('Game.uproject')
+        self.scheduler.put(uproject)
+        self.scheduler.put(DONE)
+        self.scheduler.track([uproject], acked({'failed': {'Game.uproject': 'Permission denied'}}))
+        self.assertEqual(self.announced, [])
+
+    def test_not_reported_when_stopped(self):
+        # The diff stopped before it queued any launchable file
+        self.stopping = True
+        self.scheduler.put(DONE)
+        self.assertEqual(self.announced, [])
+        self.assertIsNone(self.scheduler.launchable_seconds)
+
+
+if __name__ == '__main__':
+    unittest.main()
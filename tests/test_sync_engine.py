@@ -0,0 +1,279 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import client
+import listener
+import protocol
+import sync_engine
+from hashing import HashEngine
+from sync_engine import MultiTargetSync, SyncPipeline
+
+# Whole syncs against a listener on a loopback port
+
+
+# Reads every pushed file and never acknowledges it, like a listener whose
+# disk has stopped responding
+class SilentListener(listener.ListenerServer):
+    def receive_file(self, session, frame):
+        protocol.discard_frame(session.conn, frame, session.buffer)
+
+
+class SyncTest(unittest.TestCase):
+    listener_class = listener.ListenerServer
+
+    def setUp(self):
+        # Listener threads outlive the test and may still be saving their caches
+        self.tmp = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        self.source = os.path.join(self.tmp.name, 'source')
+        self.destination = os.path.join(self.tmp.name, 'destination')
+        self.server = self.start_listener(self.listener_class, '127.0.0.1', 0)
+        self.log = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def start_listener(self, listener_class, host, port):
+        server = listener_class(host, port, cache_dir=os.path.join(self.tmp.name, f'listener-{host}'))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.assertTrue(server.ready.wait(10))
+        return server
+
+    def write(self, relative_path, data):
+        path = os.path.join(self.source, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def pipeline(self, **options):
+        options.setdefault('cache_dir', os.path.join(self.tmp.name, 'sender'))
+        return SyncPipeline('127.0.0.1', self.source, self.destination, HashEngine(), port=self.server.port,
+                            log=self.log.append, **options)
+
+
+class SyncPipelineTest(SyncTest):
+    def test_sync(self):
+        self.write('Game.uproject', b'{}')
+        self.write(os.path.join('Content', 'a.uasset'), b'a' * 1000)
+        summary = self.pipeline().run()
+        self.assertEqual((summary['sent'], summary['failed'], summary['errors']), (2, 0, []))
+        with open(os.path.join(self.destination, 'Content', 'a.uasset'), 'rb') as f:
+            self.assertEqual(f.read(), b'a' * 1000)
+
+    # [user-008] A file the walk cannot stat is skipped, not fatal
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'needs symlinks')
+    def test_broken_symlink(self):
+        self.write(os.path.join('Content', 'a.uasset'), b'a')
+        os.symlink(os.path.join(self.source, 'gone'), os.path.join(self.source, 'Content', 'broken.uasset'))
+        summary = self.pipeline().run()
+        self.assertEqual((summary['sent'], summary['errors']), (1, []))
+        self.assertTrue(any(line.startswith('Error reading') for line in self.log))
+
+
+    # [user-015] The launchable milestone is reported only for files the
+    # listener acknowledged, and not at all when a stage fails
+    def test_launchable(self):
+        self.write('Game.uproject', b'{}')
+        launched = []
+        summary = self.pipeline(on_launchable=lambda target, seconds: launched.append(target)).run()
+        self.assertEqual(launched, [f'127.0.0.1:{self.destination}'])
+        self.assertIsNotNone(summary['launchable_seconds'])
+
+    def test_no_launchable_after_failed_stage(self):
+        self.write('Game.uproject', b'{}')
+        launched = []
+        def diff(pipeline, run):
+            raise RuntimeError('diff failed')
+
+        with mock.patch.object(SyncPipeline, 'diff', diff):
+            summary = self.pipeline(on_launchable=lambda target, seconds: launched.append(target)).run()
+        self.assertEqual(summary['errors'], ['diff failed'])
+        self.assertEqual(launched, [])
+        self.assertIsNone(summary['launchable_seconds'])
+
+
+    # [user-010] Compressible files travel compressed when both sides agree on a codec
+    def test_compressed(self):
+        data = b'[Section]\nKey=Value\n' * 20000
+        self.write(os.path.join('Config', 'Game.ini'), data)
+        summary = self.pipeline(codecs=['zlib'], batch_size=0).run()
+        self.assertEqual((summary['sent'], summary['compression']['files']), (1, 1))
+        self.assertLess(summary['wire_bytes'], len(data) // 2)
+        with open(os.path.join(self.destination, 'Config', 'Game.ini'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+
+    def tree(self, folder):
+        files = {}
+        for root, _, names in os.walk(folder):
+            for name in names:
+                with open(os.path.join(root, name), 'rb') as f:
+                    files[os.path.relpath(os.path.join(root, name), folder)] = f.read()
+        return files
+
+    # [user-012] Changed subtrees are found by comparing hash trees, and with
+    # streaming on they are compared as soon as the walk finishes them
+    def test_tree_diff(self):
+        for folder in ['Maps', 'Props', 'Characters', 'Audio']:
+            for i in range(3):
+                self.write(os.path.join('Content', folder, f'{i}.uasset'), f'{folder}{i}'.encode('ascii'))
+        self.assertEqual(self.pipeline().run()['sent'], 12)
+
+        self.write(os.path.join('Content', 'Maps', '0.uasset'), b'changed map')
+        self.write(os.path.join('Content', 'Audio', '2.uasset'), b'changed audio')
+        self.write(os.path.join('Content', 'Audio', 'new.uasset'), b'new')
+        with mock.patch.object(sync_engine, 'STREAM_DIFF_BYTES', 1), \
+                mock.patch.object(sync_engine, 'STREAM_DIFF_MIN_FILE', 1):
+            summary = self.pipeline().run()
+        self.assertEqual((summary['sent'], summary['failed']), (3, 0))
+        self.assertEqual(self.tree(self.destination), self.tree(self.source))
+
+        self.log.clear()
+        self.assertEqual(self.pipeline().run()['sent'], 0)
+        self.assertTrue(any(line.startswith('Compared checksum trees in 1 round trips') for line in self.log))
+
+
+    # [user-013] Content the listener already holds under another path is
+    # copied there instead of sent again
+    def test_dedup(self):
+        data = random.Random(13).randbytes(sync_engine.DEDUP_MIN_SIZE * 2)
+        self.write(os.path.join('Content', 'a.uasset'), data)
+        self.assertEqual(self.pipeline().run()['sent'], 1)
+        self.write(os.path.join('Content', 'Moved', 'b.uasset'), data)
+        summary = self.pipeline().run()
+        self.assertEqual((summary['sent'], summary['dedup_files'], summary['wire_bytes']), (1, 1, 0))
+        self.assertEqual(self.tree(self.destination), self.tree(self.source))
+
+    def test_no_dedup_from_a_changed_copy(self):
+        # The listener only copies from files still matching its index
+        data = random.Random(13).randbytes(sync_engine.DEDUP_MIN_SIZE * 2)
+        self.write(os.path.join('Content', 'a.uasset'), data)
+        self.pipeline().run()
+        with open(os.path.join(self.destination, 'Content', 'a.uasset'), 'ab') as f:
+            f.write(b'edited on the listener')
+        shutil.copy(os.path.join(self.source, 'Content', 'a.uasset'), os.path.join(self.source, 'Content', 'b.uasset'))
+        summary = self.pipeline().run()
+        self.assertEqual((summary['dedup_files'], summary['failed']), (0, 0))
+        self.assertEqual(self.tree(self.destination), self.tree(self.source))
+
+
+    # [user-014] Small files share batch frames; a file the listener cannot
+    # write fails on its own
+    def test_batches(self):
+        for i in range(40):
+            self.write(os.path.join('Content', f'{i}.uasset'), b'x' * i)
+        os.makedirs(os.path.join(self.destination, 'Content', '7.uasset', 'in the way'))
+        summary = self.pipeline(transfer_workers=1).run()
+        self.assertEqual((summary['sent'], summary['failed'], summary['batch_files']), (39, 1, 39))
+        self.assertGreaterEqual(summary['batches'], 1)
+        with open(os.path.join(self.destination, 'Content', '39.uasset'), 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 39)
+
+
+    # [user-017] Large files go out with sendfile or buffered writes and land
+    # through the listener's memory-mapped receive path
+    def test_zero_copy_and_mapped(self):
+        data = random.Random(17).randbytes(1024 * 1024 + 3)
+        with mock.patch.object(listener, 'MAPPED_MIN_SIZE', 64 * 1024):
+            for zero_copy in (True, False):
+                with self.subTest(zero_copy=zero_copy):
+                    self.write(os.path.join('Content', 'big.uasset'), data + bytes([zero_copy]))
+                    summary = self.pipeline(zero_copy=zero_copy).run()
+                    self.assertEqual((summary['sent'], summary['failed']), (1, 0))
+                    self.assertEqual(self.tree(self.destination), self.tree(self.source))
+
+
+# Refuses every delta, as if the file changed on the listener since it
+# described it
+class DeltaRefusingListener(listener.ListenerServer):
+    def receive_delta(self, session, frame):
+        protocol.discard_payload(session.conn, frame.size, session.buffer)
+        session.reply(protocol.CMD_ERROR, frame, {'error': 'Delta result digest mismatch'})
+
+
+# [user-016] A refused delta is resent whole and says so in plain words
+class DeltaFallbackTest(SyncTest):
+    listener_class = DeltaRefusingListener
+
+    def test_refused_delta(self):
+        path = os.path.join('Content', 'a.uasset')
+        self.write(path, b'x' * 65536)
+        self.assertEqual(self.pipeline().run()['sent'], 1)
+        self.write(path, b'x' * 32768 + b'changed' + b'x' * 32768)
+        summary = self.pipeline(delta_threshold=1, block_size=4096, batch_size=0).run()
+        self.assertEqual((summary['sent'], summary['failed']), (1, 0))
+        self.assertIn(f'Patching {path} failed (Delta result digest mismatch), sending the whole file', self.log)
+        with open(os.path.join(self.destination, path), 'rb') as f:
+            self.assertEqual(len(f.read()), 65536 + 7)
+
+
+# [user-016] Every acknowledgement is waited for through the session, so a
+# listener that stops answering neither outlasts a cancel nor hangs the sync
+class UnansweredAckTest(SyncTest):
+    listener_class = SilentListener
+
+    def setUp(self):
+        super().setUp()
+        for name in 'abc':
+            self.write(os.path.join('Content', f'{name}.uasset'), name.encode('ascii') * 1000)
+
+    def test_reply_timeout_fails_the_sync(self):
+        with mock.patch.object(client, 'REPLY_TIMEOUT', 1):
+            started = time.monotonic()
+            summary = self.pipeline(batch_size=0, transfer_workers=1).run()
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual((summary['sent'], summary['failed']), (0, 3))
+        self.assertEqual(len(summary['errors']), 1)
+        self.assertIn('did not answer', summary['errors'][0])
+
+    def test_cancel_ends_the_wait(self):
+        cancel = threading.Event()
+        threading.Timer(1, cancel.set).start()
+        started = time.monotonic()
+        summary = self.pipeline(batch_size=0, transfer_workers=1, cancel=cancel).run()
+        self.assertLess(time.monotonic() - started, client.REPLY_TIMEOUT)
+        self.assertTrue(summary['cancelled'])
+        self.assertEqual(summary['sent'], 0)
+
+
+# [user-011] A fan-out sync where one node stops acknowledging its files
+class MultiTargetSyncTest(SyncTest):
+    def test_hung_node_fails_alone(self):
+        self.start_listener(SilentListener, '127.0.0.2', self.server.port)
+        for name in 'abc':
+            self.write(os.path.join('Content', f'{name}.uasset'), name.encode('ascii') * 1000)
+        fan_out = MultiTargetSync(['127.0.0.1', '127.0.0.2'], self.source, self.destination, HashEngine(),
+                                  port=self.server.port, cache_dir=os.path.join(self.tmp.name, 'sender'),
+                                  batch_size=0, log=self.log.append)
+        with mock.patch.object(client, 'REPLY_TIMEOUT', 1):
+            started = time.monotonic()
+            summary = fan_out.run()
+        self.assertLess(time.monotonic() - started, 10)
+        healthy, hung = summary['nodes']['127.0.0.1'], summary['nodes']['127.0.0.2']
+        self.assertEqual((healthy['sent'], healthy['failed'], healthy['errors']), (3, 0, []))
+        self.assertEqual((hung['sent'], hung['failed']), (0, 3))
+        self.assertEqual([e.split(':')[0] for e in summary['errors']], ['127.0.0.2'])
+        self.assertTrue(any(line.startswith('  127.0.0.2: FAILED') for line in self.log))
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'needs symlinks')
+    def test_broken_symlink(self):
+        self.start_listener(listener.ListenerServer, '127.0.0.2', self.server.port)
+        self.write(os.path.join('Content', 'a.uasset'), b'a')
+        os.symlink(os.path.join(self.source, 'gone'), os.path.join(self.source, 'Content', 'broken.uasset'))
+        summary = MultiTargetSync(['127.0.0.1', '127.0.0.2'], self.source, self.destination, HashEngine(),
+                                  port=self.server.port, cache_dir=os.path.join(self.tmp.name, 'sender'),
+                                  log=self.log.append).run()
+        self.assertEqual((summary['sent'], summary['errors']), (2, []))
+        self.assertTrue(any(line.startswith('Error reading') for line in self.log))
+
+
+if __name__ == '__main__':
+    unittest.main()